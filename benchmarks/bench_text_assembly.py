@@ -0,0 +1,81 @@
+"""全文拼接与页码定位的微基准
+
+对比原先 extract_text_from_pdf 的做法（逐页 text += ...，再对整篇做一次 \\s+ 替换，
+定位页码时回头扫描 "--- Page N ---" 标记）与现在的逐页清理 + 一次 join + PageMap 二分查找。
+
+用法：python benchmarks/bench_text_assembly.py [页数] [每页字符数]
+"""
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.page_map import PageMap  # noqa: E402
+from utils.pdf_extract import assemble_text  # noqa: E402
+
+_PAGE_MARKER_RE = re.compile(r"--- Page (\d+) ---")
+
+
+def make_pages(page_count, page_chars, seed=0):
+    """生成带换行和连续空白的合成页面文本，模拟 pypdf 的输出"""
+    rng = random.Random(seed)
+    words = "model data learning neural network training accuracy method results baseline transformer attention 注意力 模型".split()
+    pages = []
+    for _ in range(page_count):
+        parts, length = [], 0
+        while length < page_chars:
+            word = rng.choice(words)
+            parts.append(word + rng.choice([" ", " ", " ", "\n", "  ", " \n "]))
+            length += len(parts[-1])
+        pages.append("".join(parts))
+    return pages
+
+
+def legacy_assemble(pages):
+    """原先的实现：重复字符串拼接后整篇折叠空白"""
+    text = ""
+    for page_num, page_text in enumerate(pages):
+        text += f"\n--- Page {page_num + 1} ---\n{page_text}\n"
+    text = re.sub(r"\s+", " ", text)
+    return text.strip()
+
+
+def legacy_page_of(text, position):
+    """原先只能回头扫描页标记来确定页码"""
+    page = 1
+    for match in _PAGE_MARKER_RE.finditer(text, 0, position + 1):
+        page = int(match.group(1))
+    return page
+
+
+def best_of(stmt, number, repeat=5):
+    return min(timeit.repeat(stmt, number=number, repeat=repeat)) / number
+
+
+def main():
+    page_count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    page_chars = int(sys.argv[2]) if len(sys.argv) > 2 else 3000
+    pages = make_pages(page_count, page_chars)
+
+    text, page_offsets = assemble_text(pages)
+    assert text == legacy_assemble(pages), "逐页清理的结果应与整篇折叠空白完全一致"
+    page_map = PageMap(page_offsets, len(text))
+
+    print(f"{page_count} 页，每页约 {page_chars} 字符，全文 {len(text)} 字符")
+    legacy = best_of(lambda: legacy_assemble(pages), number=3)
+    current = best_of(lambda: assemble_text(pages), number=3)
+    print(f"拼接 + 清理：原实现 {legacy * 1000:.1f} ms，逐页清理 + join {current * 1000:.1f} ms")
+
+    positions = random.Random(1).sample(range(len(text)), 200)
+    assert all(page_map.page_of(p) == legacy_page_of(text, p) for p in positions[:20])
+    legacy = best_of(lambda: [legacy_page_of(text, p) for p in positions], number=1)
+    current = best_of(lambda: [page_map.page_of(p) for p in positions], number=100)
+    print(f"定位 {len(positions)} 个位置的页码：扫描页标记 {legacy * 1000:.2f} ms，PageMap 二分查找 {current * 1000:.3f} ms")
+    print(f"页码映射占用：{page_map.offsets.itemsize * len(page_map)} 字节（{len(page_map)} 页）")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,13 @@
 import streamlit as st
-from openai import OpenAI
+from utils.async_runner import get_async_runner
+from utils.chunked_polish import polish_chunks, reassemble, split_draft, with_neighbour_context
+from utils.llm import format_cache_stats, format_stream_stats, stream_chat_completion
+from utils.llm_client import DEFAULT_BASE_URL, get_shared_client
+from utils.resilience import format_upstream_health
+from utils.tokenizer import estimate_tokens
+
+# 提示词模板版本（修改提示词后递增，使旧的补全缓存失效）
+PROMPT_VERSION = "v1"
 
 # 侧边栏配置区域
 st.sidebar.markdown("### 🔑 API 配置")
@@ -41,20 +49,22 @@ def get_valid_api_key():
     except KeyError:
         return None
 
+def get_final_base_url():
+    """获取实际使用的 Base URL（后台并发调用与共享客户端使用同一地址）"""
+    return user_base_url.strip() if user_base_url and user_base_url.strip() else DEFAULT_BASE_URL
+
 # 初始化 OpenAI 客户端
 def get_client():
-    """获取配置好的 OpenAI 客户端"""
+    """获取配置好的 OpenAI 客户端（进程内共享连接池）"""
     final_api_key = get_valid_api_key()
-    final_base_url = user_base_url.strip() if user_base_url and user_base_url.strip() else "https://api.deepseek.com"
+    final_base_url = get_final_base_url()
 
     if not final_api_key:
         return None, "请输入 API Key 或确保系统配置了默认 Key"
 
     try:
-        client = OpenAI(
-            api_key=final_api_key,
-            base_url=final_base_url
-        )
+        # 复用进程级共享客户端，保持 keep-alive 连接
+        client = get_shared_client(final_api_key, final_base_url)
         return client, None
     except Exception as e:
         return None, f"初始化客户端失败：{str(e)}"
@@ -109,6 +119,44 @@ elif "Humanize" in mode:
 else:
     mode_type = "style_mimic"
 
+# 侧边栏高级设置
+st.sidebar.markdown("### ⚙️ 高级设置")
+temperature = st.sidebar.slider(
+    "创造性 (Temperature):",
+    min_value=0.0,
+    max_value=1.0,
+    value=0.3 if mode_type == "standard" else 0.5,
+    step=0.1,
+    help="控制输出的创造性，数值越高越有创意"
+)
+
+max_tokens = st.sidebar.slider(
+    "最大长度 (Tokens):",
+    min_value=500,
+    max_value=4000,
+    value=3000,
+    step=100,
+    help="限制生成文本的最大长度"
+)
+
+chunk_tokens = st.sidebar.slider(
+    "长文档分段 (Tokens):",
+    min_value=300,
+    max_value=2000,
+    value=800,
+    step=100,
+    help="超过该长度的文本按段落 / 句子切分成多段并发处理，每段附带前后文以保持连贯"
+)
+
+fresh_generation = st.sidebar.checkbox(
+    "🔄 重新生成（跳过补全缓存）",
+    value=False,
+    help="相同的文本和设置默认直接返回上次的结果；勾选后重新调用模型，得到新的改写"
+)
+
+# 长文档每段附带的前后文长度
+NEIGHBOUR_CONTEXT_TOKENS = 150
+
 # 动态显示模式说明
 mode_descriptions = {
     "standard": "📝 **标准学术润色**：优化语法、提升表达规范性、改善句子结构",
@@ -129,6 +177,12 @@ input_text = st.text_area(
     help="请输入需要处理的学术论文段落、摘要或其他文本"
 )
 
+# 长文档模式：一次请求的输出会被 max_tokens 截断，且只能串行生成，改为分段并发处理
+input_tokens = estimate_tokens(input_text.strip())
+draft_chunks = split_draft(input_text.strip(), chunk_tokens) if input_tokens > chunk_tokens else []
+if len(draft_chunks) > 1:
+    st.caption(f"📄 长文档：约 {input_tokens} tokens，将按段落切分为 {len(draft_chunks)} 段并发处理（每段附带前后文以保持连贯），完成后按原顺序拼接")
+
 # 参考文本（仅风格仿写模式需要）
 reference_text = ""
 if mode_type == "style_mimic":
@@ -257,117 +311,151 @@ if st.button("🚀 开始润色", type="primary"):
         system_prompt = get_system_prompt(mode_type, additional_config)
         user_prompt = build_user_prompt(mode_type, input_text, reference_text, additional_config)
 
-        # 显示加载动画
-        with st.spinner(f"正在进行{mode}处理，请稍候..."):
-            try:
-                # 调用 API
-                response = client.chat.completions.create(
-                    model=model_name,
+        try:
+            if len(draft_chunks) > 1:
+                # 各段提示词与单次润色相同，只是加上相邻段落的原文作为上下文
+                message_lists = [
+                    [
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": with_neighbour_context(
+                            build_user_prompt(mode_type, chunk.text, reference_text, additional_config),
+                            draft_chunks, i, NEIGHBOUR_CONTEXT_TOKENS
+                        )}
+                    ]
+                    for i, chunk in enumerate(draft_chunks)
+                ]
+                user_prompt = message_lists[0][1]["content"]
+
+                st.markdown("### 📄 处理结果")
+                progress_bar = st.progress(0.0, text=f"正在分段处理（共 {len(draft_chunks)} 段）...")
+
+                def update_progress(done, total):
+                    progress_bar.progress(done / total, text=f"正在分段处理...（{done}/{total} 段）")
+
+                results = polish_chunks(
+                    get_async_runner(), get_valid_api_key(), get_final_base_url(), model_name,
+                    message_lists,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    prompt_version=PROMPT_VERSION,
+                    labels={"page": "text_polisher", "mode": f"{mode_type}_chunked"},
+                    on_progress=update_progress,
+                    use_cache=not fresh_generation
+                )
+                progress_bar.empty()
+
+                failed = [result for result in results if not isinstance(result, str)]
+                if len(failed) == len(results):
+                    raise failed[0]
+                result_text = reassemble(draft_chunks, results)
+
+                st.text_area(
+                    "润色后的文本：",
+                    value=result_text,
+                    height=400,
+                    disabled=True
+                )
+                st.caption(f"🧩 全文分为 {len(draft_chunks)} 段并发处理后按原顺序拼接")
+                if failed:
+                    st.warning(f"⚠️ 有 {len(failed)} 段处理失败，这些段落保留了原文")
+            else:
+                # 调用 API（流式输出，边生成边显示）
+                stream = stream_chat_completion(
+                    client,
+                    model_name,
                     messages=[
                         {"role": "system", "content": system_prompt},
                         {"role": "user", "content": user_prompt}
                     ],
-                    max_tokens=3000,
-                    temperature=0.3 if mode_type == "standard" else 0.5
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    prompt_version=PROMPT_VERSION,
+                    use_cache=not fresh_generation,
+                    labels={"page": "text_polisher", "mode": mode_type}
                 )
 
-                # 获取结果
-                result_text = response.choices[0].message.content.strip()
+                st.markdown("### 📄 处理结果")
+                result_placeholder = st.empty()
+                with result_placeholder.container():
+                    st.write_stream(stream)
 
-                # 显示成功消息
-                st.success("润色完成！")
+                # 获取结果
+                result_text = stream.text
 
-                # 显示结果
-                st.markdown("### 📄 处理结果")
-                result_display = st.text_area(
+                # 生成结束后替换为只读文本框
+                result_placeholder.text_area(
                     "润色后的文本：",
                     value=result_text,
                     height=200,
                     disabled=True
                 )
+                st.caption(format_stream_stats(stream))
+
+            # 显示成功消息
+            st.success("润色完成！")
+
+            # 对比显示
+            st.markdown("### 📊 对比分析")
+            if mode_type == "style_mimic":
+                tab1, tab2, tab3 = st.tabs(["原文", "参考风格", "润色后"])
+
+                with tab1:
+                    st.markdown("**原文：**")
+                    st.info(input_text)
+
+                with tab2:
+                    st.markdown("**参考文本：**")
+                    st.warning(reference_text)
+
+                with tab3:
+                    st.markdown("**仿写结果：**")
+                    st.success(result_text)
+            else:
+                tab1, tab2 = st.tabs(["原文", "润色后"])
+
+                with tab1:
+                    st.markdown("**原文：**")
+                    st.info(input_text)
+
+                with tab2:
+                    if mode_type == "humanize":
+                        st.markdown("**去 AI 痕迹后：**")
+                    else:
+                        st.markdown("**润色后：**")
+                    st.success(result_text)
+
+            # 操作按钮
+            col_download, col_copy = st.columns(2)
+
+            with col_download:
+                suffix = "_style_mimic" if mode_type == "style_mimic" else "_humanized" if mode_type == "humanize" else "_polished"
+                st.download_button(
+                    "📥 下载结果",
+                    data=result_text,
+                    file_name=f"academic_text{suffix}.txt",
+                    mime="text/plain"
+                )
 
-                # 对比显示
-                st.markdown("### 📊 对比分析")
-                if mode_type == "style_mimic":
-                    tab1, tab2, tab3 = st.tabs(["原文", "参考风格", "润色后"])
-
-                    with tab1:
-                        st.markdown("**原文：**")
-                        st.info(input_text)
-
-                    with tab2:
-                        st.markdown("**参考文本：**")
-                        st.warning(reference_text)
-
-                    with tab3:
-                        st.markdown("**仿写结果：**")
-                        st.success(result_text)
-                else:
-                    tab1, tab2 = st.tabs(["原文", "润色后"])
-
-                    with tab1:
-                        st.markdown("**原文：**")
-                        st.info(input_text)
-
-                    with tab2:
-                        if mode_type == "humanize":
-                            st.markdown("**去 AI 痕迹后：**")
-                        else:
-                            st.markdown("**润色后：**")
-                        st.success(result_text)
-
-                # 操作按钮
-                col_download, col_copy = st.columns(2)
-
-                with col_download:
-                    suffix = "_style_mimic" if mode_type == "style_mimic" else "_humanized" if mode_type == "humanize" else "_polished"
-                    st.download_button(
-                        "📥 下载结果",
-                        data=result_text,
-                        file_name=f"academic_text{suffix}.txt",
-                        mime="text/plain"
-                    )
-
-                with col_copy:
-                    st.code(result_text, language=None)
-
-                # 显示完整提示词（学习用途）
-                with st.expander("🔍 查看发送给 AI 的完整提示词"):
-                    st.markdown("##### System Prompt:")
-                    st.code(system_prompt, language=None)
-
-                    st.markdown("##### User Prompt:")
-                    st.code(user_prompt, language=None)
-
-                    st.caption("💡 提示：你可以学习这些提示词的写法，用于自己的项目中！")
-
-            except Exception as e:
-                # 显示错误信息
-                st.error(f"调用 API 时出现错误：{str(e)}")
-                st.info("请检查网络连接、API Key 配置或稍后重试。")
+            with col_copy:
+                st.code(result_text, language=None)
 
-    else:
-        st.warning("请先输入需要润色的文本！")
+            # 显示完整提示词（学习用途）
+            with st.expander("🔍 查看发送给 AI 的完整提示词"):
+                st.markdown("##### System Prompt:")
+                st.code(system_prompt, language=None)
 
-# 侧边栏高级设置
-st.sidebar.markdown("### ⚙️ 高级设置")
-temperature = st.sidebar.slider(
-    "创造性 (Temperature):",
-    min_value=0.0,
-    max_value=1.0,
-    value=0.3 if mode_type == "standard" else 0.5,
-    step=0.1,
-    help="控制输出的创造性，数值越高越有创意"
-)
+                st.markdown("##### User Prompt:" if len(draft_chunks) <= 1 else f"##### User Prompt（第 1/{len(draft_chunks)} 段）:")
+                st.code(user_prompt, language=None)
 
-max_tokens = st.sidebar.slider(
-    "最大长度 (Tokens):",
-    min_value=500,
-    max_value=4000,
-    value=2000,
-    step=100,
-    help="限制生成文本的最大长度"
-)
+                st.caption("💡 提示：你可以学习这些提示词的写法，用于自己的项目中！")
+
+        except Exception as e:
+            # 显示错误信息
+            st.error(f"调用 API 时出现错误：{str(e)}")
+            st.info("请检查网络连接、API Key 配置或稍后重试。")
+
+    else:
+        st.warning("请先输入需要润色的文本！")
 
 # 显示当前配置
 st.sidebar.markdown("---")
@@ -376,6 +464,7 @@ st.sidebar.write(f"**功能模式**: {mode}")
 st.sidebar.write(f"**模型**: {model_name}")
 st.sidebar.write(f"**Temperature**: {temperature}")
 st.sidebar.write(f"**Max Tokens**: {max_tokens}")
+st.sidebar.write(f"**补全缓存**: {format_cache_stats()}")
 
 if mode_type == "standard":
     st.sidebar.write(f"**文本类型**: {text_type}")
@@ -426,6 +515,7 @@ st.sidebar.markdown("### 📊 连接状态")
 if get_valid_api_key():
     st.sidebar.success("✅ API Key 已配置")
     st.sidebar.write(f"🔗 Base URL: {user_base_url if user_base_url else 'https://api.deepseek.com'}")
+    st.sidebar.write(f"🩺 上游状态: {format_upstream_health(user_base_url.strip() if user_base_url else DEFAULT_BASE_URL)}")
 else:
     st.sidebar.warning("⚠️ 需要配置 API Key")
     st.sidebar.info("请在左侧输入 API Key")
@@ -1,8 +1,27 @@
 import streamlit as st
-from openai import OpenAI
-from pypdf import PdfReader
-import io
-import re
+from utils.async_runner import get_async_runner
+from utils.chat_memory import ConversationMemory, summarize_turns
+from utils.llm import format_cache_stats, format_stream_stats, stream_chat_completion
+from utils.llm_client import DEFAULT_BASE_URL, get_shared_client
+from utils.paper_library import get_paper_library
+from utils.pdf_cache import hash_pdf_bytes
+from utils.pdf_ingest import start_ingest_job
+from utils.pdf_sandbox import (
+    FAILURE_CORRUPT, FAILURE_CRASHED, FAILURE_ENCRYPTED, FAILURE_MEMORY, FAILURE_SCANNED, FAILURE_TIMEOUT
+)
+from utils.references import ReferenceTable, format_reference_note, parse_references
+from utils.resilience import format_upstream_health
+from utils.retrieval import get_chunk_index, reciprocal_rank_fusion
+from utils.sections import SECTION_LABELS, PaperSections, remove_sections, sections_for_question
+from utils.session import get_session_id
+from utils.text_store import get_text_store
+from utils.summarizer import combine_notes, label_notes, map_sections, split_by_pages
+from utils.token_budget import get_context_window, plan_document_budget
+from utils.tokenizer import estimate_messages_tokens, estimate_tokens, truncate_to_tokens
+from utils.vector_index import get_vector_store
+
+# 提示词模板版本（修改提示词后递增，使旧的补全缓存失效）
+PROMPT_VERSION = "v3"
 
 # 设置页面配置
 st.set_page_config(
@@ -53,22 +72,24 @@ def get_valid_api_key():
 
 # 初始化 OpenAI 客户端
 def get_client():
-    """获取配置好的 OpenAI 客户端"""
+    """获取配置好的 OpenAI 客户端（进程内共享连接池）"""
     final_api_key = get_valid_api_key()
-    final_base_url = user_base_url.strip() if user_base_url and user_base_url.strip() else "https://api.deepseek.com"
+    final_base_url = user_base_url.strip() if user_base_url and user_base_url.strip() else DEFAULT_BASE_URL
 
     if not final_api_key:
         return None, "请输入 API Key 或确保系统配置了默认 Key"
 
     try:
-        client = OpenAI(
-            api_key=final_api_key,
-            base_url=final_base_url
-        )
+        # 复用进程级共享客户端，保持 keep-alive 连接
+        client = get_shared_client(final_api_key, final_base_url)
         return client, None
     except Exception as e:
         return None, f"初始化客户端失败：{str(e)}"
 
+def get_final_base_url():
+    """获取实际使用的 Base URL（后台并发调用与共享客户端使用同一地址）"""
+    return user_base_url.strip() if user_base_url and user_base_url.strip() else DEFAULT_BASE_URL
+
 # API 配置状态显示
 api_status_col, api_key_info_col = st.sidebar.columns([1, 2])
 with api_status_col:
@@ -87,6 +108,44 @@ with api_key_info_col:
 
 st.sidebar.markdown("---")
 
+# 侧边栏高级设置
+st.sidebar.markdown("### ⚙️ 高级设置")
+temperature = st.sidebar.slider(
+    "创造性 (Temperature):",
+    min_value=0.0,
+    max_value=1.0,
+    value=0.3,
+    step=0.1,
+    help="控制回答的创造性，学术分析建议保持较低值"
+)
+
+max_tokens = st.sidebar.slider(
+    "最大长度 (Tokens):",
+    min_value=500,
+    max_value=4000,
+    value=2000,
+    step=100,
+    help="限制生成内容的最大长度"
+)
+
+memory_budget_tokens = st.sidebar.slider(
+    "对话记忆预算 (Tokens):",
+    min_value=500,
+    max_value=6000,
+    value=2000,
+    step=500,
+    help="论文对话时随请求发送的历史上限，较早的轮次会被压缩成摘要"
+)
+
+retrieval_top_k = st.sidebar.slider(
+    "检索片段数 (Top-K):",
+    min_value=2,
+    max_value=12,
+    value=6,
+    step=1,
+    help="论文对话时只发送与问题最相关的 K 个片段"
+)
+
 # 页面标题
 st.title("📚 沉浸式文献速读")
 st.markdown("---")
@@ -104,10 +163,17 @@ st.markdown("""
 # 初始化 session_state
 if "messages" not in st.session_state:
     st.session_state.messages = []
-if "pdf_text" not in st.session_state:
-    st.session_state.pdf_text = ""
 if "pdf_filename" not in st.session_state:
     st.session_state.pdf_filename = ""
+if "pdf_hash" not in st.session_state:
+    st.session_state.pdf_hash = ""
+if "pdf_upload_id" not in st.session_state:
+    st.session_state.pdf_upload_id = ""
+if "pdf_ingest_job" not in st.session_state:
+    st.session_state.pdf_ingest_job = None
+if "chat_memory" not in st.session_state:
+    st.session_state.chat_memory = ConversationMemory(memory_budget_tokens)
+st.session_state.chat_memory.budget_tokens = memory_budget_tokens
 
 # 文件上传区
 st.markdown("### 📁 文件上传")
@@ -117,64 +183,403 @@ uploaded_file = st.file_uploader(
     help="上传需要阅读的学术论文 PDF 文件"
 )
 
-# PDF 文本提取函数
-def extract_text_from_pdf(uploaded_file):
-    """从上传的 PDF 文件中提取文本"""
-    try:
-        pdf_reader = PdfReader(uploaded_file)
-        text = ""
-        page_count = len(pdf_reader.pages)
+# 解析进度刷新间隔（秒）
+INGEST_POLL_SECONDS = 1.0
+
+# 问到引用时随问题附带的参考文献条目上限
+REFERENCE_NOTE_MAX_TOKENS = 1500
+
+# 按失败类型给出的解析失败提示
+PARSE_FAILURE_MESSAGES = {
+    FAILURE_ENCRYPTED: "🔒 PDF 已加密，无法提取文本，请移除打开密码后重新上传",
+    FAILURE_SCANNED: "🖼️ PDF 中几乎没有可提取的文字，可能是扫描件，请先进行 OCR 后再上传",
+    FAILURE_CORRUPT: "❌ PDF 文件已损坏或格式不正确，无法解析",
+    FAILURE_TIMEOUT: "⏱️ PDF 解析超时",
+    FAILURE_MEMORY: "💾 PDF 解析占用的内存超出上限",
+    FAILURE_CRASHED: "💥 PDF 解析进程异常退出",
+}
+
+def open_paper(parsed, filename):
+    """把已解析好的论文设为当前论文
+
+    完整文本放入进程级共享的文本存储（发送前再按模型上下文预算截取），会话中只保存内容哈希。
+    """
+    st.session_state.pdf_hash = get_text_store().put(parsed)
+    st.session_state.pdf_filename = filename
+    st.session_state.pdf_ingest_job = None
+
+def show_parsed_result(parsed, from_cache=False):
+    """显示解析结果和文本预览"""
+    st.success(f"✅ 成功提取 {parsed.page_count} 页，共 {len(parsed.text)} 字符（约 {estimate_tokens(parsed.text)} tokens）" + ("，⚡ 命中解析缓存" if from_cache else ""))
+    if parsed.boilerplate and parsed.boilerplate["lines"]:
+        st.caption(f"🧹 已去除 {parsed.boilerplate['lines']} 行跨页重复的页眉页脚（期刊名、页码、版权声明等），全文减少约 {parsed.boilerplate['tokens']} tokens")
+
+    with st.expander("📋 文本预览"):
+        preview_text = parsed.text[:1000] + "..." if len(parsed.text) > 1000 else parsed.text
+        st.text_area("PDF 文本预览:", preview_text, height=200, disabled=True)
+
+@st.fragment(run_every=INGEST_POLL_SECONDS)
+def show_ingest_progress(job):
+    """后台解析进行中时定时刷新进度和预览，解析完成后刷新整个页面"""
+    if job.done:
+        st.rerun()
+
+    pages_done = job.pages_done
+    if job.page_count:
+        st.progress(pages_done / job.page_count, text=f"正在解析 PDF 文件...（{pages_done}/{job.page_count} 页）")
+    else:
+        st.progress(0.0, text="正在解析 PDF 文件...")
 
-        # 提取每页文本
-        for page_num, page in enumerate(pdf_reader.pages):
-            page_text = page.extract_text()
-            text += f"\n--- Page {page_num + 1} ---\n{page_text}\n"
+    if pages_done:
+        st.caption(f"💡 前 {pages_done} 页已可用于对话，后续页面解析完成后自动加入")
+        with st.expander("📋 文本预览（已解析部分）"):
+            preview_text = job.snapshot()[0][:1000]
+            st.text_area("PDF 文本预览:", preview_text, height=200, disabled=True)
 
-        # 清理文本（移除多余的空白字符）
-        text = re.sub(r'\s+', ' ', text)
-        text = text.strip()
+# 核心提示词系统
+# 总结时论文全文放在 system 消息中，且位于所有任务指令之前，重复总结时共享
+# 字节完全相同的前缀，上游的上下文缓存（DeepSeek 按前缀命中）才能生效。
+# 对话时只发送按问题检索出的片段，见 build_chat_messages。
+CHAT_SYSTEM_PROMPT = "你是一个专业的学术文献分析师和学术顾问，擅长从学术论文中提取关键信息、进行结构化总结，并解答关于论文的问题。"
 
-        return text, page_count
-    except Exception as e:
-        return None, 0
+def build_paper_system_prompt(pdf_text):
+    """构建包含论文全文的系统提示词（内容不能随任务变化）"""
+    return f"""你是一个专业的学术文献分析师和学术顾问，擅长从学术论文中提取关键信息、进行结构化总结，并解答关于论文的问题。
 
-# 处理文件上传
-if uploaded_file is not None:
-    if st.session_state.pdf_filename != uploaded_file.name:
-        with st.spinner("正在解析 PDF 文件..."):
-            pdf_text, page_count = extract_text_from_pdf(uploaded_file)
+以下是论文的完整内容：
+{pdf_text}"""
+
+SUMMARY_INSTRUCTION = """请阅读这篇学术论文，并严格按照以下结构进行总结，用中文回答：
+
+1. **研究空白 (Research Gap)**
+   - 现有研究的不足之处
+   - 作者试图解决的具体问题
+   - 研究的重要性和必要性
 
-            if pdf_text is not None:
-                # 如果文本超过 20,000 字，进行截取
-                max_length = 20000
-                if len(pdf_text) > max_length:
-                    pdf_text = pdf_text[:max_length] + f"\n\n[注意：文本已截取至 {max_length} 字符，完整内容请参考原文件]"
-                    st.warning(f"📄 文本过长（{len(pdf_text)} 字符），已截取至 {max_length} 字符用于分析")
+2. **方法论 (Methodology)**
+   - 主要研究方法和技术路线
+   - 实验设计和数据收集方式
+   - 分析方法和验证手段
 
-                st.session_state.pdf_text = pdf_text
-                st.session_state.pdf_filename = uploaded_file.name
+3. **核心结论 (Key Results)**
+   - 主要发现和创新点
+   - 数据支持的重要结论
+   - 研究的理论和实践意义
 
-                # 显示提取结果
-                st.success(f"✅ 成功提取 {page_count} 页，共 {len(pdf_text)} 字符")
+请确保回答准确、简洁、专业。"""
 
-                # 显示部分预览
-                with st.expander("📋 文本预览"):
-                    preview_text = pdf_text[:1000] + "..." if len(pdf_text) > 1000 else pdf_text
-                    st.text_area("PDF 文本预览:", preview_text, height=200, disabled=True)
+# 系统提示词中论文以外的部分，以及总结指令 / 用户问题的预留 token
+PROMPT_OVERHEAD_TOKENS = 1024
+
+def get_paper_budget(pdf_text):
+    """按当前模型的上下文窗口和输出长度规划论文正文能否完整放入上下文"""
+    return plan_document_budget(
+        model_name,
+        pdf_text,
+        prompt_tokens=PROMPT_OVERHEAD_TOKENS,
+        reserved_output=max_tokens
+    )
+
+def build_summary_messages(pdf_text):
+    """构建结构化总结请求"""
+    return [
+        {"role": "system", "content": build_paper_system_prompt(pdf_text)},
+        {"role": "user", "content": SUMMARY_INSTRUCTION}
+    ]
+
+# 长论文分段总结：每段的 token 上限和每段笔记的最大长度
+MAP_SECTION_TOKENS = 8000
+MAP_NOTE_MAX_TOKENS = 800
+
+def build_map_reduce_summary_messages(pdf_text, page_offsets, budget_plan):
+    """论文超出上下文窗口时，先按页分段并发生成要点笔记，再把笔记汇总成结构化总结请求"""
+    runner = get_async_runner()
+    api_key = get_valid_api_key()
+    base_url = get_final_base_url()
+
+    sections = split_by_pages(pdf_text, page_offsets, MAP_SECTION_TOKENS)
+    progress_bar = st.progress(0.0, text=f"正在分段阅读全文（共 {len(sections)} 段）...")
+
+    def update_progress(done, total):
+        progress_bar.progress(done / total, text=f"正在分段阅读全文...（{done}/{total} 段）")
+
+    notes, reused = map_sections(runner, api_key, base_url, model_name, sections, MAP_NOTE_MAX_TOKENS, on_progress=update_progress)
+    progress_bar.empty()
+
+    failed = [note for note in notes if not isinstance(note, str)]
+    if len(failed) == len(notes):
+        raise failed[0]
+    if failed:
+        st.warning(f"⚠️ 有 {len(failed)} 段阅读失败，总结中可能缺少这些部分")
+
+    # 笔记仍然超出预算时分组合并，直到能放进一次汇总请求
+    labeled_notes = combine_notes(
+        runner, api_key, base_url, model_name,
+        label_notes(sections, notes),
+        budget_tokens=budget_plan.available_tokens,
+        max_tokens=MAP_NOTE_MAX_TOKENS
+    )
+    notes_text = "\n\n".join(labeled_notes)
+    notes_text = notes_text[:truncate_to_tokens(notes_text, budget_plan.available_tokens)]
+    st.caption(f"🧩 全文分为 {len(sections)} 段并发阅读（复用缓存 {reused} 段），再汇总为结构化总结")
+
+    return [
+        {"role": "system", "content": f"""{CHAT_SYSTEM_PROMPT}
+
+以下是论文各部分的要点笔记（按页码顺序，由全文分段阅读得到）：
+{notes_text}"""},
+        {"role": "user", "content": SUMMARY_INSTRUCTION}
+    ]
+
+def load_library_index(pdf_hash):
+    """读取文献库中的其他论文，返回 (片段索引, 章节索引)（免解析），同时确保其语义向量已建立"""
+    parsed = get_text_store().get(pdf_hash)
+    if parsed is None:
+        return None, None
+    chunk_index = get_chunk_index(pdf_hash, len(parsed.text), parsed.text, parsed.page_offsets)
+    get_vector_store().ensure(pdf_hash, chunk_index.chunks)
+    return chunk_index, PaperSections(parsed.sections)
+
+@st.cache_resource(max_entries=32, show_spinner=False)
+def load_reference_table(pdf_hash, text_length, reference_span, _text, _sections):
+    """当前论文的参考文献表，按 (内容哈希, 已解析长度, 参考文献位置) 在进程内共享，不必每次重跑都查库或解析
+
+    文献库中已有解析好的条目时直接读取，否则现场解析（如后台解析中，或只保留了前几页的结果）。
+    """
+    references = get_paper_library().references(pdf_hash)
+    if references is None:
+        references = parse_references(_text, _sections)
+    return ReferenceTable(references)
+
+def chunk_section(sections, chunk):
+    """片段所属的章节（按片段中点判断）"""
+    return sections.section_at((chunk.start + chunk.end) // 2)
+
+def retrieve_chunks(papers, question, vector_hashes=()):
+    """按问题检索最相关的片段：BM25 与本地语义向量两路检索后做倒数排名融合
+
+    papers 为 [(内容哈希, 文件名, 片段索引, 章节索引)]，第一篇是当前论文；返回 [(文件名, 片段, 章节名)]。
+    多篇论文的 BM25 结果按分数合并（各篇统计量不同，分数只作粗排，再与向量检索融合）。
+    融合后问题涉及的章节排在前面；参考文献的片段只在问到引用时才使用，其余时候直接略去。
+    两路都没有结果时退回当前论文开头（摘要和引言）。
+    """
+    sources = {pdf_hash: (filename, chunk_index, sections) for pdf_hash, filename, chunk_index, sections in papers}
+    lexical = [
+        (score, pdf_hash, chunk.chunk_id)
+        for pdf_hash, _, chunk_index, _ in papers
+        for chunk, score in chunk_index.search(question, k=retrieval_top_k * 2)
+    ]
+    lexical.sort(reverse=True)
+    rankings = [[(pdf_hash, chunk_id) for _, pdf_hash, chunk_id in lexical[:retrieval_top_k * 2]]]
+    if vector_hashes:
+        dense = get_vector_store().search([question], k=retrieval_top_k * 2, pdf_hashes=list(vector_hashes))[0]
+        rankings.append([(pdf_hash, chunk_id) for score, pdf_hash, chunk_id in dense if score > 0])
+
+    targets = sections_for_question(question)
+    results = []
+    for pdf_hash, chunk_id in reciprocal_rank_fusion(rankings):
+        filename, chunk_index, sections = sources[pdf_hash]
+        chunk = chunk_index.chunks[chunk_id]
+        results.append((filename, chunk, chunk_section(sections, chunk)))
+
+    if "references" not in targets:
+        results = [result for result in results if result[2] != "references"]
+
+    def priority(result):
+        return 0 if result[2] in targets else 1
+
+    # 排序是稳定的，同一优先级内保持融合后的相关度顺序
+    results = sorted(results, key=priority)[:retrieval_top_k]
+    if not results:
+        _, filename, chunk_index, sections = papers[0]
+        return [(filename, chunk, chunk_section(sections, chunk)) for chunk in chunk_index.chunks[:retrieval_top_k]]
+    return results
+
+def format_chunk_source(filename, chunk, section, with_filename):
+    """片段出处：页码和章节，多篇论文时加上文件名"""
+    label = chunk.page_label() or f"片段 {chunk.chunk_id + 1}"
+    if section:
+        label = f"{label}·{SECTION_LABELS[section]}"
+    return f"《{filename}》{label}" if with_filename else label
+
+def build_chat_messages(chunks, question, note="", history=(), with_filename=False):
+    """构建论文对话请求：对话记忆（摘要 + 最近几轮原文）之后，附上与问题相关的片段及其出处"""
+    excerpts = "\n\n".join(
+        f"[片段 {i} | {format_chunk_source(filename, chunk, section, with_filename)}]\n{chunk.text}"
+        for i, (filename, chunk, section) in enumerate(chunks, 1)
+    )
+    return [
+        {"role": "system", "content": CHAT_SYSTEM_PROMPT},
+        *history,
+        {"role": "user", "content": f"""以下是论文中与问题最相关的片段（按相关度排序）：
+
+{excerpts}
+{note}
+User Question: {question}
+
+请基于以上片段回答用户的问题。如果片段中没有相关信息，请诚实说明。回答要准确、专业、有帮助，并注明引用内容所在的页码。"""}
+    ]
 
-            else:
-                st.error("❌ PDF 文件解析失败，请确保文件格式正确")
+# 处理文件上传
+# 按上传控件的 file_id 判断是否是新上传的文件，重跑脚本时不必每次复制并哈希整个文件；
+# 记录的是上传框中的文件而不是当前论文，从文献库打开其他论文后不会被上传框覆盖
+if uploaded_file is not None and st.session_state.pdf_upload_id != uploaded_file.file_id:
+    st.session_state.pdf_upload_id = uploaded_file.file_id
+    pdf_bytes = uploaded_file.getvalue()
+    pdf_hash = hash_pdf_bytes(pdf_bytes)
+
+    # 按文件内容查找已有的解析结果，同名的不同文件不会串用：
+    # 依次查共享文本存储、解析缓存和文献库（解析缓存按容量淘汰，文献库长期保存）
+    parsed = get_text_store().get(pdf_hash)
+    if parsed is not None:
+        open_paper(parsed, uploaded_file.name)
+        get_paper_library().add(parsed, uploaded_file.name)
+        show_parsed_result(parsed, from_cache=True)
+    else:
+        # 后台逐页解析，已解析的前几页可以先用于对话；解析完成后自动加入文献库
+        st.session_state.pdf_hash = pdf_hash
+        st.session_state.pdf_filename = uploaded_file.name
+        st.session_state.pdf_ingest_job = start_ingest_job(pdf_hash, pdf_bytes, uploaded_file.name)
+    del pdf_bytes
+
+# 文献库：已解析过的论文可直接打开，并支持跨论文全文检索
+library = get_paper_library()
+library_papers = library.list_papers()
+library_names = {pdf_hash: filename for pdf_hash, filename, _ in library_papers}
+if library_papers:
+    with st.expander(f"🗂️ 文献库（{len(library_papers)} 篇，打开无需重新解析）"):
+        col_pick, col_open = st.columns([4, 1])
+        with col_pick:
+            picked_hash = st.selectbox(
+                "选择论文:",
+                options=[pdf_hash for pdf_hash, _, _ in library_papers],
+                format_func=lambda pdf_hash: library_names[pdf_hash],
+                label_visibility="collapsed"
+            )
+        with col_open:
+            if st.button("📂 打开", use_container_width=True):
+                parsed = get_text_store().get(picked_hash)
+                if parsed is not None:
+                    open_paper(parsed, library_names[picked_hash])
+                    show_parsed_result(parsed, from_cache=True)
+
+        library_query = st.text_input(
+            "全文检索:",
+            placeholder="在文献库的所有论文中检索，如 transformer、注意力机制",
+            help="按页检索文献库中的全部论文，结果按相关度排序"
+        )
+        if library_query.strip():
+            hits = library.search(library_query, limit=10)
+            if not hits:
+                st.info("没有找到匹配的页面" + ("（每个检索词至少 3 个字符）" if library.tokenizer == "trigram" else ""))
+            for hit_hash, hit_filename, page_number, snippet in hits:
+                st.markdown(f"**{hit_filename}** · 第 {page_number} 页  \n{snippet}")
+
+# 同步后台解析进度
+ingest_job = st.session_state.pdf_ingest_job
+if ingest_job is not None and ingest_job.done:
+    st.session_state.pdf_ingest_job = None
+    failure_message = PARSE_FAILURE_MESSAGES.get(getattr(ingest_job.error, "kind", None), "❌ PDF 文件解析失败，请确保文件格式正确")
+    if ingest_job.result is not None:
+        open_paper(ingest_job.result, st.session_state.pdf_filename)
+        show_parsed_result(ingest_job.result)
+        if ingest_job.error is not None:
+            # 超时、内存超限或进程崩溃时保留已解析的前几页，但不写入解析缓存和文献库
+            st.warning(f"{failure_message}，只保留了前 {ingest_job.result.page_count}/{ingest_job.page_count} 页")
+    else:
+        st.session_state.pdf_hash = ""
+        st.error(failure_message)
+    ingest_job = None
+
+# 取出当前论文：解析中读取已解析的前缀，否则从共享文本存储按内容哈希读取
+pdf_text, pdf_page_offsets, pdf_sections = "", [], []
+if ingest_job is not None:
+    pdf_text, pdf_page_offsets = ingest_job.snapshot()
+    show_ingest_progress(ingest_job)
+elif st.session_state.pdf_hash:
+    parsed = get_text_store().get(st.session_state.pdf_hash)
+    if parsed is None:
+        st.session_state.pdf_hash = ""
+        st.warning("⚠️ 论文文本已失效，请重新上传")
+    else:
+        pdf_text, pdf_page_offsets, pdf_sections = parsed.text, parsed.page_offsets, parsed.sections
+get_text_store().touch(get_session_id(), st.session_state.pdf_hash if ingest_job is None else "")
 
 # 功能选择区
-if st.session_state.pdf_text:
+if pdf_text:
     st.markdown("---")
     st.markdown("### 🎯 功能选择")
 
+    # 章节索引：总结时略去参考文献，对话时按问题优先检索相关章节
+    paper_sections = PaperSections(pdf_sections)
+    summary_text, summary_page_offsets = remove_sections(
+        pdf_text, pdf_page_offsets, paper_sections, {"references"}
+    )
+    if paper_sections:
+        references = paper_sections.get("references")
+        skipped_note = ""
+        if references:
+            skipped_note = f"（总结时略去参考文献，约 {estimate_tokens(pdf_text[references[0]:references[1]])} tokens，对话时只在问到引用时使用）"
+        st.caption(f"🧭 已识别章节：{paper_sections.describe()}{skipped_note}")
+
+    # 参考文献表：按作者 / 年份本地查找，不经过模型
+    reference_table = load_reference_table(
+        st.session_state.pdf_hash,
+        len(pdf_text),
+        paper_sections.get("references"),
+        pdf_text,
+        paper_sections
+    )
+    if reference_table:
+        with st.expander(f"📚 参考文献（{len(reference_table)} 条，可按作者 / 年份查找）"):
+            reference_query = st.text_input(
+                "查找参考文献:",
+                placeholder="如 Smith 2020、Vaswani、2017",
+                help="按作者姓氏和 / 或年份在本文的参考文献表中查找"
+            )
+            found = reference_table.search(reference_query) if reference_query.strip() else reference_table.references
+            if found:
+                st.dataframe(
+                    [
+                        {"编号": reference.label, "作者": reference.authors, "年份": reference.year, "标题": reference.title, "出处": reference.venue}
+                        for reference in found
+                    ],
+                    hide_index=True
+                )
+            else:
+                st.info("没有找到匹配的参考文献")
+
+    # 论文上下文预算
+    budget_plan = get_paper_budget(summary_text)
+    if not budget_plan.fits:
+        st.warning(f"📄 论文约 {budget_plan.document_tokens} tokens，超出 {model_name} 的可用预算 {budget_plan.available_tokens} tokens，总结时将分段阅读全文后汇总（论文对话检索全文）")
+    else:
+        st.caption(f"📐 论文约 {budget_plan.document_tokens} tokens，{model_name} 上下文窗口 {get_context_window(model_name)} tokens，可完整放入")
+
+    # 全文切片并建立检索索引（按内容哈希在进程内共享），论文对话只发送相关片段
+    chunk_index = get_chunk_index(
+        st.session_state.pdf_hash,
+        len(pdf_text),
+        pdf_text,
+        pdf_page_offsets
+    )
+
+    # 全文解析完成后按内容哈希持久化片段向量，用于语义检索
+    vectors_ready = False
+    if ingest_job is None and st.session_state.pdf_hash:
+        vector_store = get_vector_store()
+        if not vector_store.has(st.session_state.pdf_hash, len(chunk_index.chunks)):
+            with st.spinner("正在建立语义检索向量..."):
+                vector_store.ensure(st.session_state.pdf_hash, chunk_index.chunks)
+        vectors_ready = True
+
+    st.caption(f"🔎 已为论文对话建立 {len(chunk_index.chunks)} 个片段的检索索引" + ("（关键词 + 语义）" if vectors_ready else "（关键词）"))
+
     # 使用列布局
     col1, col2 = st.columns(2)
 
     with col1:
-        if st.button("📑 生成核心摘要", type="primary", use_container_width=True):
+        if st.button("📑 生成核心摘要", type="primary", use_container_width=True, disabled=ingest_job is not None, help="全文解析完成后可用" if ingest_job is not None else None):
             st.markdown("---")
             st.markdown("### 📄 结构化总结")
 
@@ -185,54 +590,40 @@ if st.session_state.pdf_text:
                 st.info("请在左侧配置区域输入有效的 API Key")
                 st.stop()
 
-            # 构建总结提示词
-            summary_prompt = """请阅读这篇学术论文，并严格按照以下结构进行总结，用中文回答：
-
-1. **研究空白 (Research Gap)**
-   - 现有研究的不足之处
-   - 作者试图解决的具体问题
-   - 研究的重要性和必要性
-
-2. **方法论 (Methodology)**
-   - 主要研究方法和技术路线
-   - 实验设计和数据收集方式
-   - 分析方法和验证手段
-
-3. **核心结论 (Key Results)**
-   - 主要发现和创新点
-   - 数据支持的重要结论
-   - 研究的理论和实践意义
-
-请确保回答准确、简洁、专业。"""
-
-            with st.spinner("正在生成结构化总结..."):
-                try:
-                    response = client.chat.completions.create(
-                        model=model_name,
-                        messages=[
-                            {"role": "system", "content": "你是一个专业的学术文献分析师，擅长从学术论文中提取关键信息并进行结构化总结。"},
-                            {"role": "user", "content": f"{summary_prompt}\n\n论文内容：\n{st.session_state.pdf_text}"}
-                        ],
-                        max_tokens=2000,
-                        temperature=0.3
-                    )
-
-                    summary_result = response.choices[0].message.content.strip()
 
-                    # 显示总结结果
-                    st.markdown(summary_result)
-
-                    # 下载按钮
-                    st.download_button(
-                        "📥 下载总结",
-                        data=summary_result,
-                        file_name=f"{st.session_state.pdf_filename}_总结.txt",
-                        mime="text/plain"
-                    )
-
-                except Exception as e:
-                    st.error(f"生成总结时出现错误：{str(e)}")
-                    st.info("请检查网络连接、API Key 配置或稍后重试。")
+            try:
+                # 论文能完整放入上下文时直接总结，否则分段阅读后汇总
+                if budget_plan.fits:
+                    summary_messages = build_summary_messages(summary_text)
+                else:
+                    summary_messages = build_map_reduce_summary_messages(summary_text, summary_page_offsets, budget_plan)
+
+                stream = stream_chat_completion(
+                    client,
+                    model_name,
+                    messages=summary_messages,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    prompt_version=PROMPT_VERSION,
+                    labels={"page": "pdf_reader", "mode": "summary"}
+                )
+
+                # 流式显示总结结果
+                st.write_stream(stream)
+                summary_result = stream.text
+                st.caption(format_stream_stats(stream))
+
+                # 下载按钮
+                st.download_button(
+                    "📥 下载总结",
+                    data=summary_result,
+                    file_name=f"{st.session_state.pdf_filename}_总结.txt",
+                    mime="text/plain"
+                )
+
+            except Exception as e:
+                st.error(f"生成总结时出现错误：{str(e)}")
+                st.info("请检查网络连接、API Key 配置或稍后重试。")
 
     with col2:
         st.markdown("### 💬 论文对话模式")
@@ -242,7 +633,7 @@ if st.session_state.pdf_text:
         st.caption("• 研究方法有什么局限性？")
 
 # 论文对话界面
-if st.session_state.pdf_text:
+if pdf_text:
     st.markdown("---")
     st.markdown("### 💬 论文对话")
     st.info("💡 **使用提示**: 你可以询问关于论文内容的任何问题，例如：")
@@ -254,6 +645,7 @@ if st.session_state.pdf_text:
     if st.session_state.messages:
         if st.button("🗑️ 清除对话历史", type="secondary"):
             st.session_state.messages = []
+            st.session_state.chat_memory = ConversationMemory(memory_budget_tokens)
             st.rerun()
 
     # 显示对话历史
@@ -261,6 +653,17 @@ if st.session_state.pdf_text:
         with st.chat_message(message["role"]):
             st.markdown(message["content"])
 
+    # 对话范围：当前论文之外，可以同时检索文献库中的其他论文
+    extra_hashes = []
+    other_hashes = [pdf_hash for pdf_hash, _, _ in library_papers if pdf_hash != st.session_state.pdf_hash]
+    if other_hashes:
+        extra_hashes = st.multiselect(
+            "同时检索文献库中的其他论文:",
+            options=other_hashes,
+            format_func=lambda pdf_hash: library_names[pdf_hash],
+            help="论文对话时从当前论文和所选论文中一并检索相关片段"
+        )
+
     # 用户输入
     if prompt := st.chat_input("请输入你想了解的问题："):
         # 添加用户消息到对话历史
@@ -276,58 +679,72 @@ if st.session_state.pdf_text:
             st.info("请在左侧配置区域输入有效的 API Key")
         else:
             with st.chat_message("assistant"):
-                with st.spinner("正在思考回答..."):
-                    try:
-                        # 构建对话提示词
-                        chat_prompt = f"""你是一个专业的学术顾问，正在帮助用户理解一篇学术论文。
-
-Context: 以下是论文的完整内容：
-{st.session_state.pdf_text}
-
-User Question: {prompt}
-
-请基于论文内容回答用户的问题。如果论文中没有相关信息，请诚实说明。回答要准确、专业、有帮助。"""
-
-                        response = client.chat.completions.create(
-                            model=model_name,
-                            messages=[
-                                {"role": "system", "content": "你是一个专业的学术顾问，擅长解读学术论文并回答相关问题。"},
-                                {"role": "user", "content": chat_prompt}
-                            ],
-                            max_tokens=1500,
-                            temperature=0.3
-                        )
-
-                        assistant_response = response.choices[0].message.content.strip()
-                        st.markdown(assistant_response)
-
-                        # 添加助手回复到对话历史
-                        st.session_state.messages.append({"role": "assistant", "content": assistant_response})
+                try:
+                    # 对话记忆：较早的轮次超出预算时先压缩成滚动摘要
+                    memory = st.session_state.chat_memory
+                    earlier_messages = st.session_state.messages[:-1]
+                    if memory.needs_compaction(earlier_messages):
+                        runner = get_async_runner()
+                        try:
+                            with st.spinner("正在压缩较早的对话..."):
+                                memory.compact(
+                                    earlier_messages,
+                                    lambda summary, turns: summarize_turns(
+                                        runner, get_valid_api_key(), get_final_base_url(), model_name,
+                                        summary, turns, memory.summary_max_tokens
+                                    )
+                                )
+                        except Exception:
+                            # 压缩失败时只发送预算内的最近几轮
+                            pass
+                    history = memory.build_history(earlier_messages)
+
+                    # 在全文片段索引中检索与问题相关的内容；追问时带上一个问题，补全指代
+                    previous_questions = [m["content"] for m in earlier_messages if m["role"] == "user"]
+                    query = f"{previous_questions[-1]} {prompt}" if previous_questions else prompt
+                    papers = [(st.session_state.pdf_hash, st.session_state.pdf_filename, chunk_index, paper_sections)]
+                    for pdf_hash in extra_hashes:
+                        extra_index, extra_sections = load_library_index(pdf_hash)
+                        if extra_index is not None:
+                            papers.append((pdf_hash, library_names[pdf_hash], extra_index, extra_sections))
+                    vector_hashes = [pdf_hash for pdf_hash, _, _, _ in papers if vectors_ready or pdf_hash != st.session_state.pdf_hash]
+                    chunks = retrieve_chunks(papers, query, vector_hashes=vector_hashes)
+                    ingest_note = ""
+                    if ingest_job is not None:
+                        ingest_note = f"\n[注意：论文仍在解析中，目前只检索了前 {ingest_job.pages_done}/{ingest_job.page_count} 页]\n"
+
+                    # 问题提到具体的参考文献（编号或作者）时附上对应条目，泛问引用时附上整张表
+                    cited = reference_table.match_question(prompt)
+                    if not cited and "references" in sections_for_question(prompt):
+                        cited = reference_table.references
+
+                    stream = stream_chat_completion(
+                        client,
+                        model_name,
+                        messages=build_chat_messages(chunks, prompt, note=ingest_note + format_reference_note(cited, REFERENCE_NOTE_MAX_TOKENS), history=history, with_filename=len(papers) > 1),
+                        max_tokens=max_tokens,
+                        temperature=temperature,
+                        prompt_version=PROMPT_VERSION,
+                        labels={"page": "pdf_reader", "mode": "chat"},
+                        hedge=True  # 对话回答对延迟敏感，首字过慢时发起对冲请求
+                    )
 
-                    except Exception as e:
-                        error_message = f"生成回答时出现错误：{str(e)}"
-                        st.error(error_message)
-                        st.session_state.messages.append({"role": "assistant", "content": error_message})
+                    st.write_stream(stream)
+                    assistant_response = stream.text
+                    st.caption(format_stream_stats(stream))
+                    st.caption("📎 参考片段：" + " · ".join(format_chunk_source(filename, chunk, section, len(papers) > 1) for filename, chunk, section in chunks))
+                    if cited:
+                        st.caption(f"📚 附带参考文献条目 {len(cited)} 条")
+                    if history:
+                        st.caption(f"🧠 对话记忆：{'滚动摘要 + ' if memory.summary else ''}最近 {sum(1 for m in history if m['role'] != 'system')} 条消息，约 {estimate_messages_tokens(history)} tokens")
 
-# 侧边栏高级设置
-st.sidebar.markdown("### ⚙️ 高级设置")
-temperature = st.sidebar.slider(
-    "创造性 (Temperature):",
-    min_value=0.0,
-    max_value=1.0,
-    value=0.3,
-    step=0.1,
-    help="控制回答的创造性，学术分析建议保持较低值"
-)
+                    # 添加助手回复到对话历史
+                    st.session_state.messages.append({"role": "assistant", "content": assistant_response})
 
-max_tokens = st.sidebar.slider(
-    "最大长度 (Tokens):",
-    min_value=500,
-    max_value=4000,
-    value=2000,
-    step=100,
-    help="限制生成内容的最大长度"
-)
+                except Exception as e:
+                    error_message = f"生成回答时出现错误：{str(e)}"
+                    st.error(error_message)
+                    st.session_state.messages.append({"role": "assistant", "content": error_message, "error": True})
 
 # 显示当前配置
 st.sidebar.markdown("---")
@@ -335,10 +752,11 @@ st.sidebar.markdown("### 🔧 当前配置")
 st.sidebar.write(f"**模型**: {model_name}")
 st.sidebar.write(f"**Temperature**: {temperature}")
 st.sidebar.write(f"**Max Tokens**: {max_tokens}")
+st.sidebar.write(f"**补全缓存**: {format_cache_stats()}")
 
 if st.session_state.pdf_filename:
     st.sidebar.write(f"**当前文件**: {st.session_state.pdf_filename}")
-    st.sidebar.write(f"**文本长度**: {len(st.session_state.pdf_text)} 字符")
+    st.sidebar.write(f"**文本长度**: {len(pdf_text)} 字符（约 {estimate_tokens(pdf_text)} tokens）")
 
 # API 配置详情
 st.sidebar.markdown("---")
@@ -368,6 +786,7 @@ st.sidebar.markdown("### 📊 连接状态")
 if get_valid_api_key():
     st.sidebar.success("✅ API Key 已配置")
     st.sidebar.write(f"🔗 Base URL: {user_base_url if user_base_url else 'https://api.deepseek.com'}")
+    st.sidebar.write(f"🩺 上游状态: {format_upstream_health(user_base_url.strip() if user_base_url else DEFAULT_BASE_URL)}")
 else:
     st.sidebar.warning("⚠️ 需要配置 API Key")
     st.sidebar.info("请在左侧输入 API Key")
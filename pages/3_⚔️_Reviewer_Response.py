@@ -1,5 +1,10 @@
 import streamlit as st
-from openai import OpenAI
+from utils.llm import format_cache_stats, format_stream_stats, stream_chat_completion
+from utils.llm_client import DEFAULT_BASE_URL, get_shared_client
+from utils.resilience import format_upstream_health
+
+# 提示词模板版本（修改提示词后递增，使旧的补全缓存失效）
+PROMPT_VERSION = "v1"
 
 # 设置页面配置
 st.set_page_config(
@@ -54,18 +59,16 @@ def get_valid_api_key():
 
 # 初始化 OpenAI 客户端
 def get_client():
-    """获取配置好的 OpenAI 客户端"""
+    """获取配置好的 OpenAI 客户端（进程内共享连接池）"""
     final_api_key = get_valid_api_key()
-    final_base_url = user_base_url.strip() if user_base_url and user_base_url.strip() else "https://api.deepseek.com"
+    final_base_url = user_base_url.strip() if user_base_url and user_base_url.strip() else DEFAULT_BASE_URL
 
     if not final_api_key:
         return None, "请输入 API Key 或确保系统配置了默认 Key"
 
     try:
-        client = OpenAI(
-            api_key=final_api_key,
-            base_url=final_base_url
-        )
+        # 复用进程级共享客户端，保持 keep-alive 连接
+        client = get_shared_client(final_api_key, final_base_url)
         return client, None
     except Exception as e:
         return None, f"初始化客户端失败：{str(e)}"
@@ -88,6 +91,32 @@ with api_key_info_col:
 
 st.sidebar.markdown("---")
 
+# 侧边栏高级设置
+st.sidebar.markdown("### ⚙️ 高级设置")
+temperature = st.sidebar.slider(
+    "创造性 (Temperature):",
+    min_value=0.0,
+    max_value=1.0,
+    value=0.4,
+    step=0.1,
+    help="控制回复的创造性，学术写作建议保持较低值"
+)
+
+max_tokens = st.sidebar.slider(
+    "最大长度 (Tokens):",
+    min_value=500,
+    max_value=2000,
+    value=1500,
+    step=100,
+    help="限制生成回复的最大长度"
+)
+
+fresh_generation = st.sidebar.checkbox(
+    "🔄 重新生成（跳过补全缓存）",
+    value=False,
+    help="相同的意见和设置默认直接返回上次的回复；勾选后重新调用模型，得到新的回复"
+)
+
 # 功能说明
 st.markdown("### 📖 功能介绍")
 st.markdown("""
@@ -239,106 +268,87 @@ if st.button("🚀 生成回复", type="primary"):
         system_prompt = get_system_prompt(tone_strategy)
         user_prompt = build_user_prompt(reviewer_comment, raw_thoughts, tone_strategy)
 
-        # 显示加载动画
-        with st.spinner("正在生成专业的审稿回复，请稍候..."):
-            try:
-                # 调用 API
-                response = client.chat.completions.create(
-                    model=model_name,
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_prompt}
-                    ],
-                    max_tokens=1500,
-                    temperature=0.4
+        try:
+            # 调用 API（流式输出）
+            stream = stream_chat_completion(
+                client,
+                model_name,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt}
+                ],
+                max_tokens=max_tokens,
+                temperature=temperature,
+                prompt_version=PROMPT_VERSION,
+                use_cache=not fresh_generation,
+                labels={"page": "reviewer_response", "mode": f"tone_{tone_strategy}"}
+            )
+
+            # 显示结果
+            st.markdown("### 📄 生成的回复")
+
+            # 边生成边显示
+            st.write_stream(stream)
+            response_text = stream.text
+            st.caption(format_stream_stats(stream))
+
+            # 显示成功消息
+            st.success("回复生成完成！")
+
+            # 复制区域
+            st.markdown("### 📋 复制回复")
+            st.code(response_text, language=None)
+
+            # 一键复制按钮
+            st.markdown("---")
+            col1, col2 = st.columns(2)
+
+            with col1:
+                st.download_button(
+                    "📥 下载回复",
+                    data=response_text,
+                    file_name="reviewer_response.txt",
+                    mime="text/plain"
                 )
 
-                # 获取结果
-                response_text = response.choices[0].message.content.strip()
-
-                # 显示成功消息
-                st.success("回复生成完成！")
-
-                # 显示结果
-                st.markdown("### 📄 生成的回复")
+            with col2:
+                st.markdown("💡 **使用提示**：复制上方文本框中的内容粘贴到回复文档中")
 
-                # 格式化显示结果
-                st.markdown(response_text)
+            # 显示完整提示词（学习用途）
+            with st.expander("🔍 查看发送给 AI 的完整提示词"):
+                st.markdown("##### System Prompt:")
+                st.code(system_prompt, language=None)
 
-                # 复制区域
-                st.markdown("### 📋 复制回复")
-                st.code(response_text, language=None)
+                st.markdown("##### User Prompt:")
+                st.code(user_prompt, language=None)
 
-                # 一键复制按钮
-                st.markdown("---")
-                col1, col2 = st.columns(2)
+                st.caption("💡 你可以学习这些提示词的写法，用于自己的项目中！")
 
-                with col1:
-                    st.download_button(
-                        "📥 下载回复",
-                        data=response_text,
-                        file_name="reviewer_response.txt",
-                        mime="text/plain"
-                    )
+            # 使用建议
+            st.markdown("---")
+            st.markdown("### 📚 使用建议")
 
-                with col2:
-                    st.markdown("💡 **使用提示**：复制上方文本框中的内容粘贴到回复文档中")
+            suggestion_cols = st.columns(3)
+            with suggestion_cols[0]:
+                st.info("🎯 **针对性回复**")
+                st.caption("确保每个审稿意见都有具体回应")
 
-                # 显示完整提示词（学习用途）
-                with st.expander("🔍 查看发送给 AI 的完整提示词"):
-                    st.markdown("##### System Prompt:")
-                    st.code(system_prompt, language=None)
+            with suggestion_cols[1]:
+                st.warning("📝 **个性化调整**")
+                st.caption("根据实际情况微调生成的回复")
 
-                    st.markdown("##### User Prompt:")
-                    st.code(user_prompt, language=None)
+            with suggestion_cols[2]:
+                st.success("📊 **引用支持**")
+                st.caption("必要时添加文献或数据支持")
 
-                    st.caption("💡 你可以学习这些提示词的写法，用于自己的项目中！")
-
-                # 使用建议
-                st.markdown("---")
-                st.markdown("### 📚 使用建议")
-
-                suggestion_cols = st.columns(3)
-                with suggestion_cols[0]:
-                    st.info("🎯 **针对性回复**")
-                    st.caption("确保每个审稿意见都有具体回应")
-
-                with suggestion_cols[1]:
-                    st.warning("📝 **个性化调整**")
-                    st.caption("根据实际情况微调生成的回复")
-
-                with suggestion_cols[2]:
-                    st.success("📊 **引用支持**")
-                    st.caption("必要时添加文献或数据支持")
-
-            except Exception as e:
-                # 显示错误信息
-                st.error(f"调用 API 时出现错误：{str(e)}")
-                st.info("请检查网络连接、API Key 配置或稍后重试。")
+        except Exception as e:
+            # 显示错误信息
+            st.error(f"调用 API 时出现错误：{str(e)}")
+            st.info("请检查网络连接、API Key 配置或稍后重试。")
 
     else:
         st.warning("请填写审稿人意见和你的真实想法！")
 
-# 侧边栏高级设置
-st.sidebar.markdown("### ⚙️ 高级设置")
-temperature = st.sidebar.slider(
-    "创造性 (Temperature):",
-    min_value=0.0,
-    max_value=1.0,
-    value=0.4,
-    step=0.1,
-    help="控制回复的创造性，学术写作建议保持较低值"
-)
-
-max_tokens = st.sidebar.slider(
-    "最大长度 (Tokens):",
-    min_value=500,
-    max_value=2000,
-    value=1500,
-    step=100,
-    help="限制生成回复的最大长度"
-)
-
 # 显示当前配置
 st.sidebar.markdown("---")
 st.sidebar.markdown("### 🔧 当前配置")
@@ -346,6 +356,7 @@ st.sidebar.write(f"**回复策略**: {tone_descriptions[tone_strategy]['title']}
 st.sidebar.write(f"**模型**: {model_name}")
 st.sidebar.write(f"**Temperature**: {temperature}")
 st.sidebar.write(f"**Max Tokens**: {max_tokens}")
+st.sidebar.write(f"**补全缓存**: {format_cache_stats()}")
 
 # API 配置详情
 st.sidebar.markdown("---")
@@ -376,6 +387,7 @@ st.sidebar.markdown("### 📊 连接状态")
 if get_valid_api_key():
     st.sidebar.success("✅ API Key 已配置")
     st.sidebar.write(f"🔗 Base URL: {user_base_url if user_base_url else 'https://api.deepseek.com'}")
+    st.sidebar.write(f"🩺 上游状态: {format_upstream_health(user_base_url.strip() if user_base_url else DEFAULT_BASE_URL)}")
 else:
     st.sidebar.warning("⚠️ 需要配置 API Key")
     st.sidebar.info("请在左侧输入 API Key")
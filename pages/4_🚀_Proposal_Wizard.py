@@ -1,9 +1,15 @@
 import streamlit as st
-from openai import OpenAI
+from utils.llm import format_cache_stats, format_stream_stats, stream_chat_completion
+from utils.llm_client import DEFAULT_BASE_URL, get_shared_client
+from utils.resilience import format_upstream_health
 import json
 import re
+import time
 from datetime import datetime
 
+# 提示词模板版本（修改提示词后递增，使旧的补全缓存失效）
+PROMPT_VERSION = "v1"
+
 # JSON 清洗函数
 def clean_and_parse_json(text):
     """从 AI 回复中提取和清洗 JSON 数据"""
@@ -27,6 +33,34 @@ def clean_and_parse_json(text):
         # 如果还是失败，抛出包含原始内容的错误，方便调试
         raise ValueError(f"无法解析 JSON。原始内容:\n{text}")
 
+# 流式预览的最短重绘间隔（秒）：每次重绘都要把整段文本发给前端，逐个 delta 重绘是平方级开销
+PREVIEW_REFRESH_SECONDS = 0.1
+
+# 流式预览函数
+def stream_json_preview(stream):
+    """边生成边以代码块预览 AI 返回的 JSON，生成结束后清除预览并返回完整文本
+
+    预览按时间节流重绘；生成中途出错时补绘一次，保留已收到的全部内容。
+    """
+    placeholder = st.empty()
+    parts = []
+    drawn = 0
+    last_draw = 0.0
+    try:
+        for delta in stream:
+            parts.append(delta)
+            now = time.monotonic()
+            if now - last_draw >= PREVIEW_REFRESH_SECONDS:
+                placeholder.code("".join(parts), language="json")
+                drawn = len(parts)
+                last_draw = now
+    except Exception:
+        if len(parts) > drawn:
+            placeholder.code("".join(parts), language="json")
+        raise
+    placeholder.empty()
+    return stream.text
+
 # 设置页面配置
 st.set_page_config(
     page_title="智能开题报告向导",
@@ -76,18 +110,16 @@ def get_valid_api_key():
 
 # 初始化 OpenAI 客户端
 def get_client():
-    """获取配置好的 OpenAI 客户端"""
+    """获取配置好的 OpenAI 客户端（进程内共享连接池）"""
     final_api_key = get_valid_api_key()
-    final_base_url = user_base_url.strip() if user_base_url and user_base_url.strip() else "https://api.deepseek.com"
+    final_base_url = user_base_url.strip() if user_base_url and user_base_url.strip() else DEFAULT_BASE_URL
 
     if not final_api_key:
         return None, "请输入 API Key 或确保系统配置了默认 Key"
 
     try:
-        client = OpenAI(
-            api_key=final_api_key,
-            base_url=final_base_url
-        )
+        # 复用进程级共享客户端，保持 keep-alive 连接
+        client = get_shared_client(final_api_key, final_base_url)
         return client, None
     except Exception as e:
         return None, f"初始化客户端失败：{str(e)}"
@@ -114,6 +146,34 @@ with api_key_info_col:
 
 st.sidebar.markdown("---")
 
+# 侧边栏高级设置（在各步骤之前声明，生成请求使用这里的取值）
+st.sidebar.markdown("### ⚙️ 高级设置")
+temperature = st.sidebar.slider(
+    "创造性 (Temperature):",
+    min_value=0.0,
+    max_value=1.0,
+    value=0.5,
+    step=0.1,
+    help="控制生成的创造性"
+)
+
+max_tokens = st.sidebar.slider(
+    "最大长度 (Tokens):",
+    min_value=1000,
+    max_value=8000,
+    value=4000,
+    step=500,
+    help="限制每一步生成内容的最大长度，完整开题报告较长，建议不低于 3000"
+)
+
+fresh_generation = st.sidebar.checkbox(
+    "🔄 重新生成（跳过补全缓存）",
+    value=False,
+    help="相同的输入和设置默认直接返回上次的结果；勾选后重新调用模型，得到新的结果"
+)
+
+st.sidebar.markdown("---")
+
 # 初始化状态管理
 def init_session_state():
     """初始化 session_state"""
@@ -179,10 +239,9 @@ def step1_idea_burst():
 
     # 生成假设按钮
     if st.button("🧠 生成科学假设", type="primary", disabled=not idea_input.strip()):
-        with st.spinner("正在分析并生成科学假设..."):
-            try:
-                # 强化的 Prompt，明确要求 JSON 格式
-                prompt = f"""基于以下研究想法，请生成3个具体的、可验证的科学假设。
+        try:
+            # 强化的 Prompt，明确要求 JSON 格式
+            prompt = f"""基于以下研究想法，请生成3个具体的、可验证的科学假设。
 
 研究想法：{idea_input}
 
@@ -213,70 +272,75 @@ def step1_idea_burst():
 - 有明确的创新点
 - 具备研究的可行性"""
 
-                response = client.chat.completions.create(
-                    model=model_name,
-                    messages=[
-                        {"role": "system", "content": """You are a research assistant. You MUST return the response in strict JSON format. Do not add any conversational text or explanations outside the JSON structure. The format must be a LIST of objects with exact keys: 'id', 'hypothesis', 'innovation', 'feasibility'."""},
-                        {"role": "user", "content": prompt}
-                    ],
-                    max_tokens=2000,
-                    temperature=0.7
-                )
-
-                result = response.choices[0].message.content.strip()
-
-                # 使用清洗函数解析 JSON
-                try:
-                    hypotheses_data = clean_and_parse_json(result)
-
-                    # 验证数据结构
-                    if not isinstance(hypotheses_data, list):
-                        raise ValueError("返回的数据不是列表格式")
-
-                    # 验证每个假设的结构
-                    valid_hypotheses = []
-                    for i, hypo in enumerate(hypotheses_data[:3], 1):  # 最多取前3个
-                        if all(key in hypo for key in ['hypothesis', 'innovation', 'feasibility']):
-                            hypo['id'] = i
-                            valid_hypotheses.append(hypo)
-
-                    if not valid_hypotheses:
-                        raise ValueError("没有找到有效的假设数据")
+            stream = stream_chat_completion(
+                client,
+                model_name,
+                messages=[
+                    {"role": "system", "content": """You are a research assistant. You MUST return the response in strict JSON format. Do not add any conversational text or explanations outside the JSON structure. The format must be a LIST of objects with exact keys: 'id', 'hypothesis', 'innovation', 'feasibility'."""},
+                    {"role": "user", "content": prompt}
+                ],
+                max_tokens=max_tokens,
+                temperature=temperature,
+                use_cache=not fresh_generation,
+                prompt_version=PROMPT_VERSION,
+                labels={"page": "proposal_wizard", "mode": "hypotheses"}
+            )
 
-                    st.session_state.data['hypotheses'] = valid_hypotheses
-                    st.success(f"✅ 成功生成 {len(valid_hypotheses)} 个科学假设！")
+            result = stream_json_preview(stream)
+            st.caption(format_stream_stats(stream))
 
-                except Exception as parse_error:
-                    st.error(f"🔍 **JSON 解析失败**: {str(parse_error)}")
+            # 使用清洗函数解析 JSON
+            try:
+                hypotheses_data = clean_and_parse_json(result)
+
+                # 验证数据结构
+                if not isinstance(hypotheses_data, list):
+                    raise ValueError("返回的数据不是列表格式")
+
+                # 验证每个假设的结构
+                valid_hypotheses = []
+                for i, hypo in enumerate(hypotheses_data[:3], 1):  # 最多取前3个
+                    if all(key in hypo for key in ['hypothesis', 'innovation', 'feasibility']):
+                        hypo['id'] = i
+                        valid_hypotheses.append(hypo)
+
+                if not valid_hypotheses:
+                    raise ValueError("没有找到有效的假设数据")
+
+                st.session_state.data['hypotheses'] = valid_hypotheses
+                st.success(f"✅ 成功生成 {len(valid_hypotheses)} 个科学假设！")
+
+            except Exception as parse_error:
+                st.error(f"🔍 **JSON 解析失败**: {str(parse_error)}")
+
+                # 显示调试信息
+                with st.expander("🐛 调试信息 - 查看 AI 原始回复", expanded=True):
+                    st.markdown("##### AI 原始回复:")
+                    st.code(result, language=None)
+
+                    st.markdown("##### 清洗后内容:")
+                    try:
+                        # 尝试显示清洗后的内容
+                        json_match = re.search(r'```json\s*(.*?)\s*```', result, re.DOTALL)
+                        if json_match:
+                            cleaned_text = json_match.group(1)
+                            st.code(cleaned_text, language=None)
+                        else:
+                            list_match = re.search(r'\[.*\]', result, re.DOTALL)
+                            dict_match = re.search(r'\{.*\}', result, re.DOTALL)
+                            if list_match:
+                                st.code(list_match.group(0), language=None)
+                            elif dict_match:
+                                st.code(dict_match.group(0), language=None)
+                            else:
+                                st.code("未找到 JSON 结构", language=None)
+                    except:
+                        st.code("清洗过程出错", language=None)
 
-                    # 显示调试信息
-                    with st.expander("🐛 调试信息 - 查看 AI 原始回复", expanded=True):
-                        st.markdown("##### AI 原始回复:")
-                        st.code(result, language=None)
+                st.info("💡 **建议**：请点击'重新生成'按钮，或者检查研究想法的描述是否清晰。")
 
-                        st.markdown("##### 清洗后内容:")
-                        try:
-                            # 尝试显示清洗后的内容
-                            json_match = re.search(r'```json\s*(.*?)\s*```', result, re.DOTALL)
-                            if json_match:
-                                cleaned_text = json_match.group(1)
-                                st.code(cleaned_text, language=None)
-                            else:
-                                list_match = re.search(r'\[.*\]', result, re.DOTALL)
-                                dict_match = re.search(r'\{.*\}', result, re.DOTALL)
-                                if list_match:
-                                    st.code(list_match.group(0), language=None)
-                                elif dict_match:
-                                    st.code(dict_match.group(0), language=None)
-                                else:
-                                    st.code("未找到 JSON 结构", language=None)
-                        except:
-                            st.code("清洗过程出错", language=None)
-
-                    st.info("💡 **建议**：请点击'重新生成'按钮，或者检查研究想法的描述是否清晰。")
-
-            except Exception as e:
-                st.error(f"生成假设时出现错误：{str(e)}")
+        except Exception as e:
+            st.error(f"生成假设时出现错误：{str(e)}")
 
     # 显示假设卡片
     if st.session_state.data['hypotheses']:
@@ -307,9 +371,8 @@ def step2_methodology():
 
     # 生成技术路线按钮
     if st.button("🛠️ 生成技术路线", type="primary"):
-        with st.spinner("正在设计技术路线..."):
-            try:
-                prompt = f"""基于以下研究假设，请生成2种不同的技术路线方案：
+        try:
+            prompt = f"""基于以下研究假设，请生成2种不同的技术路线方案：
 
 研究假设：{selected_hypo['hypothesis']}
 创新点：{selected_hypo['innovation']}
@@ -340,29 +403,34 @@ def step2_methodology():
     ]
 }}"""
 
-                response = client.chat.completions.create(
-                    model=model_name,
-                    messages=[
-                        {"role": "system", "content": "你是一个专业的研究方法学家，擅长设计可行的研究方案和技术路线。请严格按照指定的JSON格式返回结果。"},
-                        {"role": "user", "content": prompt}
-                    ],
-                    max_tokens=2500,
-                    temperature=0.5
-                )
+            stream = stream_chat_completion(
+                client,
+                model_name,
+                messages=[
+                    {"role": "system", "content": "你是一个专业的研究方法学家，擅长设计可行的研究方案和技术路线。请严格按照指定的JSON格式返回结果。"},
+                    {"role": "user", "content": prompt}
+                ],
+                max_tokens=max_tokens,
+                temperature=temperature,
+                use_cache=not fresh_generation,
+                prompt_version=PROMPT_VERSION,
+                labels={"page": "proposal_wizard", "mode": "methodology"}
+            )
 
-                result = response.choices[0].message.content.strip()
+            result = stream_json_preview(stream)
+            st.caption(format_stream_stats(stream))
 
-                try:
-                    methodology_data = clean_and_parse_json(result)
-                    st.session_state.data['methodology'] = methodology_data['routes']
-                    st.success("✅ 成功生成技术路线方案！")
-                except Exception as parse_error:
-                    st.error(f"解析技术路线数据时出错：{str(parse_error)}")
-                    with st.expander("查看原始回复"):
-                        st.code(result)
+            try:
+                methodology_data = clean_and_parse_json(result)
+                st.session_state.data['methodology'] = methodology_data['routes']
+                st.success("✅ 成功生成技术路线方案！")
+            except Exception as parse_error:
+                st.error(f"解析技术路线数据时出错：{str(parse_error)}")
+                with st.expander("查看原始回复"):
+                    st.code(result)
 
-            except Exception as e:
-                st.error(f"生成技术路线时出现错误：{str(e)}")
+        except Exception as e:
+            st.error(f"生成技术路线时出现错误：{str(e)}")
 
     # 显示技术路线选择
     if st.session_state.data['methodology']:
@@ -421,16 +489,20 @@ def step3_final_export():
 
     # 生成终稿按钮
     if st.button("🚀 生成完整开题报告", type="primary"):
-        with st.spinner("正在生成完整的开题报告..."):
-            try:
-                selected_hypo = st.session_state.data['selected_hypothesis']
-                selected_route = None
-                for route in st.session_state.data['methodology']:
-                    if route['type'] == selected_route_type:
-                        selected_route = route
-                        break
+        try:
+            selected_hypo = st.session_state.data['selected_hypothesis']
+            selected_route = None
+            for route in st.session_state.data['methodology']:
+                if route['type'] == selected_route_type:
+                    selected_route = route
+                    break
+
+            # 用户微调部分（f-string 表达式中不能包含反斜杠，需提前拼接）
+            custom_section = ""
+            if 'custom_modifications' in selected_route:
+                custom_section = "## 用户微调\n" + selected_route['custom_modifications']
 
-                prompt = f"""请基于以下信息，生成一份完整的学术开题报告，使用Markdown格式：
+            prompt = f"""请基于以下信息，生成一份完整的学术开题报告，使用Markdown格式：
 
 ## 研究假设
 {selected_hypo['hypothesis']}
@@ -454,7 +526,7 @@ def step3_final_export():
 成本：{selected_route['estimated_cost']}
 时间：{selected_route['timeline']}
 
-{'## 用户微调\n' + selected_route['custom_modifications'] if 'custom_modifications' in selected_route else ''}
+{custom_section}
 
 请生成包含以下部分的开题报告：
 1. 标题
@@ -471,22 +543,33 @@ def step3_final_export():
 
 请确保内容专业、逻辑清晰、格式规范。"""
 
-                response = client.chat.completions.create(
-                    model=model_name,
-                    messages=[
-                        {"role": "system", "content": "你是一个专业的学术写作专家，擅长撰写高质量的开题报告和研究计划。"},
-                        {"role": "user", "content": prompt}
-                    ],
-                    max_tokens=4000,
-                    temperature=0.4
-                )
+            stream = stream_chat_completion(
+                client,
+                model_name,
+                messages=[
+                    {"role": "system", "content": "你是一个专业的学术写作专家，擅长撰写高质量的开题报告和研究计划。"},
+                    {"role": "user", "content": prompt}
+                ],
+                max_tokens=max_tokens,
+                temperature=temperature,
+                use_cache=not fresh_generation,
+                prompt_version=PROMPT_VERSION,
+                labels={"page": "proposal_wizard", "mode": "final_proposal"}
+            )
 
-                proposal_content = response.choices[0].message.content.strip()
-                st.session_state.data['final_proposal'] = proposal_content
-                st.success("✅ 开题报告生成完成！")
+            # 边生成边预览，完成后由下方的终稿区域统一展示
+            preview_placeholder = st.empty()
+            with preview_placeholder.container():
+                st.write_stream(stream)
+            preview_placeholder.empty()
 
-            except Exception as e:
-                st.error(f"生成开题报告时出现错误：{str(e)}")
+            proposal_content = stream.text
+            st.session_state.data['final_proposal'] = proposal_content
+            st.success("✅ 开题报告生成完成！")
+            st.caption(format_stream_stats(stream))
+
+        except Exception as e:
+            st.error(f"生成开题报告时出现错误：{str(e)}")
 
     # 显示终稿
     if st.session_state.data['final_proposal']:
@@ -593,23 +676,14 @@ elif st.session_state.step == 3:
 st.markdown("---")
 navigation_buttons()
 
-# 侧边栏高级设置
-st.sidebar.markdown("### ⚙️ 高级设置")
-temperature = st.sidebar.slider(
-    "创造性 (Temperature):",
-    min_value=0.0,
-    max_value=1.0,
-    value=0.5,
-    step=0.1,
-    help="控制生成的创造性"
-)
-
 # 显示当前配置
 st.sidebar.markdown("---")
 st.sidebar.markdown("### 🔧 当前进度")
 st.sidebar.write(f"**当前步骤**: {st.session_state.step}/3")
 st.sidebar.write(f"**模型**: {model_name}")
 st.sidebar.write(f"**Temperature**: {temperature}")
+st.sidebar.write(f"**Max Tokens**: {max_tokens}")
+st.sidebar.write(f"**补全缓存**: {format_cache_stats()}")
 st.sidebar.write(f"**创建时间**: {st.session_state.data['timestamp']}")
 
 # 数据状态显示
@@ -654,6 +728,7 @@ st.sidebar.markdown("### 📊 连接状态")
 if get_valid_api_key():
     st.sidebar.success("✅ API Key 已配置")
     st.sidebar.write(f"🔗 Base URL: {user_base_url if user_base_url else 'https://api.deepseek.com'}")
+    st.sidebar.write(f"🩺 上游状态: {format_upstream_health(user_base_url.strip() if user_base_url else DEFAULT_BASE_URL)}")
 else:
     st.sidebar.warning("⚠️ 需要配置 API Key")
     st.sidebar.info("请在左侧输入 API Key")
@@ -0,0 +1,154 @@
+import hmac
+
+import pandas as pd
+import streamlit as st
+from utils.completion_cache import get_completion_cache
+from utils.config import get_setting
+from utils.metrics import ensure_metrics_server, get_llm_metrics, render_all_metrics
+from utils.resilience import get_upstream_health
+from utils.single_flight import get_single_flight
+from utils.text_store import get_text_store
+
+# 设置页面配置
+st.set_page_config(
+    page_title="性能监控",
+    page_icon="📊",
+    layout="wide"
+)
+
+# 页面标题
+st.title("📊 性能监控面板")
+st.markdown("---")
+
+# Prometheus 抓取端点
+metrics_port = ensure_metrics_server()
+if metrics_port:
+    st.sidebar.success(f"Prometheus 端点：`:{metrics_port}/metrics`")
+else:
+    st.sidebar.warning("Prometheus 端点未启用（METRICS_PORT=0 或端口被占用）")
+
+# 统计窗口
+window_label = st.sidebar.radio(
+    "统计窗口:",
+    options=["最近 5 分钟", "最近 15 分钟", "最近 60 分钟"],
+    index=1
+)
+window_seconds = {"最近 5 分钟": 300, "最近 15 分钟": 900, "最近 60 分钟": 3600}[window_label]
+
+if st.sidebar.button("🔄 刷新", use_container_width=True):
+    st.rerun()
+
+metrics = get_llm_metrics()
+samples = metrics.samples(window_seconds)
+
+# 总览
+total = len(samples)
+errors = sum(1 for s in samples if s["error"])
+cache_hits = sum(1 for s in samples if s["source"] == "cache")
+col1, col2, col3, col4 = st.columns(4)
+col1.metric("请求数", total)
+col2.metric("错误率", f"{errors / total:.1%}" if total else "-")
+col3.metric("缓存命中", cache_hits)
+col4.metric("进行中的请求", get_single_flight().in_flight())
+
+if not samples:
+    st.info("统计窗口内还没有 LLM 调用记录，去其他页面用一用再回来看看吧。")
+
+
+def summary_table(group_by):
+    """把分位数汇总整理成表格（耗时单位：秒）"""
+    rows = metrics.summarize(window_seconds, group_by=group_by)
+    if not rows:
+        return None
+    return pd.DataFrame(rows).rename(columns={
+        "page": "页面",
+        "model": "模型",
+        "mode": "模式",
+        "requests": "请求数",
+        "errors": "错误数",
+        "cache_hits": "缓存命中",
+        "latency_p50": "总耗时 p50",
+        "latency_p95": "总耗时 p95",
+        "latency_p99": "总耗时 p99",
+        "ttft_p50": "首字 p50",
+        "ttft_p95": "首字 p95",
+        "ttft_p99": "首字 p99",
+        "queue_wait_p50": "排队 p50",
+        "queue_wait_p95": "排队 p95",
+        "queue_wait_p99": "排队 p99",
+        "prompt_tokens": "输入 tokens",
+        "completion_tokens": "输出 tokens",
+        "cached_tokens": "上下文缓存 tokens"
+    })
+
+
+if samples:
+    st.markdown("### 📄 按页面")
+    st.dataframe(summary_table(("page", "mode")), use_container_width=True, hide_index=True)
+
+    st.markdown("### 🤖 按模型")
+    st.dataframe(summary_table(("model",)), use_container_width=True, hide_index=True)
+
+    recent_errors = [s for s in samples if s["error"]][-20:]
+    if recent_errors:
+        st.markdown("### ❗ 最近的错误")
+        st.dataframe(
+            pd.DataFrame(recent_errors)[["timestamp", "page", "mode", "model", "error"]].assign(
+                timestamp=lambda df: pd.to_datetime(df["timestamp"], unit="s")
+            ),
+            use_container_width=True,
+            hide_index=True
+        )
+
+st.markdown("---")
+
+# 补全缓存与上游健康
+cache_col, upstream_col = st.columns(2)
+with cache_col:
+    st.markdown("### 💾 补全缓存")
+    completion_cache = get_completion_cache()
+    cache_stats = completion_cache.stats()
+    st.markdown(f"""
+- **命中 / 未命中**: {cache_stats['hits']} / {cache_stats['misses']}（{cache_stats['hit_rate']:.0%}）
+- **条目数**: {cache_stats['entries']}
+- **占用**: {cache_stats['bytes'] / 1024 / 1024:.2f} MB
+""")
+
+    # 上游模型更新或提示词出错后清空缓存，让所有请求重新调用 API（命中统计保留）
+    # 清空影响所有用户，只有配置了 ADMIN_PASSWORD 并输入正确时才可操作
+    admin_password = get_setting("ADMIN_PASSWORD")
+    if not admin_password:
+        st.caption("配置 ADMIN_PASSWORD 后可在此清空补全缓存")
+    else:
+        entered_password = st.text_input("管理员密码:", type="password", key="cache_admin_password")
+        if st.button("🗑️ 清空补全缓存", type="secondary", help="删除全部已缓存的补全结果，之后的请求都会重新调用 API"):
+            if hmac.compare_digest(entered_password.encode("utf-8"), admin_password.encode("utf-8")):
+                completion_cache.clear()
+                st.success("✅ 补全缓存已清空")
+            else:
+                st.error("管理员密码不正确")
+
+with upstream_col:
+    st.markdown("### 🩺 上游状态")
+    upstream_health = get_upstream_health()
+    if upstream_health:
+        st.dataframe(
+            pd.DataFrame.from_dict(upstream_health, orient="index").rename_axis("base_url").reset_index(),
+            use_container_width=True,
+            hide_index=True
+        )
+    else:
+        st.caption("暂无上游调用记录")
+
+# 论文文本存储：各会话只保存内容哈希，同一篇论文在进程内只存一份
+st.markdown("### 📦 论文文本存储")
+text_report = get_text_store().memory_report()
+st.markdown(f"""
+- **内存中的论文**: {text_report['papers']} 篇，占用 {text_report['resident_bytes'] / 1024 / 1024:.2f} / {text_report['max_bytes'] / 1024 / 1024:.0f} MB
+- **活跃会话**: {text_report['sessions']} 个，正在查看 {text_report['viewed_papers']} 篇论文
+- **共享节省**: 各会话各存一份需 {text_report['per_session_bytes'] / 1024 / 1024:.2f} MB，共享后 {text_report['shared_bytes'] / 1024 / 1024:.2f} MB，节省 {text_report['saved_bytes'] / 1024 / 1024:.2f} MB
+- **命中 / 未命中**: {text_report['hits']} / {text_report['misses']}（未命中时从解析缓存或文献库重新读取）
+""")
+
+with st.expander("📜 Prometheus 指标原文"):
+    st.code(render_all_metrics(), language="text")
@@ -0,0 +1,63 @@
+from utils.boilerplate import EDGE_LINES, line_key, strip_boilerplate
+
+
+def _unique(*numbers):
+    """不含数字的唯一词：line_key 会把数字归一化，正文行不能只靠数字区分"""
+    return "".join(chr(ord("a") + int(digit)) for digit in "".join(f"{n:02d}" for n in numbers))
+
+
+def _page(number, header=None, body_lines=8):
+    lines = [header] if header else []
+    lines += [f"Body sentence {_unique(number, i)} about something specific." for i in range(body_lines)]
+    lines.append(str(number))
+    return "\n".join(lines)
+
+
+def test_line_key_ignores_page_numbers_and_spacing():
+    assert line_key("Page 3 of 12") == line_key("page  4 of 12")
+    assert line_key("12 Smith et al.") == line_key("Smith et al. 13")
+    assert line_key("  17 ") == "#"
+
+
+def test_header_on_minimum_page_count_keeps_first_occurrence_only():
+    pages = [_page(n, "Journal of Stuff" if n < 3 else None) for n in range(10)]
+
+    stripped, report = strip_boilerplate(pages)
+
+    assert stripped[0].startswith("Journal of Stuff\n")
+    assert "Journal of Stuff" not in stripped[1] + stripped[2]
+    # 页码行（归一化为 "#"）出现在每页，同样只保留第一页的
+    assert stripped[0].endswith("\n0")
+    assert not stripped[5].endswith("\n5")
+    assert report["lines"] == 2 + 9
+    assert report["chars"] > 0 and report["tokens"] > 0
+
+
+def test_lines_below_repeat_thresholds_are_kept():
+    # 两页重复不到 MIN_REPEAT_PAGES
+    pages = [_page(n, "Running title" if n < 2 else None) for n in range(4)]
+    stripped, _ = strip_boilerplate(pages)
+    assert all("Running title" in page for page in stripped[:2])
+
+    # 20 页中 5 页重复，不到 MIN_REPEAT_RATIO（6 页）
+    pages = [_page(n, "Odd header" if n < 5 else None) for n in range(20)]
+    stripped, _ = strip_boilerplate(pages)
+    assert all("Odd header" in page for page in stripped[:5])
+
+    pages = [_page(n, "Odd header" if n < 6 else None) for n in range(20)]
+    stripped, _ = strip_boilerplate(pages)
+    assert sum("Odd header" in page for page in stripped) == 1
+
+
+def test_repeated_lines_away_from_page_edges_are_kept():
+    repeated = "We repeat this sentence in the middle of every page."
+    pages = []
+    for n in range(6):
+        lines = [f"Unique line {_unique(n, i)} with distinct words." for i in range(2 * EDGE_LINES + 2)]
+        lines.insert(EDGE_LINES + 1, repeated)
+        pages.append("\n".join(lines))
+
+    stripped, report = strip_boilerplate(pages)
+
+    assert stripped == pages
+    assert report["lines"] == 0
@@ -0,0 +1,85 @@
+from utils.chat_memory import ConversationMemory
+from utils.tokenizer import estimate_messages_tokens
+
+
+def _conversation(turns, words=30):
+    messages = []
+    for i in range(turns):
+        messages.append({"role": "user", "content": f"question {i} " + "about the method " * words})
+        messages.append({"role": "assistant", "content": f"answer {i} " + "the paper shows " * words})
+    return messages
+
+
+class _Summarizer:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, summary, folded):
+        self.calls.append((summary, folded))
+        return f"summary {len(self.calls)}"
+
+
+def test_short_conversation_needs_no_compaction():
+    memory = ConversationMemory(budget_tokens=2000, keep_recent=4)
+
+    assert not memory.needs_compaction(_conversation(2))
+    assert memory.build_history(_conversation(2)) == _conversation(2)
+
+
+def test_compact_folds_whole_turns_and_keeps_recent_messages():
+    messages = _conversation(8)
+    memory = ConversationMemory(budget_tokens=estimate_messages_tokens(messages) // 2, keep_recent=4)
+    summarize = _Summarizer()
+    assert memory.needs_compaction(messages)
+
+    memory.compact(messages, summarize)
+
+    assert messages[memory.summarized_count]["role"] == "user"
+    assert len(messages) - memory.summarized_count >= memory.keep_recent
+    assert summarize.calls == [("", messages[:memory.summarized_count])]
+    assert estimate_messages_tokens(messages[memory.summarized_count:]) <= memory.budget_tokens // 2
+    assert not memory.needs_compaction(messages)
+
+
+def test_compact_never_folds_past_keep_recent():
+    # 最近几条本身就超出预算时也至少保留 keep_recent 条原文
+    messages = _conversation(4, words=200)
+    memory = ConversationMemory(budget_tokens=100, keep_recent=4)
+
+    memory.compact(messages, _Summarizer())
+
+    assert memory.summarized_count == len(messages) - 4
+    history = memory.build_history(messages)
+    assert history[0] == {"role": "system", "content": "此前对话的摘要：\nsummary 1"}
+    # 超长的原文被截断或丢弃，历史不会以助手消息开头，也不超出预算
+    assert [message["role"] for message in history[1:2]] in ([], ["user"])
+    assert estimate_messages_tokens(history[1:]) <= memory.budget_tokens
+
+
+def test_second_compaction_extends_the_summary_and_skips_errors():
+    messages = _conversation(6)
+    memory = ConversationMemory(budget_tokens=estimate_messages_tokens(messages) // 2, keep_recent=2)
+    summarize = _Summarizer()
+    memory.compact(messages, summarize)
+    first_count = memory.summarized_count
+
+    messages += [{"role": "assistant", "content": "request failed", "error": True}]
+    messages += _conversation(6)[:6]
+    memory.compact(messages, summarize)
+
+    assert len(summarize.calls) == 2
+    previous_summary, folded = summarize.calls[1]
+    assert previous_summary == "summary 1"
+    assert folded == [m for m in messages[first_count:memory.summarized_count] if not m.get("error")]
+    assert messages[memory.summarized_count]["role"] == "user"
+
+
+def test_compact_without_anything_to_fold_keeps_the_summary():
+    messages = _conversation(1)
+    memory = ConversationMemory(budget_tokens=10, keep_recent=4)
+    summarize = _Summarizer()
+
+    memory.compact(messages, summarize)
+
+    assert summarize.calls == []
+    assert memory.summarized_count == 0 and memory.summary == ""
@@ -0,0 +1,44 @@
+from utils.chunked_polish import reassemble, split_draft, with_neighbour_context
+from utils.tokenizer import estimate_tokens
+
+DRAFT = (
+    "Deep models need data. They also need compute!\n\n"
+    "  Indented second paragraph; it keeps going? Yes.\n"
+    "深度学习需要大量数据。模型越大，需要的算力越多！\n\n\n"
+    + "word " * 400 + "\n"
+    + "Final short paragraph.\n"
+)
+
+
+def test_split_draft_is_lossless_and_within_budget():
+    for max_tokens in (8, 40, 200, 5000):
+        chunks = split_draft(DRAFT, max_tokens)
+
+        assert "".join(chunk.text + chunk.suffix for chunk in chunks) == DRAFT
+        assert all(chunk.text and chunk.text == chunk.text.rstrip() for chunk in chunks)
+        assert all(estimate_tokens(chunk.text) <= max_tokens for chunk in chunks)
+
+
+def test_split_draft_merges_short_paragraphs():
+    assert len(split_draft(DRAFT, 5000)) == 1
+    assert split_draft("", 100) == []
+
+
+def test_reassemble_keeps_separators_and_falls_back_to_original():
+    chunks = split_draft("First para.\n\nSecond para.\n\nThird para.", 4)
+    assert [chunk.text for chunk in chunks] == ["First para.", "Second para.", "Third para."]
+
+    results = ["  Polished first.\n", RuntimeError("failed"), ""]
+
+    assert reassemble(chunks, results) == "Polished first.\n\nSecond para.\n\nThird para."
+    assert reassemble(chunks, [chunk.text for chunk in chunks]) == "First para.\n\nSecond para.\n\nThird para."
+
+
+def test_neighbour_context_marks_document_edges():
+    chunks = split_draft("First para.\n\nSecond para.\n\nThird para.", 4)
+
+    first = with_neighbour_context("PROMPT", chunks, 0, 50)
+    middle = with_neighbour_context("PROMPT", chunks, 1, 50)
+
+    assert "part 1 of 3" in first and "(start of document)" in first and "Second para." in first
+    assert "First para." in middle and "Third para." in middle
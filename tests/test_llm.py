@@ -0,0 +1,37 @@
+import asyncio
+import types
+
+import httpx
+import openai
+import pytest
+
+from utils.llm import _async_request
+from utils.rate_limiter import get_rate_limiter
+
+
+def _failing_client(api_key, error):
+    async def create(**kwargs):
+        raise error
+
+    completions = types.SimpleNamespace(create=create)
+    return types.SimpleNamespace(
+        api_key=api_key,
+        base_url="http://upstream-llm.test/v1",
+        chat=types.SimpleNamespace(completions=completions)
+    )
+
+
+def test_failed_async_request_returns_reserved_tokens():
+    request = httpx.Request("POST", "http://upstream-llm.test/v1/chat/completions")
+    error = openai.BadRequestError("bad request", response=httpx.Response(400, request=request), body=None)
+    client = _failing_client("sk-test-settle-on-error", error)
+    limiter = get_rate_limiter(client.api_key)
+    capacity = limiter._tokens.capacity
+
+    with pytest.raises(openai.BadRequestError):
+        asyncio.run(_async_request(
+            client, None, "key", "session", "model",
+            messages=[{"role": "user", "content": "hello"}], max_tokens=4000, temperature=0
+        ))
+
+    assert limiter._tokens.level == capacity
@@ -0,0 +1,49 @@
+from utils.page_map import PageMap, join_pages
+
+
+def _page_map():
+    text, page_offsets = join_pages(["aaaa", "bb", "", "cccc"])
+    return text, PageMap(page_offsets, len(text))
+
+
+def test_join_pages_records_offsets_after_single_spaces():
+    text, page_offsets = join_pages(["aaaa", "bb", "", "cccc"])
+
+    assert text == "aaaa bb  cccc"
+    assert page_offsets == [0, 5, 8, 9]
+    assert join_pages([]) == ("", [])
+
+
+def test_page_of_at_page_boundaries():
+    _, page_map = _page_map()
+
+    assert page_map.page_of(0) == 1
+    assert page_map.page_of(4) == 1
+    assert page_map.page_of(5) == 2
+    assert page_map.page_of(7) == 2
+    # 空页只占它后面的分隔空格一格
+    assert page_map.page_of(8) == 3
+    assert page_map.page_of(9) == 4
+    assert page_map.page_of(12) == 4
+    assert page_map.page_of(100) == 4
+    assert page_map.page_of(-1) == 1
+
+
+def test_pages_between_treats_end_as_exclusive():
+    _, page_map = _page_map()
+
+    assert page_map.pages_between(0, 5) == (1, 1)
+    assert page_map.pages_between(0, 6) == (1, 2)
+    assert page_map.pages_between(3, 3) == (1, 1)
+    assert page_map.label(4, 10) == "第 1-4 页"
+    assert page_map.label(9, 13) == "第 4 页"
+
+
+def test_page_spans_reproduce_each_page():
+    text, page_map = _page_map()
+
+    assert page_map.page_span(1) == (0, 5)
+    assert page_map.page_span(4) == (9, 13)
+    assert [(number, page.strip()) for number, page in page_map.iter_pages(text)] == [
+        (1, "aaaa"), (2, "bb"), (3, ""), (4, "cccc")
+    ]
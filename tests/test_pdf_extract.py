@@ -0,0 +1,49 @@
+import io
+
+import pytest
+from pypdf import PdfWriter
+
+from utils import pdf_sandbox
+from utils.pdf_extract import MAX_BATCH_PAGES, _page_batches, iter_pages
+from utils.pdf_sandbox import FAILURE_CORRUPT, FAILURE_SCANNED, PdfParseError
+
+
+def _blank_pdf(page_count):
+    writer = PdfWriter()
+    for _ in range(page_count):
+        writer.add_blank_page(width=200, height=200)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+def test_blank_pages_arrive_in_order_then_scanned_error():
+    pages = []
+    with pytest.raises(PdfParseError) as error:
+        for page_index, page_count, page_text, headings in iter_pages(_blank_pdf(20), workers=3):
+            pages.append((page_index, page_count))
+
+    assert error.value.kind == FAILURE_SCANNED
+    assert pages == [(i, 20) for i in range(20)]
+
+
+def test_page_batches_cover_every_page_in_small_ordered_batches():
+    batches = list(_page_batches(300, workers=4))
+
+    assert batches[0] == (0, MAX_BATCH_PAGES)
+    assert [page for start, end in batches for page in range(start, end)] == list(range(300))
+    assert len(batches) >= 4 * 4
+    assert list(_page_batches(5, workers=4)) == [(i, i + 1) for i in range(5)]
+
+
+def test_garbage_bytes_report_corrupt():
+    with pytest.raises(PdfParseError) as error:
+        list(iter_pages(b"not a pdf at all", workers=1))
+
+    assert error.value.kind == FAILURE_CORRUPT
+
+
+def test_memory_limit_is_skipped_without_resource_module(monkeypatch):
+    monkeypatch.setattr(pdf_sandbox, "resource", None)
+
+    pdf_sandbox._limit_memory(64 * 1024 * 1024)
@@ -0,0 +1,34 @@
+from utils import pdf_ingest
+from utils.pdf_ingest import IngestJob
+
+
+class _BrokenCache:
+    def set(self, parsed):
+        raise OSError("disk full")
+
+
+class _Library:
+    def __init__(self):
+        self.added = []
+
+    def add(self, parsed, filename):
+        self.added.append((parsed.sha256, filename))
+
+
+def _fake_pages(pdf_bytes):
+    for i in range(3):
+        yield i, 3, f"Page {i + 1} body text about transformers.", []
+
+
+def test_persistence_failure_keeps_result(monkeypatch):
+    monkeypatch.setattr(pdf_ingest, "iter_pages", _fake_pages)
+    library = _Library()
+    job = IngestJob("abc123", b"%PDF", _BrokenCache(), library, "paper.pdf")
+
+    job._run(b"%PDF")
+
+    assert job.done
+    assert job.error is None
+    assert job.result.sha256 == "abc123"
+    assert job.result.page_count == 3
+    assert library.added == [("abc123", "paper.pdf")]
@@ -0,0 +1,60 @@
+import threading
+import time
+
+import pytest
+
+from utils.rate_limiter import FairRateLimiter, _Ticket
+
+
+def test_waiting_sessions_are_served_round_robin():
+    limiter = FairRateLimiter(rpm=600, tpm=1000000)
+    limiter._requests.level = 0
+    served = []
+    lock = threading.Lock()
+
+    def request(session_id, name):
+        limiter.acquire(session_id, 10)
+        with lock:
+            served.append(name)
+
+    threads = []
+    for session_id, name in [("heavy", "a1"), ("heavy", "a2"), ("heavy", "a3"), ("light", "b1")]:
+        thread = threading.Thread(target=request, args=(session_id, name))
+        thread.start()
+        threads.append(thread)
+        time.sleep(0.01)
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert served == ["a1", "b1", "a2", "a3"]
+
+
+def test_service_order_interleaves_sessions_by_depth():
+    limiter = FairRateLimiter(rpm=60, tpm=6000)
+    a1, a2, a3, b1, c1, c2 = (_Ticket(session_id, 1) for session_id in "aaabcc")
+    for ticket in (a1, a2, a3, b1, c1, c2):
+        limiter._queues.setdefault(ticket.session_id, []).append(ticket)
+
+    assert limiter._service_order() == [a1, b1, c1, a2, c2, a3]
+
+
+def test_eta_counts_requests_and_tokens_ahead():
+    limiter = FairRateLimiter(rpm=60, tpm=6000)
+    limiter._requests.level = 0
+    limiter._tokens.level = 0
+    ahead = [_Ticket("a", 1000), _Ticket("b", 1000)]
+
+    # 请求桶每秒补 1 个，token 桶每秒补 100 个：3 个请求要 3 秒，3000 tokens 要 30 秒
+    assert limiter._estimate_wait(ahead, _Ticket("c", 1000)) == pytest.approx(30.0)
+
+    limiter._tokens.level = 6000
+    assert limiter._estimate_wait(ahead, _Ticket("c", 1000)) == pytest.approx(3.0)
+    assert limiter._estimate_wait([], _Ticket("c", 1000)) == pytest.approx(1.0)
+
+
+def test_try_acquire_never_jumps_the_queue():
+    limiter = FairRateLimiter(rpm=60, tpm=6000)
+
+    assert limiter.try_acquire(1000)
+    limiter._queues["waiting"] = [_Ticket("waiting", 10)]
+    assert not limiter.try_acquire(10)
@@ -0,0 +1,83 @@
+from utils.references import ReferenceTable, format_reference_note, parse_reference, split_entries
+
+NUMBERED = (
+    "References [1] Smith, J., Wang, L. and Brown, K. (2001). Deep transformer for method efficient. "
+    "In Proceedings of NeurIPS, pp. 10-19. "
+    "[2] A. Vaswani, N. Shazeer, and J.-P. Doe, \"Attention is all you need,\" in Advances in NIPS, vol. 30, 2017. "
+    "--- Page 3 --- [3] Devlin J, Chang MW, Lee K. BERT: Pre-training of deep bidirectional transformers. "
+    "NAACL. 2019;1:4171-4186."
+)
+
+APA = (
+    "Bibliography Smith, J., & Doe, A. (2020). A study of things. Journal of Stuff, 12(3), 1-10. "
+    "Lee, K. (2019b). Another paper on topics. Nature, 5, 22-30."
+)
+
+ACL = (
+    "References Tom B. Brown, Benjamin Mann, and Nick Ryder. 2020. Language models are few-shot learners. "
+    "In Advances in Neural Information Processing Systems, pages 1877-1901. "
+    "Jacob Devlin, Ming-Wei Chang, Kenton Lee, and Kristina Toutanova. 2019. BERT: Pre-training of deep "
+    "bidirectional transformers for language understanding. In Proceedings of NAACL, pages 4171-4186. "
+    "Ashish Vaswani et al. 2017. Attention is all you need. In NIPS."
+)
+
+
+def _parse(text):
+    return [parse_reference(label, raw) for label, raw in split_entries(text)]
+
+
+def test_numbered_entries_keep_labels():
+    references = _parse(NUMBERED)
+
+    assert [reference.label for reference in references] == ["1", "2", "3"]
+    assert [reference.year for reference in references] == [2001, 2017, 2019]
+    assert references[1].title == "Attention is all you need"
+    assert references[2].surnames() == {"devlin", "chang", "lee"}
+
+
+def test_apa_entries_split_on_author_start():
+    references = _parse(APA)
+
+    assert [(reference.authors, reference.year) for reference in references] == [
+        ("Smith, J., & Doe, A", 2020),
+        ("Lee, K", 2019),
+    ]
+
+
+def test_acl_entries_split_before_author_list():
+    references = _parse(ACL)
+
+    assert [reference.year for reference in references] == [2020, 2019, 2017]
+    assert references[0].authors == "Tom B. Brown, Benjamin Mann, and Nick Ryder"
+    assert references[0].title == "Language models are few-shot learners"
+    assert references[0].surnames() == {"brown", "mann", "ryder"}
+    assert references[1].surnames() == {"devlin", "chang", "lee", "toutanova"}
+    assert references[2].authors == "Ashish Vaswani et al"
+    assert references[2].venue == "NIPS"
+
+
+def test_table_matches_acl_authors_in_question():
+    table = ReferenceTable(_parse(ACL))
+
+    assert [reference.year for reference in table.match_question("What did Mann et al. (2020) show?")] == [2020]
+    assert [reference.year for reference in table.search("Devlin 2019")] == [2019]
+
+
+def test_reference_note_contains_formatted_entries():
+    references = _parse(NUMBERED)
+
+    note = format_reference_note(references, max_tokens=1500)
+
+    assert note.startswith("\n[论文参考文献表中的相关条目]\n")
+    for reference in references:
+        assert reference.format() in note
+
+
+def test_reference_note_truncates_to_budget():
+    references = _parse(NUMBERED)
+
+    note = format_reference_note(references, max_tokens=10)
+
+    assert references[0].format()[:10] in note
+    assert references[2].format() not in note
+    assert format_reference_note([], max_tokens=1500) == ""
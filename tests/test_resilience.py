@@ -0,0 +1,145 @@
+import asyncio
+import itertools
+import threading
+
+import httpx
+import openai
+import pytest
+
+from utils.rate_limiter import FairRateLimiter
+from utils.resilience import (
+    CircuitBreaker, CircuitOpenError, RetryPolicy, acall_with_retry, call_with_retry, get_circuit_breaker, hedged_call
+)
+
+_NO_RETRY = RetryPolicy(max_attempts=1, base_delay=0, max_delay=0)
+_urls = itertools.count()
+
+
+def _status_error(cls, status_code):
+    request = httpx.Request("POST", "http://upstream.test/v1/chat/completions")
+    return cls("error", response=httpx.Response(status_code, request=request), body=None)
+
+
+def _raise(error):
+    def fn():
+        raise error
+    return fn
+
+
+def _tripped_breaker():
+    """连续 503 打开熔断器，并让冷却期立即结束，下一个请求即为半开探测"""
+    base_url = f"http://upstream-{next(_urls)}.test"
+    breaker = get_circuit_breaker(base_url)
+    for _ in range(breaker.failure_threshold):
+        with pytest.raises(openai.InternalServerError):
+            call_with_retry(_raise(_status_error(openai.InternalServerError, 503)), base_url, _NO_RETRY)
+    assert breaker.state == CircuitBreaker.OPEN
+    breaker.reset_timeout = 0
+    return base_url, breaker
+
+
+def test_probe_rate_limited_then_next_call_goes_through():
+    base_url, breaker = _tripped_breaker()
+
+    with pytest.raises(openai.RateLimitError):
+        call_with_retry(_raise(_status_error(openai.RateLimitError, 429)), base_url, _NO_RETRY)
+
+    assert call_with_retry(lambda: "ok", base_url, _NO_RETRY) == "ok"
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_probe_bad_request_does_not_wedge_breaker():
+    base_url, breaker = _tripped_breaker()
+
+    with pytest.raises(openai.BadRequestError):
+        call_with_retry(_raise(_status_error(openai.BadRequestError, 400)), base_url, _NO_RETRY)
+
+    assert call_with_retry(lambda: "ok", base_url, _NO_RETRY) == "ok"
+
+
+def test_cancelled_async_probe_releases_breaker():
+    base_url, breaker = _tripped_breaker()
+
+    async def cancelled():
+        raise asyncio.CancelledError()
+
+    async def ok():
+        return "ok"
+
+    async def scenario():
+        with pytest.raises(asyncio.CancelledError):
+            await acall_with_retry(cancelled, base_url, _NO_RETRY)
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        return await acall_with_retry(ok, base_url, _NO_RETRY)
+
+    assert asyncio.run(scenario()) == "ok"
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_concurrent_request_rejected_while_probe_in_flight():
+    base_url, breaker = _tripped_breaker()
+    assert breaker.before_call() is True
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def _slow_then_fast():
+    """第一次调用阻塞到 release 被设置，之后的调用立即返回"""
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(len(calls))
+        if len(calls) == 1:
+            release.wait(timeout=5)
+            return "primary"
+        return "backup"
+    return fn, release, calls
+
+
+def test_hedge_skipped_while_breaker_half_open():
+    base_url, breaker = _tripped_breaker()
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    fn, release, calls = _slow_then_fast()
+    threading.Timer(0.2, release.set).start()
+
+    assert hedged_call(fn, base_url, hedge_after=0.05) == "primary"
+    assert len(calls) == 1
+
+
+def test_hedge_skipped_without_backup_quota():
+    base_url = f"http://upstream-{next(_urls)}.test"
+    limiter = FairRateLimiter(rpm=1, tpm=1000)
+    assert limiter.try_acquire(100)
+    fn, release, calls = _slow_then_fast()
+    threading.Timer(0.2, release.set).start()
+
+    result = hedged_call(fn, base_url, hedge_after=0.05, reserve=lambda: limiter.try_acquire(100))
+
+    assert result == "primary"
+    assert len(calls) == 1
+
+
+def test_backup_reserves_quota_and_refunds_on_failure():
+    base_url = f"http://upstream-{next(_urls)}.test"
+    limiter = FairRateLimiter(rpm=60, tpm=1000)
+    release = threading.Event()
+    backup_failed = threading.Event()
+
+    def fn():
+        if not release.is_set():
+            release.set()
+            backup_failed.wait(timeout=5)
+            return "primary"
+        raise RuntimeError("backup failed")
+
+    def refund():
+        limiter.settle(300, 0)
+        backup_failed.set()
+
+    result = hedged_call(fn, base_url, hedge_after=0.05, reserve=lambda: limiter.try_acquire(300), refund=refund)
+
+    assert result == "primary"
+    assert limiter._requests.level < 60
+    assert limiter._tokens.level == pytest.approx(1000, abs=1)
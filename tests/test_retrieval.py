@@ -0,0 +1,62 @@
+from utils.page_map import join_pages
+from utils.retrieval import BM25Index, chunk_document, tokenize_for_search
+
+PAGES = [
+    "Transformers replace recurrence with attention. " * 6,
+    "The encoder stacks six identical layers. " * 6,
+    "Dropout regularizes the residual connections. " * 6,
+]
+
+
+def _chunks(chunk_chars=200, overlap_chars=40):
+    text, page_offsets = join_pages(PAGES)
+    return text, page_offsets, chunk_document(text, page_offsets, chunk_chars, overlap_chars)
+
+
+def test_chunks_overlap_and_cover_the_whole_text():
+    text, _, chunks = _chunks()
+
+    assert chunks[0].start == 0
+    assert chunks[-1].end == len(text)
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert previous.start < chunk.start < previous.end
+    for chunk in chunks:
+        assert chunk.text == text[chunk.start:chunk.end].strip()
+        # 切分点落在句末
+        assert chunk.end == len(text) or text[chunk.end - 1] == "."
+
+
+def test_chunk_pages_match_page_offsets():
+    _, page_offsets, chunks = _chunks()
+
+    def page_of(position):
+        return max(number for number, offset in enumerate(page_offsets, 1) if offset <= position)
+
+    for chunk in chunks:
+        assert chunk.pages == (page_of(chunk.start), page_of(chunk.end - 1))
+    assert chunks[0].page_label() == "第 1 页"
+    assert any(chunk.pages[0] < chunk.pages[1] for chunk in chunks)
+    assert chunks[-1].pages[1] == len(PAGES)
+
+
+def test_chunks_without_page_offsets_have_no_pages():
+    chunks = chunk_document("".join(PAGES), None, 200, 40)
+
+    assert all(chunk.pages is None and chunk.page_label() == "" for chunk in chunks)
+
+
+def test_bm25_ranks_the_chunk_on_the_matching_page_first():
+    _, _, chunks = _chunks()
+    index = BM25Index(chunks)
+
+    best, score = index.search("how does dropout regularize?", k=1)[0]
+
+    assert score > 0
+    assert "Dropout" in best.text
+    assert best.pages[1] == 3
+    assert index.search("nothing relevant here zzz") == []
+
+
+def test_tokenizer_drops_stopwords_and_splits_cjk_into_bigrams():
+    assert tokenize_for_search("The encoder of a Transformer") == ["encoder", "transformer"]
+    assert tokenize_for_search("注意力") == ["注意", "意力"]
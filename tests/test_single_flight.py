@@ -0,0 +1,65 @@
+import threading
+
+import pytest
+
+from utils.single_flight import SingleFlight
+
+
+def test_followers_replay_chunks_and_share_the_result():
+    single_flight = SingleFlight()
+    flight, is_leader = single_flight.join_or_lead("key")
+    follower_flight, follower_is_leader = single_flight.join_or_lead("key")
+
+    assert is_leader and not follower_is_leader
+    assert follower_flight is flight
+
+    flight.publish("a")
+    received = []
+    follower = threading.Thread(target=lambda: received.extend(flight.subscribe()))
+    follower.start()
+    flight.publish("b")
+    flight.finish(usage="usage")
+    follower.join(timeout=5)
+
+    assert received == ["a", "b"]
+    assert flight.usage == "usage"
+
+
+def test_leader_error_is_raised_to_every_follower_after_its_chunks():
+    single_flight = SingleFlight()
+    flight, _ = single_flight.join_or_lead("key")
+    outcomes = []
+
+    def follow():
+        chunks = []
+        try:
+            for chunk in flight.subscribe():
+                chunks.append(chunk)
+        except RuntimeError as e:
+            outcomes.append((chunks, e))
+
+    followers = [threading.Thread(target=follow) for _ in range(3)]
+    for follower in followers:
+        follower.start()
+    flight.publish("partial")
+    error = RuntimeError("upstream failed")
+    flight.finish(error=error)
+    for follower in followers:
+        follower.join(timeout=5)
+
+    assert outcomes == [(["partial"], error)] * 3
+    with pytest.raises(RuntimeError):
+        list(flight.subscribe())
+
+
+def test_forget_only_removes_the_same_flight():
+    single_flight = SingleFlight()
+    old, _ = single_flight.join_or_lead("key")
+    single_flight.forget("key", old)
+    new, is_leader = single_flight.join_or_lead("key")
+
+    single_flight.forget("key", old)
+
+    assert is_leader and new is not old
+    assert single_flight.in_flight() == 1
+    assert single_flight.join_or_lead("key") == (new, False)
@@ -0,0 +1,49 @@
+import os
+import threading
+import types
+
+from utils.vector_index import VectorStore
+
+
+def _chunks(count, word):
+    return [
+        types.SimpleNamespace(text=f"{word} chunk {i} about attention", start=i * 10, end=i * 10 + 9, pages=[i + 1])
+        for i in range(count)
+    ]
+
+
+def test_concurrent_writers_do_not_clobber_each_other(tmp_path):
+    store = VectorStore(str(tmp_path), dim=64)
+    errors = []
+    start = threading.Barrier(8)
+
+    def write(i):
+        start.wait()
+        try:
+            store.add("paper", _chunks(50, f"writer{i}"))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert store.has("paper", 50)
+    assert store.load("paper").shape == (50, 64)
+    assert [name for name in os.listdir(tmp_path) if name.endswith(".tmp")] == []
+
+
+def test_ensure_rewrites_only_when_chunks_change(tmp_path):
+    store = VectorStore(str(tmp_path), dim=64)
+    store.ensure("paper", _chunks(3, "first"))
+    mtime = os.path.getmtime(store._path("paper"))
+
+    store.ensure("paper", _chunks(3, "first"))
+    assert os.path.getmtime(store._path("paper")) == mtime
+
+    store.ensure("paper", _chunks(5, "second"))
+    assert store.has("paper", 5)
+    assert store.load("paper").shape == (5, 64)
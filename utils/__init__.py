@@ -0,0 +1 @@
+"""科研助手各页面共享的工具模块"""
@@ -0,0 +1,105 @@
+import asyncio
+import concurrent.futures
+import threading
+
+import streamlit as st
+
+from utils.config import get_setting
+from utils.llm_client import create_async_client
+
+
+class AsyncRunner:
+    """后台事件循环
+
+    在独立的守护线程中运行 asyncio 事件循环，并持有 AsyncOpenAI 客户端。
+    Streamlit 脚本线程通过 submit / run / gather 同步地提交协程，
+    所有协程共享一个全局并发上限。
+    """
+
+    def __init__(self, max_concurrency):
+        self.max_concurrency = max_concurrency
+        self.loop = asyncio.new_event_loop()
+        self._clients = {}
+        self._clients_lock = threading.Lock()
+        self._semaphore = None
+        self._thread = threading.Thread(target=self._run_loop, name="llm-async-loop", daemon=True)
+        self._thread.start()
+
+        # 信号量必须在事件循环内创建
+        self._semaphore = self.run(self._create_semaphore())
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    async def _create_semaphore(self):
+        return asyncio.Semaphore(self.max_concurrency)
+
+    async def _guarded(self, coro, timeout):
+        """在并发上限内执行协程，timeout 只计算实际执行时间（不含排队）"""
+        async with self._semaphore:
+            if timeout is None:
+                return await coro
+            return await asyncio.wait_for(coro, timeout)
+
+    def get_async_client(self, api_key, base_url):
+        """获取按 (api_key, base_url) 复用的 AsyncOpenAI 客户端（仅限在事件循环内使用）"""
+        key = (api_key, base_url)
+        with self._clients_lock:
+            if key not in self._clients:
+                self._clients[key] = create_async_client(api_key, base_url)
+            return self._clients[key]
+
+    def submit(self, coro, timeout=None):
+        """提交协程，返回 concurrent.futures.Future；调用 future.cancel() 可取消"""
+        if self._semaphore is None:
+            return asyncio.run_coroutine_threadsafe(coro, self.loop)
+        return asyncio.run_coroutine_threadsafe(self._guarded(coro, timeout), self.loop)
+
+    def run(self, coro, timeout=None):
+        """同步执行单个协程并返回结果"""
+        future = self.submit(coro, timeout)
+        try:
+            return future.result()
+        except BaseException:
+            future.cancel()
+            raise
+
+    def gather(self, coros, timeout=None, per_call_timeout=None, on_done=None):
+        """并发执行多个协程，按提交顺序返回结果
+
+        单个协程失败时，对应位置返回异常对象而不是抛出；
+        总耗时超过 timeout 时取消尚未完成的协程，对应位置为 TimeoutError。
+        on_done(index, result) 在每个协程完成时于调用线程中回调，便于更新进度。
+        """
+        futures = [self.submit(coro, per_call_timeout) for coro in coros]
+        index_of = {future: i for i, future in enumerate(futures)}
+        results = [None] * len(futures)
+
+        try:
+            for future in concurrent.futures.as_completed(futures, timeout=timeout):
+                i = index_of[future]
+                try:
+                    results[i] = future.result()
+                except (Exception, concurrent.futures.CancelledError) as e:
+                    results[i] = e
+                if on_done is not None:
+                    on_done(i, results[i])
+        except concurrent.futures.TimeoutError:
+            for future in futures:
+                if not future.done():
+                    future.cancel()
+                    results[index_of[future]] = TimeoutError("并发调用超时，已取消")
+        except BaseException:
+            # 脚本被中断（如 Streamlit 重新运行）时取消全部未完成的调用
+            for future in futures:
+                future.cancel()
+            raise
+
+        return results
+
+
+@st.cache_resource(show_spinner=False)
+def get_async_runner():
+    """获取进程级共享的后台事件循环"""
+    return AsyncRunner(max_concurrency=get_setting("LLM_MAX_CONCURRENCY", 16, int))
@@ -0,0 +1,75 @@
+import collections
+import re
+
+from utils.tokenizer import estimate_tokens
+
+# 每页只检查开头和结尾的若干个非空行：页眉页脚都在页面边缘，正文中偶然重复的句子不受影响
+EDGE_LINES = 4
+
+# 同一行（归一化后）至少出现在这么多页上，且不少于总页数的这一比例，才视为页眉页脚
+# （奇偶页交替的页眉各占一半页数）
+MIN_REPEAT_PAGES = 3
+MIN_REPEAT_RATIO = 0.3
+
+# 超过该长度的行不会是页眉页脚
+MAX_LINE_CHARS = 200
+
+_DIGITS_RE = re.compile(r"\d+")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def line_key(line):
+    """行的归一化键：忽略大小写和空白，数字统一记为 #，并去掉首尾的页码
+
+    页码、卷期号、DOI 中的数字每页不同，替换后 "Page 3 of 12" 与 "Page 4 of 12"、
+    "12 Smith et al." 与 "Smith et al. 13" 归为同一行；只有页码的行归一化为 "#"。
+    """
+    key = _SPACE_RE.sub(" ", _DIGITS_RE.sub("#", line.lower())).strip(" #|-–—·•")
+    return key or "#"
+
+
+def _edge_lines(lines):
+    """页面开头和结尾若干个非空行的下标"""
+    indices = [i for i, line in enumerate(lines) if line.strip()]
+    return set(indices[:EDGE_LINES] + indices[-EDGE_LINES:])
+
+
+def strip_boilerplate(page_texts):
+    """去掉跨页重复的页眉、页脚（期刊名、running title、页码、版权声明、DOI 等）
+
+    按归一化键统计各行在多少页的边缘出现过，达到阈值的行只保留全文第一次出现，
+    之后各页边缘上的同一行全部删除（第一次出现的往往是首页上的论文标题或期刊信息）。
+    返回 (清理后的各页文本, 报告)，报告为 {"lines": 删除行数, "chars": 删除字符数, "tokens": 约节省的 tokens}。
+    """
+    pages = [(page_text or "").split("\n") for page_text in page_texts]
+    edges = [_edge_lines(lines) for lines in pages]
+
+    page_counts = collections.Counter()
+    for lines, edge in zip(pages, edges):
+        page_counts.update({
+            line_key(lines[i]) for i in edge if len(lines[i].strip()) <= MAX_LINE_CHARS
+        })
+    threshold = max(MIN_REPEAT_PAGES, MIN_REPEAT_RATIO * len(pages))
+    repeated = {key for key, count in page_counts.items() if count >= threshold}
+
+    seen = set()
+    removed = []
+    stripped = []
+    for lines, edge in zip(pages, edges):
+        kept = []
+        for i, line in enumerate(lines):
+            key = line_key(line) if i in edge and len(line.strip()) <= MAX_LINE_CHARS else None
+            if key in repeated and key in seen:
+                removed.append(line)
+                continue
+            if key is not None:
+                seen.add(key)
+            kept.append(line)
+        stripped.append("\n".join(kept))
+
+    removed_text = "\n".join(removed)
+    return stripped, {
+        "lines": len(removed),
+        "chars": len(removed_text),
+        "tokens": estimate_tokens(removed_text),
+    }
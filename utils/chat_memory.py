@@ -0,0 +1,113 @@
+from utils.llm import async_chat_completion
+from utils.tokenizer import estimate_messages_tokens, estimate_tokens, truncate_to_tokens
+
+# 滚动摘要提示词版本（修改提示词后递增，使旧的摘要缓存失效）
+MEMORY_PROMPT_VERSION = "v1"
+
+COMPACTION_INSTRUCTION = """下面是一段关于学术论文的问答对话。请把“已有摘要”和“新增对话”合并成一份新的对话摘要，用中文书写：
+- 保留用户关心的问题、已经得到的结论、涉及的页码和术语
+- 保留尚未解决的问题和用户的偏好
+- 不要逐句复述，控制在 {max_tokens} tokens 以内
+
+已有摘要：
+{summary}
+
+新增对话：
+{turns}"""
+
+
+class ConversationMemory:
+    """对话记忆：最近几轮原文保留，更早的轮次压缩成滚动摘要
+
+    messages[:summarized_count] 已经并入 summary。未压缩部分超出预算时，
+    把最旧的若干条并入摘要，直到原文部分降到预算的一半以下；
+    摘要只在压缩时更新，其余轮次直接复用，每轮的历史开销基本恒定。
+    """
+
+    def __init__(self, budget_tokens, keep_recent=4, summary_max_tokens=400):
+        self.budget_tokens = budget_tokens
+        self.keep_recent = keep_recent
+        self.summary_max_tokens = summary_max_tokens
+        self.summary = ""
+        self.summarized_count = 0
+
+    @staticmethod
+    def _valid(messages):
+        """有效消息（跳过出错的回复），只保留 role / content"""
+        return [{"role": m["role"], "content": m["content"]} for m in messages if not m.get("error")]
+
+    def _recent(self, messages):
+        """尚未压缩的有效消息"""
+        return self._valid(messages[self.summarized_count:])
+
+    def _summary_tokens(self):
+        return estimate_tokens(self.summary) if self.summary else 0
+
+    def needs_compaction(self, messages):
+        recent = self._recent(messages)
+        return (
+            len(recent) > self.keep_recent
+            and self._summary_tokens() + estimate_messages_tokens(recent) > self.budget_tokens
+        )
+
+    def compact(self, messages, summarize):
+        """把较早的消息并入滚动摘要；summarize(旧摘要, 待压缩消息) 返回新摘要"""
+        target = self.budget_tokens // 2
+        fold_until = self.summarized_count
+        while (
+            len(messages) - fold_until > self.keep_recent
+            and estimate_messages_tokens(self._valid(messages[fold_until:])) > target
+        ):
+            fold_until += 1
+        # 问答成对压缩，保留的原文从用户消息开始
+        while fold_until < len(messages) and messages[fold_until]["role"] != "user":
+            fold_until += 1
+
+        folded = self._valid(messages[self.summarized_count:fold_until])
+        if folded:
+            self.summary = summarize(self.summary, folded)
+        self.summarized_count = fold_until
+
+    def build_history(self, messages):
+        """构建要随请求发送的历史：摘要（如有）+ 最近几轮原文，总量不超过预算"""
+        history = []
+        budget = self.budget_tokens
+        if self.summary:
+            history.append({"role": "system", "content": f"此前对话的摘要：\n{self.summary}"})
+            budget -= self._summary_tokens()
+
+        # 从最新的消息往前取，超出预算的更早消息直接丢弃（它们会在下次压缩时并入摘要）
+        recent = []
+        for message in reversed(self._recent(messages)):
+            tokens = estimate_messages_tokens([message])
+            if tokens > budget:
+                if not recent:
+                    # 最近一条本身就超长时截取开头
+                    content = message["content"]
+                    recent.append({"role": message["role"], "content": content[:truncate_to_tokens(content, max(0, budget))]})
+                break
+            recent.append(message)
+            budget -= tokens
+
+        # 保证历史以用户消息开头
+        recent.reverse()
+        while recent and recent[0]["role"] != "user":
+            recent.pop(0)
+        return history + recent
+
+
+def summarize_turns(runner, api_key, base_url, model, summary, turns, max_tokens):
+    """调用模型把已有摘要和新增对话合并成新的滚动摘要（走补全缓存）"""
+    transcript = "\n\n".join(
+        f"{'用户' if turn['role'] == 'user' else '助手'}：{turn['content']}" for turn in turns
+    )
+    return runner.run(async_chat_completion(
+        runner, api_key, base_url, model,
+        messages=[{"role": "user", "content": COMPACTION_INSTRUCTION.format(
+            max_tokens=max_tokens, summary=summary or "（无）", turns=transcript
+        )}],
+        max_tokens=max_tokens,
+        temperature=0.2,
+        prompt_version=MEMORY_PROMPT_VERSION,
+        labels={"page": "pdf_reader", "mode": "chat_memory"}
+    ))
@@ -0,0 +1,148 @@
+import re
+
+from utils.llm import async_chat_completion
+from utils.tokenizer import estimate_tokens, truncate_to_tokens
+
+# 段落分隔（换行及其后的空白）和句子分隔（英文标点后的空白，中文标点之后）
+_PARAGRAPH_RE = re.compile(r"\n\s*")
+_SENTENCE_RE = re.compile(r"(?<=[.!?;])\s+|(?<=[。！？；])\s*")
+
+CONTEXT_TEMPLATE = """This is part {index} of {total} of a longer document that is being processed in parts.
+The preceding and following text is given only for coherence (terminology, tone, transitions):
+do not rewrite, translate or repeat it, and return only the result for the text in the request below.
+
+PRECEDING TEXT (context only):
+{before}
+
+{prompt}
+
+FOLLOWING TEXT (context only):
+{after}"""
+
+
+class DraftChunk:
+    """长文档的一段：text 为去掉末尾空白的原文，suffix 为原文中紧随其后的分隔空白（换行 / 空格）"""
+
+    def __init__(self, raw):
+        self.text = raw.rstrip()
+        self.suffix = raw[len(self.text):]
+
+
+def _split_after(text, pattern):
+    """在 pattern 匹配的分隔符之后切分，分隔符留在前一块末尾，各块拼接后与原文完全一致"""
+    pieces = []
+    start = 0
+    for match in pattern.finditer(text):
+        end = match.end()
+        if start < end < len(text):
+            pieces.append(text[start:end])
+            start = end
+    if start < len(text):
+        pieces.append(text[start:])
+    return pieces
+
+
+def split_draft(text, max_tokens):
+    """把长文按段落切成不超过 max_tokens 的若干段
+
+    优先在段落之间切分，多个短段落合成一段；单个段落超长时在句子之间切分，
+    单句仍超长时按 token 硬切。返回 [DraftChunk]，按顺序拼接 text + suffix 即还原原文。
+    """
+    units = []
+    for paragraph in _split_after(text, _PARAGRAPH_RE):
+        if estimate_tokens(paragraph) <= max_tokens:
+            units.append(paragraph)
+            continue
+        for sentence in _split_after(paragraph, _SENTENCE_RE):
+            while estimate_tokens(sentence) > max_tokens:
+                cut = truncate_to_tokens(sentence, max_tokens) or len(sentence)
+                units.append(sentence[:cut])
+                sentence = sentence[cut:]
+            if sentence:
+                units.append(sentence)
+
+    chunks, current, current_tokens = [], [], 0
+    for unit in units:
+        unit_tokens = estimate_tokens(unit)
+        if current and current_tokens + unit_tokens > max_tokens:
+            chunks.append(DraftChunk("".join(current)))
+            current, current_tokens = [], 0
+        current.append(unit)
+        current_tokens += unit_tokens
+    if current:
+        chunks.append(DraftChunk("".join(current)))
+    return [chunk for chunk in chunks if chunk.text]
+
+
+def _tail(text, max_tokens):
+    """text 末尾不超过 max_tokens 的完整句子"""
+    sentences = _split_after(text, _SENTENCE_RE)
+    kept, tokens = [], 0
+    for sentence in reversed(sentences):
+        tokens += estimate_tokens(sentence)
+        if kept and tokens > max_tokens:
+            break
+        kept.insert(0, sentence)
+    tail = "".join(kept).strip()
+    if estimate_tokens(tail) > max_tokens:
+        # 单句超长时取其末尾（反转后按 token 截取）
+        tail = tail[len(tail) - truncate_to_tokens(tail[::-1], max_tokens):]
+    return tail
+
+
+def _head(text, max_tokens):
+    """text 开头不超过 max_tokens 的完整句子"""
+    sentences = _split_after(text, _SENTENCE_RE)
+    kept, tokens = [], 0
+    for sentence in sentences:
+        tokens += estimate_tokens(sentence)
+        if kept and tokens > max_tokens:
+            break
+        kept.append(sentence)
+    head = "".join(kept).strip()
+    return head[:truncate_to_tokens(head, max_tokens)]
+
+
+def with_neighbour_context(prompt, chunks, index, context_tokens):
+    """给第 index 段的提示词加上前后相邻段落的原文（只作上下文，不参与改写）"""
+    before = _tail(chunks[index - 1].text, context_tokens) if index > 0 else "(start of document)"
+    after = _head(chunks[index + 1].text, context_tokens) if index + 1 < len(chunks) else "(end of document)"
+    return CONTEXT_TEMPLATE.format(index=index + 1, total=len(chunks), before=before, prompt=prompt, after=after)
+
+
+def polish_chunks(runner, api_key, base_url, model, message_lists, max_tokens, temperature,
+                  prompt_version=None, labels=None, on_progress=None, use_cache=True):
+    """并发处理各段（每段一组 messages），按原顺序返回结果
+
+    并发上限由 AsyncRunner（LLM_MAX_CONCURRENCY）统一控制；
+    失败的段对应位置为异常对象，on_progress(已完成段数, 总段数) 在调用线程中回调。
+    """
+    coros = [
+        async_chat_completion(
+            runner, api_key, base_url, model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            prompt_version=prompt_version,
+            use_cache=use_cache,
+            labels=labels
+        )
+        for messages in message_lists
+    ]
+    done = 0
+
+    def on_done(index, result):
+        nonlocal done
+        done += 1
+        if on_progress is not None:
+            on_progress(done, len(coros))
+
+    return runner.gather(coros, on_done=on_done)
+
+
+def reassemble(chunks, results):
+    """按原顺序拼回全文：各段之间保留原文的分隔空白，失败或结果为空的段保留原文"""
+    return "".join(
+        (result.strip() if isinstance(result, str) and result.strip() else chunk.text) + chunk.suffix
+        for chunk, result in zip(chunks, results)
+    ).strip()
@@ -0,0 +1,138 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import streamlit as st
+
+from utils.config import get_cache_dir, get_setting
+
+
+class CompletionCache:
+    """内容寻址的补全结果缓存
+
+    以 (base_url, model, messages, temperature, max_tokens, 提示词版本) 的哈希为键，
+    持久化到 SQLite；按总字节数做 LRU 淘汰，并支持 TTL 过期。
+    """
+
+    def __init__(self, path, max_bytes, ttl_seconds):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS completions (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_completions_accessed ON completions (accessed_at)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(base_url, model, messages, temperature, max_tokens, prompt_version):
+        """计算请求指纹"""
+        payload = json.dumps(
+            {
+                "base_url": base_url,
+                "model": model,
+                "messages": messages,
+                "temperature": temperature,
+                "max_tokens": max_tokens,
+                "prompt_version": prompt_version
+            },
+            ensure_ascii=False,
+            sort_keys=True
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """读取缓存，未命中或已过期返回 None"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM completions WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is None or now - row[1] > self.ttl_seconds:
+                if row is not None:
+                    self._conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+
+            self._conn.execute("UPDATE completions SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def set(self, key, value, model=None):
+        """写入缓存，并按 TTL 和容量上限淘汰旧条目"""
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completions (key, model, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, value, size, now, now)
+            )
+            self._conn.execute("DELETE FROM completions WHERE created_at < ?", (now - self.ttl_seconds,))
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """按最近访问时间淘汰，直到总大小不超过上限"""
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        rows = self._conn.execute("SELECT key, size FROM completions ORDER BY accessed_at ASC").fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+            total -= size
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._conn.execute("DELETE FROM completions")
+            self._conn.commit()
+
+    def stats(self):
+        """返回命中统计和占用情况"""
+        with self._lock:
+            entries, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM completions"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": total
+        }
+
+
+@st.cache_resource(show_spinner=False)
+def get_completion_cache():
+    """获取进程级共享的补全缓存"""
+    return CompletionCache(
+        os.path.join(get_cache_dir(), "completions.sqlite3"),
+        max_bytes=get_setting("COMPLETION_CACHE_MAX_MB", 256, float) * 1024 * 1024,
+        ttl_seconds=get_setting("COMPLETION_CACHE_TTL_HOURS", 24 * 7, float) * 3600
+    )
+
+
+def is_cacheable_temperature(temperature):
+    """温度过高时输出不确定，默认不缓存（阈值可配置）"""
+    return temperature <= get_setting("COMPLETION_CACHE_MAX_TEMPERATURE", 0.5, float)
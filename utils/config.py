@@ -0,0 +1,36 @@
+import os
+
+import streamlit as st
+
+
+def get_setting(name, default=None, cast=None):
+    """读取配置项，优先级：环境变量 > st.secrets > 默认值"""
+    value = os.environ.get(name)
+
+    if value is None:
+        try:
+            value = st.secrets[name]
+        except Exception:
+            value = None
+
+    if value is None:
+        return default
+
+    if cast is not None:
+        try:
+            return cast(value)
+        except (TypeError, ValueError):
+            return default
+
+    return value
+
+
+def get_cache_dir(*parts):
+    """获取本地缓存目录（默认位于项目根目录下的 .cache），不存在时自动创建"""
+    root = get_setting(
+        "CACHE_DIR",
+        os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache")
+    )
+    path = os.path.join(root, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
@@ -0,0 +1,383 @@
+import asyncio
+import itertools
+import threading
+import time
+
+import streamlit as st
+
+from utils.completion_cache import CompletionCache, get_completion_cache, is_cacheable_temperature
+from utils.config import get_setting
+from utils.metrics import ensure_metrics_server, get_llm_metrics
+from utils.rate_limiter import get_rate_limiter
+from utils.resilience import acall_with_retry, call_with_retry, hedged_call
+from utils.session import get_session_id
+from utils.single_flight import get_single_flight
+from utils.tokenizer import estimate_messages_tokens
+
+
+class ChatStream:
+    """流式对话补全
+
+    可直接传给 st.write_stream 逐字渲染；迭代结束后可读取完整文本、
+    首字延迟 (TTFT)、总耗时和 token 用量。
+    启用缓存时，相同请求直接回放缓存结果，不再调用 API。
+    首个 chunk 到达前的失败会自动退避重试；hedge=True 时，首字迟迟未到会发起对冲请求。
+    请求前先在 API Key 共享的限流器中排队，排队期间在页面上显示排队位置。
+    进程内已有相同请求在生成时，直接订阅它的输出（包括已生成的部分）。
+    每次调用结束后按 labels（page / mode）记录指标，见 utils.metrics。
+    """
+
+    def __init__(self, client, model, messages, max_tokens, temperature, prompt_version=None, use_cache=True, hedge=False, labels=None):
+        self.client = client
+        self.model = model
+        self.messages = messages
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.prompt_version = prompt_version
+        self.use_cache = use_cache and is_cacheable_temperature(temperature)
+        self.hedge = hedge
+        self.labels = labels or {}
+
+        self.text = ""
+        self.ttft = None
+        self.latency = None
+        self.usage = None
+        self.cached = False
+        self.coalesced = False
+        self.queue_wait = 0.0
+        self._queue_placeholder = None
+
+    def cache_key(self):
+        """当前请求的缓存指纹"""
+        return CompletionCache.make_key(
+            str(self.client.base_url),
+            self.model,
+            self.messages,
+            self.temperature,
+            self.max_tokens,
+            self.prompt_version
+        )
+
+    def _show_queue_status(self, position, eta):
+        """限流排队时显示排队位置和预计等待时间"""
+        if self._queue_placeholder is None:
+            self._queue_placeholder = st.empty()
+        self._queue_placeholder.info(f"⏳ 当前请求较多，正在排队：前方还有 {position} 个请求，预计等待约 {eta:.0f} 秒")
+
+    def _wait_for_quota(self, reserved_tokens):
+        """在限流器中排队，返回限流器以便结束后结算实际用量"""
+        limiter = get_rate_limiter(self.client.api_key)
+        self.queue_wait = limiter.acquire(get_session_id(), reserved_tokens, on_wait=self._show_queue_status)
+        if self._queue_placeholder is not None:
+            self._queue_placeholder.empty()
+        return limiter
+
+    def _create(self):
+        """发起流式请求"""
+        return self.client.chat.completions.create(
+            model=self.model,
+            messages=self.messages,
+            max_tokens=self.max_tokens,
+            temperature=self.temperature,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+
+    def _open_stream(self):
+        """发起请求并等待首个 chunk，返回 (response, chunk 迭代器)
+
+        首个 chunk 到达即说明上游已开始生成，此前的错误都可以安全重试。
+        """
+        response = self._create()
+        chunks = iter(response)
+        try:
+            first = next(chunks)
+        except StopIteration:
+            return response, iter(())
+        return response, itertools.chain([first], chunks)
+
+    def _open_resilient(self, limiter, reserved_tokens):
+        """带重试、熔断（以及可选对冲）的 _open_stream；对冲请求单独向限流器预留配额"""
+        base_url = str(self.client.base_url).rstrip("/")
+
+        def open_with_retry():
+            return call_with_retry(self._open_stream, base_url)
+
+        if not self.hedge:
+            return open_with_retry()
+        return hedged_call(
+            open_with_retry,
+            base_url,
+            hedge_after=get_setting("LLM_HEDGE_AFTER_SECONDS", 4.0, float),
+            on_discard=lambda opened: opened[0].close(),
+            reserve=lambda: limiter.try_acquire(reserved_tokens),
+            refund=lambda: limiter.settle(reserved_tokens, 0)
+        )
+
+    def _produce(self, flight, key, cache, limiter, reserved_tokens):
+        """在后台线程中读取上游流并发布到 flight
+
+        与页面渲染解耦：发起请求的会话中途离开，其他合并进来的会话仍能拿到完整结果。
+        """
+        parts = []
+        usage = None
+        try:
+            response, chunks = self._open_resilient(limiter, reserved_tokens)
+            try:
+                for chunk in chunks:
+                    # 开启 include_usage 后，最后一个 chunk 只携带用量信息
+                    if getattr(chunk, "usage", None):
+                        usage = chunk.usage
+                    if not chunk.choices:
+                        continue
+
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        parts.append(delta)
+                        flight.publish(delta)
+            finally:
+                response.close()
+        except BaseException as e:
+            # 失败或中断的请求按已知用量结算（没有用量时退还全部预留），避免配额被白白占用
+            limiter.settle(reserved_tokens, usage.total_tokens if usage else 0)
+            flight.finish(error=e)
+            get_single_flight().forget(key, flight)
+            return
+
+        text = "".join(parts).strip()
+        limiter.settle(reserved_tokens, usage.total_tokens if usage else None)
+        if cache is not None and text:
+            cache.set(key, text, model=self.model)
+
+        flight.finish(usage=usage)
+        get_single_flight().forget(key, flight)
+
+    def _record_metrics(self, error=None):
+        """记录本次调用的指标"""
+        if self.cached:
+            source = "cache"
+        elif self.coalesced:
+            source = "coalesced"
+        else:
+            source = "upstream"
+
+        usage = self.usage
+        ensure_metrics_server()
+        get_llm_metrics().record(
+            page=self.labels.get("page", "unknown"),
+            model=self.model,
+            source=source,
+            mode=self.labels.get("mode"),
+            queue_wait=self.queue_wait,
+            ttft=self.ttft,
+            latency=self.latency,
+            prompt_tokens=usage.prompt_tokens if usage else 0,
+            completion_tokens=usage.completion_tokens if usage else 0,
+            cached_tokens=cached_prompt_tokens(usage) or 0,
+            error=type(error).__name__ if error is not None else None
+        )
+
+    def __iter__(self):
+        start = time.perf_counter()
+        try:
+            yield from self._iterate(start)
+        except Exception as e:
+            self.latency = time.perf_counter() - start
+            self._record_metrics(error=e)
+            raise
+        self._record_metrics()
+
+    def _iterate(self, start):
+        key = self.cache_key()
+        cache = get_completion_cache() if self.use_cache else None
+
+        if cache is not None:
+            cached_text = cache.get(key)
+            if cached_text is not None:
+                self.cached = True
+                self.ttft = time.perf_counter() - start
+                yield cached_text
+                self.text = cached_text
+                self.latency = time.perf_counter() - start
+                return
+
+        # 相同指纹的请求正在进行时直接订阅它，不再重复调用 API
+        flight, is_leader = get_single_flight().join_or_lead(key)
+        if is_leader:
+            try:
+                reserved_tokens = estimate_messages_tokens(self.messages) + self.max_tokens
+                limiter = self._wait_for_quota(reserved_tokens)
+            except BaseException as e:
+                flight.finish(error=e)
+                get_single_flight().forget(key, flight)
+                raise
+            threading.Thread(
+                target=self._produce,
+                args=(flight, key, cache, limiter, reserved_tokens),
+                name="llm-stream-producer",
+                daemon=True
+            ).start()
+        else:
+            self.coalesced = True
+
+        parts = []
+        for delta in flight.subscribe():
+            if self.ttft is None:
+                self.ttft = time.perf_counter() - start
+            parts.append(delta)
+            yield delta
+
+        self.text = "".join(parts).strip()
+        self.latency = time.perf_counter() - start
+        if is_leader:
+            self.usage = flight.usage
+
+
+def stream_chat_completion(client, model, messages, max_tokens, temperature, prompt_version=None, use_cache=True, hedge=False, labels=None):
+    """创建流式对话补全，返回可迭代的 ChatStream"""
+    return ChatStream(client, model, messages, max_tokens, temperature, prompt_version, use_cache, hedge, labels)
+
+
+def async_chat_completion(runner, api_key, base_url, model, messages, max_tokens, temperature, prompt_version=None, use_cache=True, labels=None):
+    """构建一次非流式补全的协程，交给 AsyncRunner 在后台事件循环中并发执行
+
+    与 ChatStream 共用补全缓存；缓存对象在调用线程中获取。
+    """
+    client = runner.get_async_client(api_key, base_url)
+    cache = get_completion_cache() if use_cache and is_cacheable_temperature(temperature) else None
+    key = CompletionCache.make_key(str(client.base_url), model, messages, temperature, max_tokens, prompt_version)
+    return _timed_async_chat_completion(
+        labels or {}, client, cache, key, get_session_id(), model, messages, max_tokens, temperature
+    )
+
+
+async def _timed_async_chat_completion(labels, client, cache, key, session_id, model, messages, max_tokens, temperature):
+    """执行 _async_chat_completion 并记录指标"""
+    ensure_metrics_server()
+    start = time.perf_counter()
+    outcome = {"source": "upstream", "usage": None, "queue_wait": 0.0}
+    error = None
+    try:
+        return await _async_chat_completion(client, cache, key, session_id, model, messages, max_tokens, temperature, outcome)
+    except Exception as e:
+        error = type(e).__name__
+        raise
+    finally:
+        latency = time.perf_counter() - start
+        usage = outcome["usage"]
+        get_llm_metrics().record(
+            page=labels.get("page", "unknown"),
+            model=model,
+            source=outcome["source"],
+            mode=labels.get("mode"),
+            queue_wait=outcome["queue_wait"],
+            latency=latency,
+            prompt_tokens=usage.prompt_tokens if usage else 0,
+            completion_tokens=usage.completion_tokens if usage else 0,
+            cached_tokens=cached_prompt_tokens(usage) or 0,
+            error=error
+        )
+
+
+# 后台事件循环中进行中的请求 {指纹: Task}，只在事件循环线程中访问
+_async_flights = {}
+
+
+async def _async_chat_completion(client, cache, key, session_id, model, messages, max_tokens, temperature, outcome):
+    if cache is not None:
+        cached_text = cache.get(key)
+        if cached_text is not None:
+            outcome["source"] = "cache"
+            return cached_text
+
+    # 合并相同的进行中请求；shield 保证单个调用方取消时不影响其他等待者
+    task = _async_flights.get(key)
+    if task is None:
+        task = asyncio.ensure_future(
+            _async_request(client, cache, key, session_id, model, messages, max_tokens, temperature)
+        )
+        _async_flights[key] = task
+        task.add_done_callback(lambda _: _async_flights.pop(key, None))
+    else:
+        outcome["source"] = "coalesced"
+
+    text, usage, queue_wait = await asyncio.shield(task)
+    if outcome["source"] == "upstream":
+        outcome["usage"] = usage
+        outcome["queue_wait"] = queue_wait
+    return text
+
+
+async def _async_request(client, cache, key, session_id, model, messages, max_tokens, temperature):
+    # 限流排队是阻塞调用，放到线程池中执行，避免卡住事件循环
+    limiter = get_rate_limiter(client.api_key)
+    reserved_tokens = estimate_messages_tokens(messages) + max_tokens
+    queue_wait = await asyncio.to_thread(limiter.acquire, session_id, reserved_tokens)
+
+    try:
+        response = await acall_with_retry(
+            lambda: client.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature
+            ),
+            str(client.base_url).rstrip("/")
+        )
+    except BaseException:
+        # 请求失败或被取消时没有实际用量，退还全部预留
+        limiter.settle(reserved_tokens, 0)
+        raise
+    text = (response.choices[0].message.content or "").strip()
+    limiter.settle(reserved_tokens, response.usage.total_tokens if response.usage else None)
+
+    if cache is not None and text:
+        cache.set(key, text, model=model)
+    return text, response.usage, queue_wait
+
+
+def cached_prompt_tokens(usage):
+    """从 usage 中读取命中上游上下文缓存的输入 token 数
+
+    DeepSeek 返回 prompt_cache_hit_tokens；OpenAI 兼容接口返回 prompt_tokens_details.cached_tokens。
+    """
+    if usage is None:
+        return None
+    hit = getattr(usage, "prompt_cache_hit_tokens", None)
+    if hit is not None:
+        return hit
+    details = getattr(usage, "prompt_tokens_details", None)
+    if details is not None:
+        return getattr(details, "cached_tokens", None)
+    return None
+
+
+def format_stream_stats(stream):
+    """格式化流式调用的耗时统计，用于 st.caption 展示"""
+    if stream.latency is None:
+        return ""
+
+    if stream.cached:
+        return f"⚡ 命中缓存 · 总耗时 {stream.latency:.2f}s"
+
+    stats = []
+    if stream.coalesced:
+        stats.append("复用进行中的相同请求")
+    if stream.queue_wait >= 0.1:
+        stats.append(f"排队 {stream.queue_wait:.1f}s")
+    if stream.ttft is not None:
+        stats.append(f"首字延迟 {stream.ttft:.2f}s")
+    stats.append(f"总耗时 {stream.latency:.2f}s")
+    if stream.usage is not None:
+        stats.append(f"输入 {stream.usage.prompt_tokens} / 输出 {stream.usage.completion_tokens} tokens")
+        cached = cached_prompt_tokens(stream.usage)
+        if cached is not None and stream.usage.prompt_tokens:
+            stats.append(f"上下文缓存命中 {cached} tokens（{cached / stream.usage.prompt_tokens:.0%}）")
+
+    return "⚡ " + " · ".join(stats)
+
+
+def format_cache_stats():
+    """格式化补全缓存的命中统计，用于侧边栏展示"""
+    stats = get_completion_cache().stats()
+    return f"命中 {stats['hits']} / 未命中 {stats['misses']}（{stats['hit_rate']:.0%}），{stats['entries']} 条"
@@ -0,0 +1,61 @@
+import httpx
+import streamlit as st
+from openai import AsyncOpenAI, OpenAI
+
+from utils.config import get_setting
+
+DEFAULT_BASE_URL = "https://api.deepseek.com"
+
+
+def build_httpx_limits():
+    """连接池上限（可通过环境变量或 st.secrets 调整）"""
+    return httpx.Limits(
+        max_connections=get_setting("LLM_MAX_CONNECTIONS", 50, int),
+        max_keepalive_connections=get_setting("LLM_MAX_KEEPALIVE_CONNECTIONS", 20, int),
+        keepalive_expiry=get_setting("LLM_KEEPALIVE_EXPIRY", 120.0, float)
+    )
+
+
+def build_httpx_timeout():
+    """请求超时设置：连接超时单独配置，读取超时需覆盖长文本生成"""
+    return httpx.Timeout(
+        get_setting("LLM_TIMEOUT", 180.0, float),
+        connect=get_setting("LLM_CONNECT_TIMEOUT", 10.0, float)
+    )
+
+
+@st.cache_resource(show_spinner=False, max_entries=get_setting("LLM_MAX_CLIENTS", 64, int))
+def get_shared_client(api_key, base_url=DEFAULT_BASE_URL):
+    """获取进程级共享的 OpenAI 客户端
+
+    按 (api_key, base_url) 缓存，所有页面和会话复用同一个 keep-alive 连接池，
+    避免每次请求都重新建立 TLS 连接。
+    """
+    http_client = httpx.Client(
+        limits=build_httpx_limits(),
+        timeout=build_httpx_timeout()
+    )
+    return OpenAI(
+        api_key=api_key,
+        base_url=base_url,
+        http_client=http_client,
+        max_retries=0  # 重试由 utils.resilience 统一处理
+    )
+
+
+def create_async_client(api_key, base_url=DEFAULT_BASE_URL):
+    """创建 AsyncOpenAI 客户端（连接池配置与同步客户端一致）
+
+    异步客户端只能在创建它的事件循环中使用，由后台事件循环统一持有，
+    见 utils.async_runner。
+    """
+    http_client = httpx.AsyncClient(
+        limits=build_httpx_limits(),
+        timeout=build_httpx_timeout()
+    )
+    return AsyncOpenAI(
+        api_key=api_key,
+        base_url=base_url,
+        http_client=http_client,
+        max_retries=0  # 重试由 utils.resilience 统一处理
+    )
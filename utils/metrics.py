@@ -0,0 +1,254 @@
+import bisect
+import collections
+import logging
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils.config import get_setting
+
+logger = logging.getLogger(__name__)
+
+# 延迟类直方图的桶边界（秒）
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0, 64.0, 128.0)
+
+# 直方图指标：样本字段 -> (Prometheus 指标名, 说明)
+HISTOGRAMS = {
+    "latency": ("llm_request_duration_seconds", "LLM 调用总耗时"),
+    "ttft": ("llm_time_to_first_token_seconds", "LLM 首字延迟"),
+    "queue_wait": ("llm_queue_wait_seconds", "LLM 请求在限流队列中的等待时间")
+}
+
+
+class Histogram:
+    """Prometheus 风格的累积直方图"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """返回 [(le, 累积计数)]，最后一项为 +Inf"""
+        total = 0
+        result = []
+        for bound, count in zip(list(self.buckets) + ["+Inf"], self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+def percentile(sorted_values, q):
+    """最近秩法求分位数"""
+    if not sorted_values:
+        return None
+    rank = min(len(sorted_values) - 1, max(0, math.ceil(q * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+class LLMMetrics:
+    """进程内的 LLM 调用指标
+
+    直方图和计数器自进程启动起累积，供 Prometheus 抓取；
+    同时保留最近的原始样本，用于按滑动窗口计算 p50 / p95 / p99。
+    """
+
+    def __init__(self, retention_seconds, max_samples):
+        self.retention_seconds = retention_seconds
+        self._lock = threading.Lock()
+        self._samples = collections.deque(maxlen=max_samples)
+        self._histograms = collections.defaultdict(Histogram)
+        self._requests = collections.Counter()
+        self._tokens = collections.Counter()
+
+    def record(self, page, model, source, mode=None, queue_wait=0.0, ttft=None, latency=None,
+               prompt_tokens=0, completion_tokens=0, cached_tokens=0, error=None):
+        """记录一次 LLM 调用
+
+        source：upstream（实际调用 API）/ cache（命中补全缓存）/ coalesced（合并到进行中的请求）
+        """
+        sample = {
+            "timestamp": time.time(),
+            "page": page,
+            "model": model,
+            "mode": mode,
+            "source": source,
+            "queue_wait": queue_wait,
+            "ttft": ttft,
+            "latency": latency,
+            "prompt_tokens": prompt_tokens or 0,
+            "completion_tokens": completion_tokens or 0,
+            "cached_tokens": cached_tokens or 0,
+            "error": error
+        }
+        status = "error" if error else "ok"
+
+        with self._lock:
+            self._samples.append(sample)
+            self._requests[(page, model, mode or "", source, status)] += 1
+            for field in HISTOGRAMS:
+                if sample[field] is not None:
+                    self._histograms[(field, page, model)].observe(sample[field])
+            for kind in ("prompt", "completion", "cached"):
+                self._tokens[(page, model, kind)] += sample[f"{kind}_tokens"]
+
+    def samples(self, window_seconds):
+        """最近 window_seconds 秒内的样本"""
+        cutoff = time.time() - min(window_seconds, self.retention_seconds)
+        with self._lock:
+            return [s for s in self._samples if s["timestamp"] >= cutoff]
+
+    def summarize(self, window_seconds, group_by=("page", "model")):
+        """按维度汇总滑动窗口内的延迟分位数、错误率和 token 用量"""
+        groups = collections.defaultdict(list)
+        for sample in self.samples(window_seconds):
+            groups[tuple(sample[key] for key in group_by)].append(sample)
+
+        rows = []
+        for key, samples in sorted(groups.items(), key=lambda item: str(item[0])):
+            row = dict(zip(group_by, key))
+            row["requests"] = len(samples)
+            row["errors"] = sum(1 for s in samples if s["error"])
+            row["cache_hits"] = sum(1 for s in samples if s["source"] == "cache")
+            for field in HISTOGRAMS:
+                values = sorted(s[field] for s in samples if s[field] is not None and not s["error"])
+                for q in (0.5, 0.95, 0.99):
+                    row[f"{field}_p{int(q * 100)}"] = percentile(values, q)
+            row["prompt_tokens"] = sum(s["prompt_tokens"] for s in samples)
+            row["completion_tokens"] = sum(s["completion_tokens"] for s in samples)
+            row["cached_tokens"] = sum(s["cached_tokens"] for s in samples)
+            rows.append(row)
+        return rows
+
+    def render_prometheus(self):
+        """渲染 Prometheus 文本格式（不含外部组件的指标）"""
+        lines = []
+        with self._lock:
+            for field, (name, help_text) in HISTOGRAMS.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} histogram")
+                for (metric, page, model), histogram in sorted(self._histograms.items()):
+                    if metric != field:
+                        continue
+                    labels = _labels(page=page, model=model)
+                    for bound, count in histogram.cumulative():
+                        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+                    lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+                    lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+
+            lines.append("# HELP llm_requests_total LLM 调用次数")
+            lines.append("# TYPE llm_requests_total counter")
+            for (page, model, mode, source, status), count in sorted(self._requests.items()):
+                labels = _labels(page=page, model=model, mode=mode, source=source, status=status)
+                lines.append(f"llm_requests_total{{{labels}}} {count}")
+
+            lines.append("# HELP llm_tokens_total LLM token 用量")
+            lines.append("# TYPE llm_tokens_total counter")
+            for (page, model, kind), count in sorted(self._tokens.items()):
+                lines.append(f"llm_tokens_total{{{_labels(page=page, model=model, type=kind)}}} {count}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(**labels):
+    return ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+
+
+_metrics = LLMMetrics(
+    retention_seconds=get_setting("METRICS_RETENTION_SECONDS", 3600, int),
+    max_samples=get_setting("METRICS_MAX_SAMPLES", 50000, int)
+)
+
+
+def get_llm_metrics():
+    """获取进程级的 LLM 指标"""
+    return _metrics
+
+
+def render_all_metrics():
+    """渲染完整的 Prometheus 指标：LLM 调用、补全缓存、上游健康、限流、请求合并和论文文本存储"""
+    # 延迟导入，避免与 utils.llm 循环依赖
+    from utils.completion_cache import get_completion_cache
+    from utils.resilience import get_upstream_health
+    from utils.single_flight import get_single_flight
+    from utils.text_store import get_text_store
+
+    lines = [_metrics.render_prometheus().rstrip("\n")]
+
+    cache_stats = get_completion_cache().stats()
+    lines.append("# TYPE llm_completion_cache_lookups_total counter")
+    lines.append(f'llm_completion_cache_lookups_total{{result="hit"}} {cache_stats["hits"]}')
+    lines.append(f'llm_completion_cache_lookups_total{{result="miss"}} {cache_stats["misses"]}')
+    lines.append("# TYPE llm_completion_cache_bytes gauge")
+    lines.append(f"llm_completion_cache_bytes {cache_stats['bytes']}")
+
+    lines.append("# TYPE llm_upstream_events_total counter")
+    lines.append("# TYPE llm_upstream_circuit_open gauge")
+    for base_url, stats in sorted(get_upstream_health().items()):
+        for event, count in sorted(stats.items()):
+            if event == "circuit_state":
+                lines.append(f"llm_upstream_circuit_open{{{_labels(base_url=base_url)}}} {int(count != 'closed')}")
+            else:
+                lines.append(f"llm_upstream_events_total{{{_labels(base_url=base_url, event=event)}}} {count}")
+
+    lines.append("# TYPE llm_inflight_requests gauge")
+    lines.append(f"llm_inflight_requests {get_single_flight().in_flight()}")
+
+    text_report = get_text_store().memory_report()
+    lines.append("# TYPE pdf_text_store_bytes gauge")
+    for kind in ("resident", "per_session", "shared", "saved"):
+        lines.append(f'pdf_text_store_bytes{{kind="{kind}"}} {text_report[kind + "_bytes"]}')
+    lines.append("# TYPE pdf_text_store_sessions gauge")
+    lines.append(f"pdf_text_store_sessions {text_report['sessions']}")
+
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_all_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server_lock = threading.Lock()
+_server = None
+
+
+def ensure_metrics_server():
+    """按需启动 Prometheus 抓取端点（METRICS_PORT，设为 0 表示关闭），返回端口或 None"""
+    global _server
+    port = get_setting("METRICS_PORT", 9464, int)
+    if not port:
+        return None
+
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer((get_setting("METRICS_HOST", "127.0.0.1"), port), _MetricsHandler)
+            except OSError as e:
+                logger.warning("指标端点启动失败（端口 %s）：%s", port, e)
+                _server = False
+                return None
+            threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+        return port if _server else None
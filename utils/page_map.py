@@ -0,0 +1,58 @@
+import array
+import bisect
+
+
+def format_page_range(first, last):
+    """页码范围的显示文本，如 "第 3 页"、"第 3-5 页" """
+    return f"第 {first} 页" if first == last else f"第 {first}-{last} 页"
+
+
+class PageMap:
+    """全文的页码映射：合并后的全文只存一份，各页起始字符位置存成紧凑的整数数组
+
+    任意字符位置到页码的映射是对数组的二分查找（O(log n)），
+    不需要回头在全文中扫描 "--- Page N ---" 标记。
+    """
+
+    def __init__(self, page_offsets, text_length):
+        self.offsets = array.array("q", page_offsets)
+        self.text_length = text_length
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def page_of(self, position):
+        """字符位置所在的页码（从 1 开始）"""
+        return max(1, bisect.bisect_right(self.offsets, position))
+
+    def pages_between(self, start, end):
+        """[start, end) 覆盖的页码范围 (首页, 末页)"""
+        return self.page_of(start), self.page_of(max(start, end - 1))
+
+    def page_span(self, page_number):
+        """第 page_number 页在全文中的 [起始, 结束) 字符位置"""
+        start = self.offsets[page_number - 1]
+        end = self.offsets[page_number] if page_number < len(self.offsets) else self.text_length
+        return start, end
+
+    def label(self, start, end):
+        """[start, end) 所在页码的显示文本"""
+        return format_page_range(*self.pages_between(start, end))
+
+    def iter_pages(self, text):
+        """按页码顺序产出 (页码, 该页文本)"""
+        for page_number in range(1, len(self.offsets) + 1):
+            start, end = self.page_span(page_number)
+            yield page_number, text[start:end]
+
+
+def join_pages(parts):
+    """按页码顺序用单个空格拼接各页文本（一次 join，线性时间），返回 (全文, 各页起始字符位置)"""
+    page_offsets = []
+    offset = 0
+    for part in parts:
+        if page_offsets:
+            offset += 1
+        page_offsets.append(offset)
+        offset += len(part)
+    return " ".join(parts), page_offsets
@@ -0,0 +1,190 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import streamlit as st
+
+from utils.config import get_cache_dir
+from utils.page_map import PageMap, join_pages
+from utils.pdf_cache import ParsedPdf
+from utils.references import Reference, parse_references
+from utils.sections import get_paper_sections
+
+# 查询词：英文单词 / 数字，以及中文字符串
+_QUERY_TERM_RE = re.compile(r"[A-Za-z0-9]+|[一-鿿]+")
+
+
+class PaperLibrary:
+    """本地文献库
+
+    论文元数据和逐页文本存放在 SQLite 中，逐页文本建 FTS5 全文索引，
+    支持跨论文检索和免解析重新打开。参考文献解析成结构化条目单独存放，按需查询。SQLite 支持 trigram 分词器时按三元组建索引，
+    中英文都能做子串匹配；否则退回 unicode61。
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS papers (
+                sha256 TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                page_count INTEGER NOT NULL,
+                char_count INTEGER NOT NULL,
+                added_at REAL NOT NULL,
+                opened_at REAL NOT NULL,
+                sections TEXT,
+                reference_count INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS pages (
+                id INTEGER PRIMARY KEY,
+                sha256 TEXT NOT NULL,
+                page_number INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                UNIQUE (sha256, page_number)
+            );
+            CREATE TABLE IF NOT EXISTS paper_references (
+                sha256 TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                label TEXT NOT NULL,
+                authors TEXT NOT NULL,
+                year INTEGER,
+                title TEXT NOT NULL,
+                venue TEXT NOT NULL,
+                raw TEXT NOT NULL,
+                PRIMARY KEY (sha256, position)
+            );
+        """)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(papers)")]
+        if "sections" not in columns:
+            self._conn.execute("ALTER TABLE papers ADD COLUMN sections TEXT")
+        if "reference_count" not in columns:
+            # 为空表示还没有解析参考文献（旧版本加入的论文），下次加入时补上
+            self._conn.execute("ALTER TABLE papers ADD COLUMN reference_count INTEGER")
+        try:
+            self._create_fts("trigram")
+            self.tokenizer = "trigram"
+        except sqlite3.OperationalError:
+            self._create_fts("unicode61")
+            self.tokenizer = "unicode61"
+        self._conn.commit()
+
+    def _create_fts(self, tokenizer):
+        self._conn.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS pages_fts USING fts5(text, content='pages', content_rowid='id', tokenize='{tokenizer}')"
+        )
+
+    def add(self, parsed, filename):
+        """把解析结果加入文献库（已存在时只更新文件名，以及此前缺少的章节信息和参考文献）"""
+        now = time.time()
+        sections = json.dumps(parsed.sections) if parsed.sections is not None else None
+        with self._lock:
+            row = self._conn.execute("SELECT reference_count FROM papers WHERE sha256 = ?", (parsed.sha256,)).fetchone()
+            if row is not None:
+                self._conn.execute(
+                    "UPDATE papers SET filename = ?, sections = COALESCE(sections, ?) WHERE sha256 = ?",
+                    (filename, sections, parsed.sha256)
+                )
+                if row[0] is None:
+                    self._insert_references(parsed)
+                self._conn.commit()
+                return
+
+            self._conn.execute(
+                "INSERT INTO papers (sha256, filename, page_count, char_count, added_at, opened_at, sections) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (parsed.sha256, filename, parsed.page_count, len(parsed.text), now, now, sections)
+            )
+            for page_number, page_text in PageMap(parsed.page_offsets, len(parsed.text)).iter_pages(parsed.text):
+                page_text = page_text.strip()
+                cursor = self._conn.execute(
+                    "INSERT INTO pages (sha256, page_number, text) VALUES (?, ?, ?)",
+                    (parsed.sha256, page_number, page_text)
+                )
+                self._conn.execute("INSERT INTO pages_fts (rowid, text) VALUES (?, ?)", (cursor.lastrowid, page_text))
+            self._insert_references(parsed)
+            self._conn.commit()
+
+    def _insert_references(self, parsed):
+        references = parse_references(parsed.text, get_paper_sections(parsed))
+        self._conn.execute("DELETE FROM paper_references WHERE sha256 = ?", (parsed.sha256,))
+        self._conn.executemany(
+            "INSERT INTO paper_references (sha256, position, label, authors, year, title, venue, raw) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (parsed.sha256, position, ref.label, ref.authors, ref.year, ref.title, ref.venue, ref.raw)
+                for position, ref in enumerate(references)
+            ]
+        )
+        self._conn.execute("UPDATE papers SET reference_count = ? WHERE sha256 = ?", (len(references), parsed.sha256))
+
+    def load(self, sha256):
+        """从文献库读取论文（免解析），不存在时返回 None"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT text FROM pages WHERE sha256 = ? ORDER BY page_number", (sha256,)
+            ).fetchall()
+            if not rows:
+                return None
+            sections = self._conn.execute("SELECT sections FROM papers WHERE sha256 = ?", (sha256,)).fetchone()[0]
+            self._conn.execute("UPDATE papers SET opened_at = ? WHERE sha256 = ?", (time.time(), sha256))
+            self._conn.commit()
+
+        # 各页已是清理后的文本，用单个空格拼接即可还原全文和页码位置
+        text, page_offsets = join_pages([page_text for (page_text,) in rows])
+        return ParsedPdf(
+            sha256, text, len(rows), page_offsets,
+            json.loads(sections) if sections else None
+        )
+
+    def references(self, sha256):
+        """论文的参考文献条目（按原文顺序），论文不在库中或尚未解析参考文献时返回 None"""
+        with self._lock:
+            row = self._conn.execute("SELECT reference_count FROM papers WHERE sha256 = ?", (sha256,)).fetchone()
+            if row is None or row[0] is None:
+                return None
+            rows = self._conn.execute(
+                "SELECT label, authors, year, title, venue, raw FROM paper_references WHERE sha256 = ? ORDER BY position",
+                (sha256,)
+            ).fetchall()
+        return [Reference(*row) for row in rows]
+
+    def list_papers(self):
+        """文献库中的论文，最近打开的在前：[(sha256, 文件名, 页数)]"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT sha256, filename, page_count FROM papers ORDER BY opened_at DESC"
+            ).fetchall()
+
+    def _match_expression(self, query):
+        terms = _QUERY_TERM_RE.findall(query)
+        if self.tokenizer == "trigram":
+            # trigram 至少需要 3 个字符才能匹配
+            terms = [term for term in terms if len(term) >= 3]
+        return " OR ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+    def search(self, query, limit=20):
+        """全文检索：返回 [(sha256, 文件名, 页码, 摘录)]，按 BM25 相关度排序"""
+        expression = self._match_expression(query)
+        if not expression:
+            return []
+
+        sql = """
+            SELECT pages.sha256, papers.filename, pages.page_number,
+                   snippet(pages_fts, 0, '**', '**', '…', 16), bm25(pages_fts) AS score
+            FROM pages_fts
+            JOIN pages ON pages.id = pages_fts.rowid
+            JOIN papers ON papers.sha256 = pages.sha256
+            WHERE pages_fts MATCH ?
+            ORDER BY score LIMIT ?
+        """
+        with self._lock:
+            rows = self._conn.execute(sql, (expression, limit)).fetchall()
+        return [row[:4] for row in rows]
+
+
+@st.cache_resource(show_spinner=False)
+def get_paper_library():
+    """获取进程级共享的文献库"""
+    return PaperLibrary(os.path.join(get_cache_dir(), "library.sqlite3"))
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import streamlit as st
+
+from utils.config import get_cache_dir, get_setting
+
+
+class ParsedPdf:
+    """PDF 解析结果
+
+    page_offsets[i] 是第 i + 1 页在 text 中的起始字符位置；
+    sections 为识别出的章节 [[章节名, 起始, 结束]]，旧版本缓存中没有时为 None；
+    boilerplate 为去除页眉页脚的报告 {"lines", "chars", "tokens"}，没有时为 None。
+    """
+
+    def __init__(self, sha256, text, page_count, page_offsets, sections=None, boilerplate=None):
+        self.sha256 = sha256
+        self.text = text
+        self.page_count = page_count
+        self.page_offsets = page_offsets
+        self.sections = sections
+        self.boilerplate = boilerplate
+
+
+def hash_pdf_bytes(pdf_bytes):
+    """PDF 文件内容的 SHA-256"""
+    return hashlib.sha256(pdf_bytes).hexdigest()
+
+
+class ParsedPdfCache:
+    """按文件内容哈希缓存 PDF 解析结果
+
+    与文件名无关：同名的不同文件不会串用，不同会话上传的同一篇论文只解析一次。
+    持久化到 SQLite，按总字节数做 LRU 淘汰。
+    """
+
+    def __init__(self, path, max_bytes):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS parsed_pdfs (
+                sha256 TEXT PRIMARY KEY,
+                text TEXT NOT NULL,
+                page_count INTEGER NOT NULL,
+                page_offsets TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_parsed_pdfs_accessed ON parsed_pdfs (accessed_at)")
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(parsed_pdfs)")]
+        if "sections" not in columns:
+            self._conn.execute("ALTER TABLE parsed_pdfs ADD COLUMN sections TEXT")
+        if "boilerplate" not in columns:
+            self._conn.execute("ALTER TABLE parsed_pdfs ADD COLUMN boilerplate TEXT")
+        self._conn.commit()
+
+    def get(self, sha256):
+        """读取解析结果，未命中返回 None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text, page_count, page_offsets, sections, boilerplate FROM parsed_pdfs WHERE sha256 = ?", (sha256,)
+            ).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self._conn.execute("UPDATE parsed_pdfs SET accessed_at = ? WHERE sha256 = ?", (time.time(), sha256))
+            self._conn.commit()
+            self.hits += 1
+            return ParsedPdf(
+                sha256, row[0], row[1], json.loads(row[2]),
+                json.loads(row[3]) if row[3] else None, json.loads(row[4]) if row[4] else None
+            )
+
+    def set(self, parsed):
+        """写入解析结果，并按容量上限淘汰旧条目"""
+        now = time.time()
+        size = len(parsed.text.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO parsed_pdfs (sha256, text, page_count, page_offsets, sections, boilerplate, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (parsed.sha256, parsed.text, parsed.page_count, json.dumps(parsed.page_offsets),
+                 json.dumps(parsed.sections) if parsed.sections is not None else None,
+                 json.dumps(parsed.boilerplate) if parsed.boilerplate is not None else None, size, now, now)
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """按最近访问时间淘汰，直到总大小不超过上限"""
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM parsed_pdfs").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        rows = self._conn.execute("SELECT sha256, size FROM parsed_pdfs ORDER BY accessed_at ASC").fetchall()
+        for sha256, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM parsed_pdfs WHERE sha256 = ?", (sha256,))
+            total -= size
+
+
+@st.cache_resource(show_spinner=False)
+def get_parsed_pdf_cache():
+    """获取进程级共享的 PDF 解析缓存"""
+    return ParsedPdfCache(
+        os.path.join(get_cache_dir(), "parsed_pdfs.sqlite3"),
+        max_bytes=get_setting("PDF_CACHE_MAX_MB", 512, float) * 1024 * 1024
+    )
@@ -0,0 +1,214 @@
+import collections
+import math
+import os
+import pickle
+import queue
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from utils.config import get_setting
+from utils.page_map import join_pages
+from utils.pdf_sandbox import FAILURE_CRASHED, FAILURE_SCANNED, FAILURE_TIMEOUT, PdfParseError
+
+# 页数少于该值时只用一个解析进程，多开进程的启动开销不划算
+PARALLEL_MIN_PAGES = 16
+
+# 每批最多分配的页数：批次越小负载越均衡，页面也越接近按页码顺序到达；越大则通信开销越少
+MAX_BATCH_PAGES = 8
+
+# 子进程以仓库根目录为工作目录运行 python -m utils.pdf_sandbox
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 全部页面平均每页可提取的字符数低于该值时视为扫描件（只有图片没有文字层）
+SCANNED_MAX_CHARS_PER_PAGE = 20
+
+
+def get_worker_count():
+    """解析进程数：PDF_EXTRACT_WORKERS，默认等于容器可用的 CPU 核数"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    return max(1, get_setting("PDF_EXTRACT_WORKERS", cpus, int))
+
+
+def _page_batches(page_count, workers):
+    """把页码切成按顺序分配的小批次，每个进程约能领到四批，空闲的进程领取下一批（work stealing）"""
+    per_batch = max(1, min(MAX_BATCH_PAGES, math.ceil(page_count / (workers * 4))))
+    return collections.deque(
+        (start, min(start + per_batch, page_count)) for start in range(0, page_count, per_batch)
+    )
+
+
+class _Sandbox:
+    """一个沙箱解析子进程及其消息管道
+
+    子进程以独立的解释器启动（python -m utils.pdf_sandbox），不继承 Streamlit 服务端的线程和锁，
+    也不会像 multiprocessing 的 spawn 那样重新执行被 Streamlit 装成 __main__ 的页面脚本。
+    后台线程把子进程发来的消息放入共享队列 messages（子进程退出时放入 None），
+    父进程只需等待一个队列即可同时监听所有子进程并控制超时，在各平台上行为一致。
+    """
+
+    def __init__(self, path, memory_budget_bytes, messages):
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "utils.pdf_sandbox", path, str(int(memory_budget_bytes))],
+            cwd=_PROJECT_ROOT, stdin=subprocess.PIPE, stdout=subprocess.PIPE
+        )
+        self._reader = threading.Thread(target=self._read, args=(messages,), name="pdf-sandbox-reader", daemon=True)
+        self._reader.start()
+
+    def _read(self, messages):
+        try:
+            while True:
+                messages.put((self, pickle.load(self.process.stdout)))
+        except Exception:
+            # EOF、消息被截断或子进程被杀
+            messages.put((self, None))
+        finally:
+            self.process.stdout.close()
+
+    def send(self, value):
+        try:
+            pickle.dump(value, self.process.stdin)
+            self.process.stdin.flush()
+        except OSError:
+            # 子进程已退出，读线程随后会报告
+            pass
+
+    def check(self, message):
+        """检查一条消息；子进程报告错误或异常退出时抛出 PdfParseError"""
+        if message is None:
+            try:
+                exitcode = self.process.wait(1)
+            except subprocess.TimeoutExpired:
+                exitcode = None
+            raise PdfParseError(FAILURE_CRASHED, f"解析进程异常退出（退出码 {exitcode}）")
+        if message[0] == "error":
+            raise PdfParseError(message[1], message[2])
+        return message
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        self._reader.join(1)
+
+
+def _next_message(messages, deadline):
+    """等待任一子进程的下一条消息，到截止时间仍没有消息时返回 None"""
+    try:
+        return messages.get(timeout=max(0.0, deadline - time.monotonic()))
+    except queue.Empty:
+        return None
+
+
+def iter_pages(pdf_file, workers=None):
+    """生成器：按页码顺序逐页产出 (页下标, 总页数, 页文本, 标题行)，边提取边产出
+
+    pdf_file 可以是 PDF 文件内容（bytes）或文件对象。
+    解析在沙箱子进程中进行（见 utils.pdf_sandbox），页数较多时启动多个子进程，
+    按页码顺序把小批次的页分给空闲的子进程，某一段页面解析较慢时其余进程继续领取后面的批次；
+    前面的页到齐后立即产出，调用方不必等整份文件解析完就能使用前几页。
+
+    解析超过 PDF_PARSE_TIMEOUT_SECONDS 秒、内存增长超过 PDF_PARSE_MAX_MEMORY_MB，
+    或文件加密 / 损坏时终止子进程并抛出 PdfParseError，此前已产出的页仍然有效；
+    全部解析完仍几乎没有文字时视为扫描件。
+    """
+    if isinstance(pdf_file, bytes):
+        pdf_bytes = pdf_file
+    else:
+        pdf_bytes = pdf_file.getvalue() if hasattr(pdf_file, "getvalue") else pdf_file.read()
+
+    # 通过临时文件传递 PDF，避免把整份文件序列化给每个子进程
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+        f.write(pdf_bytes)
+        path = f.name
+
+    timeout = get_setting("PDF_PARSE_TIMEOUT_SECONDS", 120, float)
+    deadline = time.monotonic() + timeout
+    memory_budget = get_setting("PDF_PARSE_MAX_MEMORY_MB", 1024, float) * 1024 * 1024
+    messages = queue.Queue()
+    sandboxes = []
+    try:
+        # 第一个子进程打开文件并报告总页数，之后再决定分几个进程
+        sandboxes.append(_Sandbox(path, memory_budget, messages))
+        received = _next_message(messages, deadline)
+        if received is None:
+            raise PdfParseError(FAILURE_TIMEOUT, f"打开 PDF 超过 {timeout:.0f} 秒")
+        _, page_count = sandboxes[0].check(received[1])
+
+        workers = workers or get_worker_count()
+        if workers <= 1 or page_count < PARALLEL_MIN_PAGES:
+            workers = 1
+        batches = _page_batches(page_count, workers)
+        for _ in range(min(workers, len(batches)) - 1):
+            sandboxes.append(_Sandbox(path, memory_budget, messages))
+        pending = set(sandboxes)
+
+        def assign(sandbox):
+            """给空闲的子进程分配下一批页，没有剩余批次时让它退出"""
+            if batches:
+                sandbox.send(batches.popleft())
+            else:
+                sandbox.send(None)
+                pending.discard(sandbox)
+
+        assign(sandboxes[0])
+
+        # 后面批次先完成的页暂存，等前面的页到齐再按顺序产出
+        finished = {}
+        next_page = 0
+        text_chars = 0
+        while next_page < page_count:
+            if next_page in finished:
+                page_text, headings = finished.pop(next_page)
+                text_chars += len(page_text.strip())
+                yield next_page, page_count, page_text, headings
+                next_page += 1
+                continue
+
+            if not pending:
+                raise PdfParseError(FAILURE_CRASHED, f"解析进程提前结束，缺少第 {next_page + 1} 页")
+            received = _next_message(messages, deadline)
+            if received is None:
+                raise PdfParseError(FAILURE_TIMEOUT, f"解析超过 {timeout:.0f} 秒，已完成 {next_page}/{page_count} 页")
+            sandbox, message = received
+            if sandbox not in pending:
+                # 已被告知退出的子进程关闭管道时的 EOF
+                continue
+            message = sandbox.check(message)
+            if message[0] == "page":
+                finished[message[1]] = (message[2], message[3])
+            else:
+                # 新启动的子进程报告总页数（"meta"）或做完一批（"idle"）时领取下一批
+                assign(sandbox)
+
+        if page_count and text_chars < SCANNED_MAX_CHARS_PER_PAGE * page_count:
+            raise PdfParseError(FAILURE_SCANNED, "PDF 中几乎没有可提取的文字，可能是扫描件")
+    finally:
+        # 调用方提前停止迭代、超时或出错时，直接杀掉仍在运行的子进程
+        for sandbox in sandboxes:
+            sandbox.close()
+        os.unlink(path)
+
+
+def clean_page_text(page_index, page_text):
+    """给单页文本加上 "--- Page N ---" 页眉并清理多余的空白字符"""
+    return re.sub(r"\s+", " ", f"--- Page {page_index + 1} ---\n{page_text}").strip()
+
+
+def assemble_text(page_texts):
+    """按页码顺序合并各页文本并清理空白，返回 (全文, 各页起始字符位置)
+
+    每页以 "--- Page N ---" 开头，逐页清理后用单个空格拼接，
+    结果与整篇拼接后再统一折叠空白完全一致。
+    """
+    return join_pages([clean_page_text(page_num, page_text) for page_num, page_text in enumerate(page_texts)])
@@ -0,0 +1,142 @@
+import logging
+import threading
+
+from utils.boilerplate import strip_boilerplate
+from utils.paper_library import get_paper_library
+from utils.pdf_cache import ParsedPdf, get_parsed_pdf_cache
+from utils.pdf_extract import assemble_text, clean_page_text, iter_pages
+from utils.pdf_sandbox import PARTIAL_FAILURES, PdfParseError
+from utils.sections import detect_sections
+
+logger = logging.getLogger(__name__)
+
+
+class IngestJob:
+    """后台增量解析 PDF
+
+    在守护线程中逐页消费 iter_pages，每解析完一页就追加到已就绪的文本中；
+    页面可以随时通过 snapshot() 读取已解析的前缀，不必等整份文件解析完。
+    全部完成后去掉跨页重复的页眉页脚、识别章节，写入解析缓存和文献库，result 为完整的 ParsedPdf。
+    解析超时、内存超限或子进程崩溃时 error 为 PdfParseError，result 为已解析的前几页（不写入缓存）。
+    """
+
+    def __init__(self, pdf_hash, pdf_bytes, cache, library=None, filename=""):
+        self.pdf_hash = pdf_hash
+        self.cache = cache
+        self.library = library
+        self.filename = filename
+        self.page_count = None
+        self.done = False
+        self.error = None
+        self.result = None
+
+        self._lock = threading.Lock()
+        self._parts = []
+        self._raw_pages = []
+        self._headings = []
+        self._page_offsets = []
+        self._length = 0
+        self._joined = ("", 0)
+        self._thread = threading.Thread(
+            target=self._run, args=(pdf_bytes,), name=f"pdf-ingest-{pdf_hash[:8]}", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+
+    @property
+    def pages_done(self):
+        return len(self._parts)
+
+    def _run(self, pdf_bytes):
+        try:
+            for page_index, page_count, page_text, headings in iter_pages(pdf_bytes):
+                part = clean_page_text(page_index, page_text)
+                with self._lock:
+                    self.page_count = page_count
+                    if self._parts:
+                        self._length += 1
+                    self._page_offsets.append(self._length)
+                    self._parts.append(part)
+                    self._raw_pages.append(page_text)
+                    self._headings.append(headings)
+                    self._length += len(part)
+
+            self.result = self._build_result(self.pdf_hash)
+        except PdfParseError as e:
+            logger.warning("PDF 解析失败（%s）：%s", e.kind, e)
+            self.error = e
+            if e.kind in PARTIAL_FAILURES and self._parts:
+                # 内容哈希加上页数后缀，以免与之后完整解析的结果混用
+                self.result = self._build_result(f"{self.pdf_hash}-partial{len(self._parts)}")
+        except Exception as e:
+            logger.warning("PDF 解析失败：%s", e)
+            self.error = e
+        else:
+            self._persist()
+        finally:
+            self.done = True
+            _forget(self)
+
+    def _persist(self):
+        """把完整的解析结果写入解析缓存和文献库
+
+        写入失败（磁盘已满、数据库被锁等）只记录日志：解析本身已成功，本次会话照常使用 result。
+        写入文献库放在后台线程中，会话中途关闭也不会丢失。
+        """
+        try:
+            self.cache.set(self.result)
+        except Exception as e:
+            logger.warning("解析缓存写入失败：%s", e)
+        if self.library is None:
+            return
+        try:
+            self.library.add(self.result, self.filename)
+        except Exception as e:
+            logger.warning("文献库写入失败：%s", e)
+
+    def _build_result(self, sha256):
+        """由已解析的各页构建 ParsedPdf：页眉页脚要看到全部页面才能判断，在这里统一去除"""
+        with self._lock:
+            raw_pages = list(self._raw_pages)
+        pages, boilerplate = strip_boilerplate(raw_pages)
+        text, page_offsets = assemble_text(pages)
+        sections = detect_sections(text, page_offsets, self._headings)
+        return ParsedPdf(sha256, text, len(page_offsets), page_offsets, sections.to_list(), boilerplate)
+
+    def snapshot(self):
+        """返回已解析部分的 (文本, 各页起始字符位置)"""
+        with self._lock:
+            # 拼接结果按已解析页数缓存，同一进度下多次读取不重复拼接
+            text, count = self._joined
+            if count != len(self._parts):
+                text = " ".join(self._parts)
+                self._joined = (text, len(self._parts))
+            return text, list(self._page_offsets)
+
+
+# 进行中的解析任务 {内容哈希: IngestJob}，多个会话上传同一文件时共享
+_jobs_lock = threading.Lock()
+_jobs = {}
+
+
+def _forget(job):
+    with _jobs_lock:
+        if _jobs.get(job.pdf_hash) is job:
+            del _jobs[job.pdf_hash]
+
+
+def start_ingest_job(pdf_hash, pdf_bytes, filename=""):
+    """启动后台解析；同一文件已在解析中时直接返回进行中的任务
+
+    解析缓存和文献库在调用线程（Streamlit 脚本线程）中获取后交给后台线程。
+    """
+    cache = get_parsed_pdf_cache()
+    library = get_paper_library()
+    with _jobs_lock:
+        job = _jobs.get(pdf_hash)
+        if job is None:
+            job = IngestJob(pdf_hash, pdf_bytes, cache, library, filename)
+            _jobs[pdf_hash] = job
+            job.start()
+        return job
@@ -0,0 +1,146 @@
+"""PDF 解析沙箱子进程
+
+畸形或恶意构造的 PDF 可能让 pypdf 长时间空转或占满内存。解析放在独立的子进程中进行，
+子进程启动后先给自己设置地址空间上限，父进程负责墙钟超时并在必要时直接杀掉子进程，
+不会拖住 Streamlit 服务进程里其他用户的请求。
+
+子进程通过 python -m utils.pdf_sandbox 启动，只依赖 pypdf 和 utils.sections，不会导入 Streamlit。
+（不用 multiprocessing 的 spawn：Streamlit 把页面脚本装成 __main__，spawn 的子进程会重新执行整个页面。）
+父子进程之间经由标准输入 / 输出传递 pickle 消息，不依赖 socketpair / pass_fds，Windows 上同样可用。
+"""
+import os
+import pickle
+import sys
+
+try:
+    import resource
+except ImportError:
+    # Windows 没有 resource 模块，只能依靠父进程的墙钟超时
+    resource = None
+
+from pypdf import PdfReader
+from pypdf.errors import FileNotDecryptedError
+
+from utils.sections import extract_page_with_headings
+
+# 解析失败的类型
+FAILURE_ENCRYPTED = "encrypted"
+FAILURE_SCANNED = "scanned"
+FAILURE_CORRUPT = "corrupt"
+FAILURE_TIMEOUT = "timeout"
+FAILURE_MEMORY = "memory"
+FAILURE_CRASHED = "crashed"
+
+# 这些失败发生时已解析的前几页仍然可用
+PARTIAL_FAILURES = frozenset({FAILURE_TIMEOUT, FAILURE_MEMORY, FAILURE_CRASHED})
+
+
+class PdfParseError(Exception):
+    """PDF 解析失败，kind 为失败类型"""
+
+    def __init__(self, kind, message=""):
+        super().__init__(message or kind)
+        self.kind = kind
+
+
+def _limit_memory(budget_bytes):
+    """把地址空间上限设为当前占用 + budget_bytes（Linux 上 RLIMIT_RSS 不生效，用 RLIMIT_AS 代替）"""
+    if budget_bytes <= 0 or resource is None:
+        return
+    try:
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        current = 0
+    limit = current + int(budget_bytes)
+    try:
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ValueError, OSError):
+        pass
+
+
+def _open_reader(path):
+    reader = PdfReader(path)
+    if reader.is_encrypted:
+        # 只有打开密码为空的加密文件（常见于只限制打印 / 复制的论文）可以直接解密
+        try:
+            decrypted = reader.decrypt("")
+        except Exception as e:
+            raise PdfParseError(FAILURE_ENCRYPTED, f"PDF 已加密：{e}")
+        if not decrypted:
+            raise PdfParseError(FAILURE_ENCRYPTED, "PDF 已加密")
+    return reader
+
+
+def run_worker(conn, path, memory_budget_bytes):
+    """沙箱子进程入口
+
+    协议：打开文件后发送 ("meta", 总页数)，然后反复等待父进程分配的页批次 (起始页, 结束页)，
+    逐页发送 ("page", 页下标, 文本, 标题行)，一批做完发送 ("idle",) 领取下一批；收到 None 时退出。
+    出错时发送 ("error", 失败类型, 说明)。单页提取出错时该页按空白页处理。
+    """
+    _limit_memory(memory_budget_bytes)
+    try:
+        reader = _open_reader(path)
+        conn.send(("meta", len(reader.pages)))
+        while True:
+            batch = conn.recv()
+            if batch is None:
+                break
+            for page_index in range(*batch):
+                try:
+                    page_text, headings = extract_page_with_headings(reader.pages[page_index])
+                except MemoryError:
+                    raise
+                except Exception:
+                    page_text, headings = "", []
+                conn.send(("page", page_index, page_text or "", headings))
+            conn.send(("idle",))
+    except MemoryError:
+        _send_error(conn, FAILURE_MEMORY, "解析占用的内存超出上限")
+    except PdfParseError as e:
+        _send_error(conn, e.kind, str(e))
+    except FileNotDecryptedError as e:
+        _send_error(conn, FAILURE_ENCRYPTED, str(e))
+    except Exception as e:
+        # PdfReadError 以及 pypdf 解析畸形结构时抛出的其他异常都视为文件损坏
+        _send_error(conn, FAILURE_CORRUPT, f"{type(e).__name__}: {e}")
+    finally:
+        conn.close()
+
+
+class StdioConnection:
+    """子进程一侧的消息通道：从标准输入读、向标准输出写 pickle 消息
+
+    协议使用原 stdout 的副本，原 stdout 改指向 stderr，pypdf 等库打印的内容不会混进消息流。
+    """
+
+    def __init__(self):
+        sys.stdout.flush()
+        self._out = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+        os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+        self._in = sys.stdin.buffer
+
+    def send(self, message):
+        pickle.dump(message, self._out)
+        self._out.flush()
+
+    def recv(self):
+        return pickle.load(self._in)
+
+    def close(self):
+        self._out.close()
+
+
+def _send_error(conn, kind, message):
+    try:
+        conn.send(("error", kind, message))
+    except Exception:
+        # 内存耗尽时可能连错误都发不出去，父进程会按子进程异常退出处理
+        pass
+
+
+if __name__ == "__main__":
+    # 参数：PDF 路径、内存预算（字节）
+    pdf_path, budget = sys.argv[1:3]
+    run_worker(StdioConnection(), pdf_path, int(budget))
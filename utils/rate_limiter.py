@@ -0,0 +1,162 @@
+import collections
+import hashlib
+import threading
+import time
+
+from utils.config import get_setting
+
+
+class TokenBucket:
+    """令牌桶：容量为每分钟配额，按秒匀速补充"""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = float(per_minute)
+        self._updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def seconds_until(self, amount):
+        """距离桶内令牌达到 amount 还需多少秒"""
+        deficit = min(amount, self.capacity) - self.level
+        return max(0.0, deficit / self.rate)
+
+    def take(self, amount):
+        self.level -= min(amount, self.capacity)
+
+    def give_back(self, amount):
+        self.level = min(self.capacity, self.level + amount)
+
+
+class _Ticket:
+    def __init__(self, session_id, tokens):
+        self.session_id = session_id
+        self.tokens = tokens
+
+
+class FairRateLimiter:
+    """同一个 API Key 共享的限流器
+
+    同时限制每分钟请求数和每分钟 token 数。等待中的请求按会话分队，
+    会话之间轮询放行，避免单个重度用户占满配额。
+    """
+
+    def __init__(self, rpm, tpm):
+        self._requests = TokenBucket(rpm)
+        self._tokens = TokenBucket(tpm)
+        self._cond = threading.Condition()
+        # 会话轮询顺序：{session_id: deque[_Ticket]}，队首会话优先
+        self._queues = collections.OrderedDict()
+
+    def _service_order(self):
+        """按轮询规则展开所有等待中的请求"""
+        order = []
+        queues = [list(q) for q in self._queues.values()]
+        depth = 0
+        while True:
+            round_tickets = [q[depth] for q in queues if len(q) > depth]
+            if not round_tickets:
+                return order
+            order.extend(round_tickets)
+            depth += 1
+
+    def _estimate_wait(self, ahead, ticket):
+        """估算排在 ticket 之前的请求全部放行后的等待时间"""
+        requests = len(ahead) + 1
+        tokens = sum(t.tokens for t in ahead) + ticket.tokens
+        return max(
+            (requests - self._requests.level) / self._requests.rate,
+            (tokens - self._tokens.level) / self._tokens.rate,
+            0.0
+        )
+
+    def acquire(self, session_id, tokens, on_wait=None):
+        """阻塞直到获得配额，返回排队耗时（秒）
+
+        on_wait(position, eta_seconds) 在排队期间周期性回调（不持有锁），用于展示排队位置。
+        """
+        start = time.monotonic()
+        ticket = _Ticket(session_id, tokens)
+
+        with self._cond:
+            self._queues.setdefault(session_id, collections.deque()).append(ticket)
+
+        try:
+            while True:
+                with self._cond:
+                    now = time.monotonic()
+                    self._requests.refill(now)
+                    self._tokens.refill(now)
+
+                    order = self._service_order()
+                    position = order.index(ticket)
+                    if position == 0:
+                        wait = max(self._requests.seconds_until(1), self._tokens.seconds_until(tokens))
+                        if wait == 0:
+                            self._requests.take(1)
+                            self._tokens.take(tokens)
+                            self._dequeue(ticket)
+                            self._cond.notify_all()
+                            return time.monotonic() - start
+                    eta = self._estimate_wait(order[:position], ticket)
+
+                if on_wait is not None:
+                    on_wait(position, eta)
+
+                with self._cond:
+                    self._cond.wait(timeout=min(max(eta, 0.05), 1.0))
+        except BaseException:
+            with self._cond:
+                self._dequeue(ticket)
+                self._cond.notify_all()
+            raise
+
+    def try_acquire(self, tokens):
+        """不排队的获取：没有请求在等待且配额立即可用时扣除配额并返回 True，否则返回 False"""
+        with self._cond:
+            now = time.monotonic()
+            self._requests.refill(now)
+            self._tokens.refill(now)
+            if self._queues or max(self._requests.seconds_until(1), self._tokens.seconds_until(tokens)) > 0:
+                return False
+            self._requests.take(1)
+            self._tokens.take(tokens)
+            return True
+
+    def _dequeue(self, ticket):
+        """移除 ticket；服务过的会话移到轮询队尾"""
+        queue = self._queues.get(ticket.session_id)
+        if queue is None or ticket not in queue:
+            return
+        queue.remove(ticket)
+        del self._queues[ticket.session_id]
+        if queue:
+            self._queues[ticket.session_id] = queue
+
+    def settle(self, reserved_tokens, actual_tokens):
+        """请求完成后按实际用量退还多预留的 token"""
+        if actual_tokens is None or actual_tokens >= reserved_tokens:
+            return
+        with self._cond:
+            self._tokens.refill(time.monotonic())
+            self._tokens.give_back(reserved_tokens - actual_tokens)
+            self._cond.notify_all()
+
+
+_limiters_lock = threading.Lock()
+_limiters = {}
+
+
+def get_rate_limiter(api_key):
+    """获取 API Key 对应的进程级限流器（以 Key 的哈希为索引，不在内存中保存明文映射）"""
+    key = hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+    with _limiters_lock:
+        if key not in _limiters:
+            _limiters[key] = FairRateLimiter(
+                rpm=get_setting("LLM_RATE_LIMIT_RPM", 60, int),
+                tpm=get_setting("LLM_RATE_LIMIT_TPM", 300000, int)
+            )
+        return _limiters[key]
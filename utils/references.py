@@ -0,0 +1,252 @@
+import collections
+import re
+
+from utils.tokenizer import truncate_to_tokens
+
+# 参考文献部分开头的标题行，以及跨页处的 "--- Page N ---" 标记
+_HEADING_RE = re.compile(r"^\s*(?:references|bibliography|literature cited|参考文献)\s*[:：]?\s*", re.IGNORECASE)
+_PAGE_MARKER_RE = re.compile(r"\s*--- Page \d+ ---\s*")
+
+# 条目编号：[12] 或行首式的 "12. "（条目之间只有空格，需按编号连续递增来确认）
+_BRACKET_LABEL_RE = re.compile(r"\[(\d{1,3})\]\s*")
+_DOTTED_LABEL_RE = re.compile(r"(?:(?<=\s)|^)(\d{1,3})\.\s+(?=\S)")
+# ACL / NeurIPS 格式在作者列表之后是单独成句的年份："Tom B. Brown, Benjamin Mann. 2020. Title. In …"
+_BARE_YEAR_RE = re.compile(r"(?<=\.\s)(?:1[89]|20)\d\d[a-z]?\.(?=\s|$)")
+# "Vaswani et al. 2017." 中 al 后不断句，年份会留在作者列表末尾
+_TRAILING_YEAR_RE = re.compile(r"\.\s+(?:1[89]|20)\d\d[a-z]?$")
+# 其他作者-年份格式没有编号时，在 "上一条结尾. " 之后出现 "Surname, X." 处切分
+_AUTHOR_START_RE = re.compile(r"(?<=[.)]\s)(?=[A-Z][A-Za-z'’\-]+,\s+(?:[A-Z]\.|[A-Z][a-z]+))")
+
+# Vancouver 格式的作者列表：姓氏 + 不带句点的缩写，如 "Devlin J, Chang MW, Lee K."
+# 至少两位作者或带 et al，单个 "Tom B." 无法与 "Tom B. Brown" 区分
+_VANCOUVER_AUTHORS_RE = re.compile(
+    r"^(?:[A-Z][\w'’\-]* [A-Z]{1,3}, )+(?:[A-Z][\w'’\-]* [A-Z]{1,3}|et al)\.\s+"
+)
+_YEAR_RE = re.compile(r"\b((?:1[89]|20)\d\d)[a-z]?\b")
+_QUOTED_TITLE_RE = re.compile(r"[“\"](.+?)[,.]?[”\"]")
+_PAREN_YEAR_RE = re.compile(r"\(((?:1[89]|20)\d\d)[a-z]?\)\.?\s*")
+# 出处后面的卷期、页码、年份，如 ", pp. 10-19"、", 12(3): 1-10"、", 2020"
+_VENUE_TAIL_RE = re.compile(r"[,;:]\s*(?:pp?\.|vol\.|no\.|\d).*$", re.IGNORECASE)
+# 中文文献的类型标识，如 [J]、[C]、[EB/OL]
+_TYPE_MARK_RE = re.compile(r"\s*\[[A-Z]{1,2}(?:/OL)?\]")
+
+# 句点前是作者名缩写（J / J.-P / J.K）或常见缩写时不是著录项的结尾
+_ABBREVIATION_RE = re.compile(r"(?:[A-Z]\.-?)*[A-Z]|al|[Ee]ds?|pp|[Vv]ol|[Nn]o")
+
+_AUTHOR_SPLIT_RE = re.compile(r",|;|&|、|，|\band\b")
+_SURNAME_RE = re.compile(r"[A-Za-z][A-Za-z'’\-]+|[一-鿿]{2,4}")
+_INITIALS_RE = re.compile(r"[A-Z]{1,3}")
+_QUESTION_NAME_RE = re.compile(r"\b[A-Z][A-Za-z'’\-]+")
+_NOT_SURNAMES = {"et", "al", "and", "jr", "eds", "ed"}
+
+MIN_ENTRY_CHARS = 15
+
+
+class Reference:
+    """一条参考文献：编号、作者、年份、标题、出处和原文"""
+
+    def __init__(self, label, authors, year, title, venue, raw):
+        self.label = label
+        self.authors = authors
+        self.year = year
+        self.title = title
+        self.venue = venue
+        self.raw = raw
+
+    def surnames(self):
+        """作者姓氏（小写），用于按作者查找"""
+        names = set()
+        for part in _AUTHOR_SPLIT_RE.split(self.authors):
+            words = [
+                word for word in _SURNAME_RE.findall(part)
+                if word.lower() not in _NOT_SURNAMES and not _INITIALS_RE.fullmatch(word)
+            ]
+            # 去掉名字缩写后取最后一个词："Smith MW" → Smith，"Tom B. Brown" → Brown
+            if words:
+                names.add(words[-1].lower())
+        return names
+
+    def format(self):
+        """紧凑的单行格式，用于提示词和显示"""
+        parts = [f"[{self.label}]" if self.label else "", self.authors]
+        if self.year:
+            parts.append(f"({self.year})")
+        head = " ".join(part for part in parts if part)
+        return ". ".join(part for part in (head, self.title, self.venue) if part)
+
+
+def _sequential_splits(text, pattern):
+    """按编号切分，只接受从 1 开始连续递增的编号（正文中的 [3] 或数字不会误切）"""
+    positions = []
+    expected = 1
+    for match in pattern.finditer(text):
+        if int(match.group(1)) == expected:
+            positions.append((match.start(), match.end(), match.group(1)))
+            expected += 1
+    if len(positions) < 2:
+        return None
+    entries = []
+    for i, (_, body_start, label) in enumerate(positions):
+        body_end = positions[i + 1][0] if i + 1 < len(positions) else len(text)
+        entries.append((label, text[body_start:body_end].strip()))
+    return entries
+
+
+def _sentence_starts(text):
+    """著录项（句子）的起始位置：". " 之后，且句点前不是作者名缩写（"J. "）或 "et al. "、"pp. " 等缩写"""
+    starts = [0]
+    for match in re.finditer(r"\.\s+", text):
+        words = text[starts[-1]:match.start()].split()
+        if words and _ABBREVIATION_RE.fullmatch(words[-1]):
+            continue
+        starts.append(match.end())
+    return starts
+
+
+def _bare_year_splits(text):
+    """ACL / NeurIPS 格式：条目从单独成句的年份的前一句（作者列表）开头算起"""
+    years = [match.start() for match in _BARE_YEAR_RE.finditer(text)]
+    if len(years) < 2:
+        return None
+    starts = _sentence_starts(text)
+    # "Brown et al. 2020." 中 al 之后不是句子起点，作者列表仍从 Brown 开始
+    entry_starts = sorted({0} | {max(start for start in starts if start < year) for year in years})
+    return [
+        ("", text[start:end].strip())
+        for start, end in zip(entry_starts, entry_starts[1:] + [len(text)])
+    ]
+
+
+def split_entries(text):
+    """把参考文献部分切成 [(编号, 条目原文)]，作者-年份格式的编号为空"""
+    text = _PAGE_MARKER_RE.sub(" ", _HEADING_RE.sub("", text)).strip()
+    entries = (
+        _sequential_splits(text, _BRACKET_LABEL_RE)
+        or _sequential_splits(text, _DOTTED_LABEL_RE)
+        or _bare_year_splits(text)
+    )
+    if entries is None:
+        entries = [("", entry.strip()) for entry in _AUTHOR_START_RE.split(text)]
+    return [(label, entry) for label, entry in entries if len(entry) >= MIN_ENTRY_CHARS]
+
+
+def _sentences(text):
+    """按 ". " 切分著录项，作者名缩写（"J. "）、"et al. "、"pp. " 之后的句点不切"""
+    starts = _sentence_starts(text)
+    parts = [text[start:end].strip().rstrip(".") for start, end in zip(starts, starts[1:] + [len(text)])]
+    return [part.strip() for part in parts if part.strip()]
+
+
+def _clean_venue(venue):
+    venue = re.sub(r"^(?:In:?|in:?)\s+", "", venue.strip())
+    return _VENUE_TAIL_RE.sub("", venue).strip(" ,.;")
+
+
+def parse_reference(label, raw):
+    """从条目原文中尽量识别作者、年份、标题和出处（识别不出的字段为空）"""
+    year_match = _YEAR_RE.search(raw)
+    year = int(year_match.group(1)) if year_match else None
+
+    quoted = _QUOTED_TITLE_RE.search(raw)
+    if quoted:
+        # IEEE 格式：A. Smith and B. Doe, "Title," Venue, 2020.
+        authors = raw[:quoted.start()].strip(" ,.")
+        title = quoted.group(1).strip()
+        venue = _clean_venue(raw[quoted.end():])
+        return Reference(label, authors, year, title, venue, raw)
+
+    paren_year = _PAREN_YEAR_RE.search(raw)
+    vancouver = _VANCOUVER_AUTHORS_RE.match(raw)
+    if paren_year:
+        # APA 格式：Smith, J., & Doe, A. (2020). Title. Venue, 12(3), 1-10.
+        authors = raw[:paren_year.start()].strip(" ,.")
+        rest = _sentences(raw[paren_year.end():])
+    elif vancouver:
+        # Vancouver 格式：Devlin J, Chang MW, Lee K. Title. Venue. 2019;1:4171-86.
+        authors = vancouver.group(0).strip(" .")
+        rest = _sentences(raw[vancouver.end():])
+    else:
+        # 其他格式：A. Smith and B. Doe. 2020. Title. In Venue. / 张三, 李四. 标题[J]. 期刊, 2020, 12(3): 1-10.
+        sentences = _sentences(raw)
+        authors = _TRAILING_YEAR_RE.sub("", sentences[0]) if sentences else ""
+        rest = sentences[1:]
+    # 单独成项的年份（"A. Smith. 2020. Title."）不是标题
+    rest = [part for part in rest if not _YEAR_RE.fullmatch(part)]
+    title = _TYPE_MARK_RE.sub("", rest[0]).strip() if rest else ""
+    venue = _clean_venue(rest[1]) if len(rest) > 1 else ""
+    return Reference(label, authors, year, title, venue, raw)
+
+
+def parse_references(text, sections):
+    """从论文全文中解析参考文献表，没有识别出参考文献部分时返回空列表"""
+    span = sections.get("references")
+    if span is None:
+        return []
+    return [parse_reference(label, raw) for label, raw in split_entries(text[span[0]:span[1]])]
+
+
+def format_reference_note(references, max_tokens):
+    """问到引用时随片段附上的参考文献条目（按 token 上限截断），没有条目时返回空字符串"""
+    if not references:
+        return ""
+    entries = "\n".join(reference.format() for reference in references)
+    entries = entries[:truncate_to_tokens(entries, max_tokens)]
+    return f"\n[论文参考文献表中的相关条目]\n{entries}\n"
+
+
+class ReferenceTable:
+    """一篇论文的参考文献表，按作者姓氏和年份建索引，支持本地快速查找"""
+
+    def __init__(self, references):
+        self.references = list(references)
+        self._by_author = collections.defaultdict(list)
+        self._by_year = collections.defaultdict(list)
+        self._by_label = {}
+        for reference in self.references:
+            for surname in reference.surnames():
+                self._by_author[surname].append(reference)
+            if reference.year:
+                self._by_year[reference.year].append(reference)
+            if reference.label:
+                self._by_label[reference.label] = reference
+
+    def __len__(self):
+        return len(self.references)
+
+    def lookup(self, author="", year=None):
+        """按作者（姓氏，不区分大小写；不是完整姓氏时按子串匹配）和 / 或年份查找"""
+        author = author.strip().lower()
+        if author:
+            candidates = self._by_author.get(author)
+            if candidates is None:
+                candidates = [reference for reference in self.references if author in reference.authors.lower()]
+        elif year:
+            candidates = self._by_year.get(year, [])
+        else:
+            candidates = self.references
+        return [reference for reference in candidates if not year or reference.year == year]
+
+    def search(self, query):
+        """解析 "Smith 2020"、"张三" 之类的查询：年份取其中的四位数字，其余词作为作者"""
+        years = [int(year) for year in _YEAR_RE.findall(query)]
+        words = [word for word in _YEAR_RE.sub(" ", query).replace(",", " ").split() if word]
+        year = years[0] if years else None
+        if not words:
+            return self.lookup(year=year) if year else list(self.references)
+
+        matched = []
+        for word in words:
+            for reference in self.lookup(word, year):
+                if reference not in matched:
+                    matched.append(reference)
+        return matched
+
+    def match_question(self, question):
+        """问题中提到的参考文献：编号（[12]）或出现在本表中的作者姓氏（可带年份）"""
+        matched = [self._by_label[label] for label in _BRACKET_LABEL_RE.findall(question) if label in self._by_label]
+        years = {int(year) for year in _YEAR_RE.findall(question)}
+        for name in _QUESTION_NAME_RE.findall(question):
+            for reference in self._by_author.get(name.lower(), ()):
+                if (not years or reference.year in years) and reference not in matched:
+                    matched.append(reference)
+        return matched
@@ -0,0 +1,325 @@
+import asyncio
+import collections
+import concurrent.futures
+import email.utils
+import random
+import threading
+import time
+
+import openai
+
+from utils.config import get_setting
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态时直接拒绝请求"""
+
+    def __init__(self, base_url, retry_in):
+        self.base_url = base_url
+        self.retry_in = retry_in
+        super().__init__(f"上游服务 {base_url} 暂时不可用，已暂停请求，约 {retry_in:.0f} 秒后自动恢复")
+
+
+# 上游健康计数器：{base_url: Counter}
+_health_lock = threading.Lock()
+_health = collections.defaultdict(collections.Counter)
+
+
+def record_event(base_url, event, n=1):
+    """记录上游事件计数（requests / successes / failures / retries / rejected / hedges 等）"""
+    with _health_lock:
+        _health[base_url][event] += n
+
+
+def get_upstream_health():
+    """导出各上游的计数器和熔断器状态"""
+    with _health_lock:
+        snapshot = {base_url: dict(counter) for base_url, counter in _health.items()}
+    with _breakers_lock:
+        for base_url, breaker in _breakers.items():
+            snapshot.setdefault(base_url, {})["circuit_state"] = breaker.state
+    return snapshot
+
+
+def format_upstream_health(base_url):
+    """格式化单个上游的健康状况，用于侧边栏展示"""
+    stats = get_upstream_health().get(base_url.rstrip("/"), {})
+    state = {"open": "⛔ 熔断中", "half_open": "🟡 恢复探测中"}.get(stats.get("circuit_state"), "🟢 正常")
+    return f"{state} · 请求 {stats.get('requests', 0)} / 失败 {stats.get('failures', 0)} / 重试 {stats.get('retries', 0)}"
+
+
+class CircuitBreaker:
+    """按 base_url 隔离的熔断器
+
+    连续失败达到阈值后打开，冷却期内直接拒绝；冷却结束后进入半开状态，
+    只放行一个探测请求，成功则关闭，失败则重新打开。探测请求得到 429、400 等
+    非服务端故障的响应时说明上游已恢复，同样关闭；被取消或中断时释放探测名额，由下一个请求重新探测。
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, base_url, failure_threshold, reset_timeout):
+        self.base_url = base_url
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """请求前检查，熔断时抛出 CircuitOpenError；返回本次请求是否为半开状态下的探测请求"""
+        with self._lock:
+            if self.state == self.OPEN:
+                elapsed = time.monotonic() - self._opened_at
+                if elapsed < self.reset_timeout:
+                    record_event(self.base_url, "rejected")
+                    raise CircuitOpenError(self.base_url, self.reset_timeout - elapsed)
+                self.state = self.HALF_OPEN
+                self._probing = False
+
+            if self.state == self.HALF_OPEN:
+                if self._probing:
+                    record_event(self.base_url, "rejected")
+                    raise CircuitOpenError(self.base_url, self.reset_timeout)
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_other(self):
+        """请求失败但不是上游故障（如 429、400）：上游有响应，半开状态下视为已恢复"""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.CLOSED
+                self._failures = 0
+            self._probing = False
+
+    def release_probe(self):
+        """探测请求被取消或中断、没有结果时释放探测名额"""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    record_event(self.base_url, "circuit_opened")
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+
+_breakers_lock = threading.Lock()
+_breakers = {}
+
+
+def get_circuit_breaker(base_url):
+    """获取 base_url 对应的进程级熔断器"""
+    with _breakers_lock:
+        if base_url not in _breakers:
+            _breakers[base_url] = CircuitBreaker(
+                base_url,
+                failure_threshold=get_setting("LLM_CIRCUIT_FAILURE_THRESHOLD", 5, int),
+                reset_timeout=get_setting("LLM_CIRCUIT_RESET_SECONDS", 30.0, float)
+            )
+        return _breakers[base_url]
+
+
+def is_retryable(error):
+    """429、5xx、连接错误和超时可以重试；其余错误（如 401、400）直接失败"""
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError, openai.RateLimitError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code >= 500
+    return False
+
+
+def is_upstream_failure(error):
+    """是否计入熔断：只统计服务端故障，429 属于配额问题，不代表上游不可用"""
+    return is_retryable(error) and not isinstance(error, openai.RateLimitError)
+
+
+def retry_after_seconds(error):
+    """解析响应头中的 Retry-After / retry-after-ms，没有时返回 None"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+
+    headers = response.headers
+    value = headers.get("retry-after-ms")
+    if value is not None:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        try:
+            retry_at = email.utils.parsedate_to_datetime(value)
+            return max(0.0, retry_at.timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+class RetryPolicy:
+    """带抖动的指数退避策略"""
+
+    def __init__(self, max_attempts, base_delay, max_delay):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt, error):
+        """第 attempt 次失败后的等待时间；服务端给出 Retry-After 时优先遵守"""
+        retry_after = retry_after_seconds(error)
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        # full jitter：在 [0, base * 2^attempt] 内均匀随机
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+def get_retry_policy():
+    """默认重试策略（可通过环境变量或 st.secrets 调整）"""
+    return RetryPolicy(
+        max_attempts=get_setting("LLM_RETRY_ATTEMPTS", 4, int),
+        base_delay=get_setting("LLM_RETRY_BASE_DELAY", 0.5, float),
+        max_delay=get_setting("LLM_RETRY_MAX_DELAY", 20.0, float)
+    )
+
+
+def _record_outcome(breaker, error):
+    if error is None:
+        breaker.record_success()
+        record_event(breaker.base_url, "successes")
+        return
+    record_event(breaker.base_url, "failures")
+    if is_upstream_failure(error):
+        breaker.record_failure()
+    else:
+        breaker.record_other()
+
+
+def call_with_retry(fn, base_url, policy=None):
+    """同步调用 fn()，失败时按策略退避重试，并经过熔断器"""
+    policy = policy or get_retry_policy()
+    breaker = get_circuit_breaker(base_url)
+
+    for attempt in range(policy.max_attempts):
+        probing = breaker.before_call()
+        record_event(base_url, "requests")
+        try:
+            result = fn()
+        except Exception as e:
+            _record_outcome(breaker, e)
+            if not is_retryable(e) or attempt == policy.max_attempts - 1:
+                raise
+            record_event(base_url, "retries")
+            time.sleep(policy.delay(attempt, e))
+        except BaseException:
+            # 被取消（CancelledError）或中断时没有结果，探测名额必须释放，否则熔断器会一直停在半开状态
+            if probing:
+                breaker.release_probe()
+            raise
+        else:
+            _record_outcome(breaker, None)
+            return result
+
+
+async def acall_with_retry(fn, base_url, policy=None):
+    """call_with_retry 的异步版本，fn 返回协程"""
+    policy = policy or get_retry_policy()
+    breaker = get_circuit_breaker(base_url)
+
+    for attempt in range(policy.max_attempts):
+        probing = breaker.before_call()
+        record_event(base_url, "requests")
+        try:
+            result = await fn()
+        except Exception as e:
+            _record_outcome(breaker, e)
+            if not is_retryable(e) or attempt == policy.max_attempts - 1:
+                raise
+            record_event(base_url, "retries")
+            await asyncio.sleep(policy.delay(attempt, e))
+        except BaseException:
+            # 被取消（CancelledError）或中断时没有结果，探测名额必须释放，否则熔断器会一直停在半开状态
+            if probing:
+                breaker.release_probe()
+            raise
+        else:
+            _record_outcome(breaker, None)
+            return result
+
+
+_hedge_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=get_setting("LLM_HEDGE_WORKERS", 32, int),
+    thread_name_prefix="llm-hedge"
+)
+
+
+def hedged_call(fn, base_url, hedge_after, on_discard=None, reserve=None, refund=None):
+    """对冲请求：fn() 在 hedge_after 秒内未返回时，再发起一个相同的请求，取先成功者
+
+    落败请求的结果交给 on_discard 释放（例如关闭流式连接）。两个请求都失败时抛出后一个异常。
+    对冲请求同样占用配额：reserve() 在发起前为它预留配额，拿不到时不对冲，继续等待原请求；
+    对冲请求失败时调用 refund() 退还。熔断器不是关闭状态时也不对冲——半开状态只放行一个探测请求，
+    对冲请求必然被拒绝。
+    """
+    primary = _hedge_executor.submit(fn)
+    try:
+        return primary.result(timeout=hedge_after)
+    except concurrent.futures.TimeoutError:
+        pass
+
+    if get_circuit_breaker(base_url).state != CircuitBreaker.CLOSED or (reserve is not None and not reserve()):
+        record_event(base_url, "hedges_skipped")
+        return primary.result()
+
+    record_event(base_url, "hedges")
+    backup = _hedge_executor.submit(fn)
+    if refund is not None:
+        backup.add_done_callback(lambda f: refund() if not f.cancelled() and f.exception() is not None else None)
+    pending = {primary, backup}
+    winner = None
+    error = None
+
+    while pending and winner is None:
+        done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is not None:
+                error = future.exception()
+            elif winner is None:
+                winner = future
+            elif on_discard is not None:
+                on_discard(future.result())
+
+    if winner is None:
+        raise error
+
+    if winner is backup:
+        record_event(base_url, "hedge_wins")
+    for loser in pending:
+        loser.add_done_callback(lambda f: _discard(f, on_discard))
+    return winner.result()
+
+
+def _discard(future, on_discard):
+    """释放对冲中落败请求的结果"""
+    if on_discard is not None and not future.cancelled() and future.exception() is None:
+        on_discard(future.result())
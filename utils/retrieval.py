@@ -0,0 +1,135 @@
+import collections
+import heapq
+import math
+import re
+
+import streamlit as st
+
+from utils.config import get_setting
+from utils.page_map import PageMap, format_page_range
+
+# 检索用的词元：英文单词 / 数字，以及中文字符二元组
+_WORD_RE = re.compile(r"[a-z0-9]+(?:[-'][a-z0-9]+)*")
+_CJK_RE = re.compile(r"[一-鿿]+")
+
+# 常见虚词，不参与打分
+STOPWORDS = frozenset("""
+a an and are as at be by for from has have in is it its of on or that the this to was were which with
+we our their these those can not also than then there such been into more most other
+""".split())
+
+
+def tokenize_for_search(text):
+    """把文本切成检索词元：英文小写单词，中文按二元组"""
+    lowered = text.lower()
+    terms = [w for w in _WORD_RE.findall(lowered) if w not in STOPWORDS and len(w) > 1]
+    for run in _CJK_RE.findall(lowered):
+        if len(run) == 1:
+            terms.append(run)
+        else:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
+
+
+class Chunk:
+    """文档片段：text 位于原文 [start, end)，pages 为覆盖的页码范围（从 1 开始）"""
+
+    def __init__(self, chunk_id, text, start, end, pages=None):
+        self.chunk_id = chunk_id
+        self.text = text
+        self.start = start
+        self.end = end
+        self.pages = pages
+
+    def page_label(self):
+        if not self.pages:
+            return ""
+        return format_page_range(*self.pages)
+
+
+def chunk_document(text, page_offsets=None, chunk_chars=None, overlap_chars=None):
+    """把全文切成相互重叠的片段，切分点尽量落在句末或空白处"""
+    chunk_chars = chunk_chars or get_setting("PDF_CHUNK_CHARS", 1500, int)
+    overlap_chars = overlap_chars or get_setting("PDF_CHUNK_OVERLAP_CHARS", 300, int)
+    page_map = PageMap(page_offsets, len(text)) if page_offsets else None
+
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(len(text), start + chunk_chars)
+        if end < len(text):
+            # 在片段末尾 1/5 的范围内找句末，其次找空白
+            window_start = end - chunk_chars // 5
+            cut = max(text.rfind(". ", window_start, end), text.rfind("。", window_start, end))
+            if cut < 0:
+                cut = text.rfind(" ", window_start, end)
+            if cut > start:
+                end = cut + 1
+
+        pages = page_map.pages_between(start, end) if page_map is not None else None
+        chunks.append(Chunk(len(chunks), text[start:end].strip(), start, end, pages))
+
+        if end >= len(text):
+            break
+        start = max(start + 1, end - overlap_chars)
+    return chunks
+
+
+class BM25Index:
+    """片段级 BM25 倒排索引（内存中）"""
+
+    def __init__(self, chunks, k1=1.5, b=0.75):
+        self.chunks = chunks
+        self.k1 = k1
+        self.b = b
+        self.postings = collections.defaultdict(list)
+
+        lengths = []
+        for chunk in chunks:
+            terms = tokenize_for_search(chunk.text)
+            lengths.append(len(terms))
+            for term, tf in collections.Counter(terms).items():
+                self.postings[term].append((chunk.chunk_id, tf))
+
+        self.lengths = lengths
+        self.avg_length = sum(lengths) / len(lengths) if lengths else 0.0
+        n = len(chunks)
+        self.idf = {
+            term: math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+            for term, posting in self.postings.items()
+        }
+
+    def search(self, query, k=5):
+        """返回与问题最相关的 k 个片段 [(片段, 分数)]，按分数从高到低"""
+        scores = collections.defaultdict(float)
+        for term in set(tokenize_for_search(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for chunk_id, tf in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[chunk_id] / self.avg_length)
+                scores[chunk_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+        top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(self.chunks[chunk_id], score) for chunk_id, score in top]
+
+
+@st.cache_resource(max_entries=32, show_spinner=False)
+def get_chunk_index(pdf_hash, text_length, _text, _page_offsets):
+    """获取论文的片段索引，按 (内容哈希, 已解析长度) 在进程内共享
+
+    后台解析进行中时文本会变长，长度变化后重新建索引。
+    """
+    return BM25Index(chunk_document(_text, _page_offsets))
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """倒数排名融合：合并多路检索的排名 [[片段标识, ...], ...]，返回融合后的片段标识
+
+    片段标识可以是片段序号，也可以是跨论文检索时的 (内容哈希, 片段序号)。
+    """
+    scores = collections.defaultdict(float)
+    for ranking in rankings:
+        for rank, key in enumerate(ranking):
+            scores[key] += 1.0 / (k + rank + 1)
+    return sorted(scores, key=lambda key: -scores[key])
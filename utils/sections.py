@@ -0,0 +1,271 @@
+import bisect
+import collections
+import math
+import re
+
+from utils.page_map import PageMap
+
+# 规范化的章节名 → 标题别名（英文小写 / 中文），按顺序匹配
+SECTION_ALIASES = {
+    "abstract": ("abstract", "摘要"),
+    "introduction": ("introduction", "background", "related work", "related works", "prior work", "引言", "绪论", "前言", "研究背景", "相关工作"),
+    "methods": ("materials and methods", "methods", "method", "methodology", "approach", "proposed method", "experimental setup", "研究方法", "材料与方法", "实验方法", "方法"),
+    "results": ("results and discussion", "results", "experiments", "experimental results", "evaluation", "findings", "实验结果", "结果", "实验"),
+    "discussion": ("discussion", "conclusion", "conclusions", "limitations", "future work", "讨论", "结论", "总结与展望", "结语"),
+    "references": ("references", "bibliography", "literature cited", "参考文献"),
+}
+
+SECTION_LABELS = {
+    "abstract": "摘要",
+    "introduction": "引言",
+    "methods": "方法",
+    "results": "结果",
+    "discussion": "讨论与结论",
+    "references": "参考文献",
+}
+
+# 问题中的关键词 → 应优先检索的章节
+QUESTION_HINTS = {
+    "abstract": ("contribution", "summary", "overview", "贡献", "概述", "主要内容"),
+    "introduction": ("motivation", "background", "related work", "prior work", "gap", "动机", "背景", "相关工作", "研究空白", "现有研究"),
+    "methods": ("method", "approach", "architecture", "algorithm", "dataset", "implementation", "setup", "方法", "模型结构", "算法", "数据集", "实现", "如何做", "怎么做"),
+    "results": ("result", "performance", "accuracy", "experiment", "evaluation", "benchmark", "baseline", "outperform", "结果", "性能", "实验", "效果", "指标", "对比"),
+    "discussion": ("limitation", "conclusion", "future", "discuss", "implication", "局限", "结论", "不足", "展望", "讨论", "意义"),
+    "references": ("reference", "citation", "cite", "bibliography", "参考文献", "引用", "引文"),
+}
+
+# 标题前的编号：1 / 1. / IV. / 一、；带小数点的二级编号（3.1）单独识别
+_NUMBER_RE = re.compile(r"^(?:(\d{1,2}(?:\.\d{1,2})+)|\d{1,2}|[IVX]{1,4}|[一二三四五六七八九十]{1,3})(?:[.、:)]\s*|\s+)")
+
+# 没有字号信息时，在全文中按编号 / 大写 / 固定格式查找英文章节标题
+_ENGLISH_ALIASES = sorted(
+    {alias for aliases in SECTION_ALIASES.values() for alias in aliases if alias.isascii()},
+    key=len, reverse=True
+)
+_TEXT_HEADING_RE = re.compile(
+    r"(?:(?<=\s)|^)(?:(?P<num>\d{1,2}|[IVX]{1,4})\.?\s+)?(?P<title>"
+    + "|".join(re.escape(alias).replace(r"\ ", r"\s+") for alias in _ENGLISH_ALIASES)
+    + r")(?=\s*:?\s+[A-Z\[\d(]|\s*$)",
+    re.IGNORECASE
+)
+_CJK_HEADING_RE = re.compile(
+    r"(?:(?<=\s)|^)(?:(?:\d{1,2}|[一二三四五六七八九十]{1,3})[.、]?\s*)?(?P<title>摘\s*要|参考文献|引\s*言|绪\s*论|结\s*论|讨\s*论)(?=\s*[:：]|\s)"
+)
+
+# 字号比正文大 15% 以上，或与正文等大但为粗体的短行视为标题
+HEADING_SIZE_RATIO = 1.15
+HEADING_MAX_CHARS = 80
+
+
+def classify_heading(heading):
+    """识别标题对应的章节：返回 (章节名或 None, 是否为二级标题)"""
+    match = _NUMBER_RE.match(heading)
+    if match and match.group(1):
+        return None, True
+    title = heading[match.end():] if match else heading
+    title = " ".join(title.lower().replace("&", "and").split()).strip(" :：.")
+    title = title.replace(" ", "") if not title.isascii() else title
+
+    for name, aliases in SECTION_ALIASES.items():
+        for alias in aliases:
+            if title == alias or title.startswith(alias + " "):
+                return name, False
+    return None, False
+
+
+def find_headings(runs):
+    """从 pypdf visitor 收集的文字片段 [(文本, 字号, 是否粗体)] 中找出可能的标题行"""
+    weights = collections.Counter()
+    for text, size, _ in runs:
+        weights[size] += len(text.strip())
+    if not weights:
+        return []
+    body_size = weights.most_common(1)[0][0]
+
+    # 相邻的同样式片段属于同一行（pypdf 会把一行拆成多个片段）
+    lines = []
+    for text, size, bold in runs:
+        if lines and lines[-1][1] == size and lines[-1][2] == bold and "\n" not in lines[-1][0]:
+            lines[-1][0] += text
+        else:
+            lines.append([text, size, bold])
+
+    headings = []
+    for text, size, bold in lines:
+        text = " ".join(text.split())
+        if not 2 <= len(text) <= HEADING_MAX_CHARS or text[-1] in ".,;，。；":
+            continue
+        if size >= body_size * HEADING_SIZE_RATIO or (bold and size >= body_size):
+            headings.append(text)
+    return headings
+
+
+def extract_page_with_headings(page):
+    """提取单页文本，并借助 visitor 回调的字号和字体找出本页的标题行"""
+    runs = []
+
+    def visit(text, cm, tm, font_dict, font_size):
+        if not text.strip():
+            return
+        scale = math.hypot(tm[2], tm[3]) * math.hypot(cm[2], cm[3]) or 1.0
+        base_font = str(font_dict.get("/BaseFont", "")) if font_dict else ""
+        bold = any(mark in base_font.lower() for mark in ("bold", "black", "heavy"))
+        runs.append((text, round(font_size * scale, 1), bold))
+
+    text = page.extract_text(visitor_text=visit)
+    return text, find_headings(runs)
+
+
+class PaperSections:
+    """论文章节索引：spans 为按位置排序的 [(章节名, 起始字符位置, 结束字符位置)]"""
+
+    def __init__(self, spans=()):
+        self.spans = [tuple(span) for span in spans]
+        self._starts = [start for _, start, _ in self.spans]
+
+    def __bool__(self):
+        return bool(self.spans)
+
+    def names(self):
+        return [name for name, _, _ in self.spans]
+
+    def get(self, name):
+        """章节的 (起始, 结束) 字符位置，未识别时返回 None"""
+        for span_name, start, end in self.spans:
+            if span_name == name:
+                return start, end
+        return None
+
+    def section_at(self, position):
+        """字符位置所在的章节名，不在任何已识别章节内时返回 None"""
+        i = bisect.bisect_right(self._starts, position) - 1
+        if i >= 0 and position < self.spans[i][2]:
+            return self.spans[i][0]
+        return None
+
+    def describe(self):
+        """章节概览，如 "摘要 · 引言 · 方法 · 参考文献" """
+        return " · ".join(SECTION_LABELS.get(name, name) for name in self.names())
+
+    def to_list(self):
+        return [list(span) for span in self.spans]
+
+
+def _locate_headings(text, page_offsets, page_headings):
+    """在全文中定位各页的标题行，返回 [(位置, 标题)]"""
+    page_map = PageMap(page_offsets, len(text))
+    located = []
+    for page_index, headings in enumerate(page_headings):
+        if page_index >= len(page_map):
+            break
+        cursor, page_end = page_map.page_span(page_index + 1)
+        for heading in headings:
+            position = text.find(heading, cursor, page_end)
+            if position >= 0:
+                located.append((position, heading))
+                cursor = position + len(heading)
+    return located
+
+
+def _scan_text_headings(text):
+    """没有字号信息时，按编号、全大写或固定写法在全文中查找章节标题，返回 [(位置, 标题)]"""
+    located = []
+    for match in _TEXT_HEADING_RE.finditer(text):
+        title = match.group("title")
+        numbered = match.group("num") is not None
+        # 正文中的 "results show ..." 之类不算标题：要求带编号、全大写，或是摘要 / 参考文献
+        if (numbered and title[0].isupper()) or title.isupper() or title in ("Abstract", "References", "Bibliography"):
+            located.append((match.start(), match.group(0)))
+    for match in _CJK_HEADING_RE.finditer(text):
+        located.append((match.start(), match.group(0)))
+    return sorted(located)
+
+
+def detect_sections(text, page_offsets, page_headings=None):
+    """识别论文的章节位置，返回 PaperSections
+
+    page_headings 为解析时按字号找到的各页标题行；没有时退回纯文本规则。
+    同名章节连续出现时合并（如 Introduction 之后的 Related Work）；
+    参考文献取最后一次出现，其余章节取第一次出现。
+    引言和结果之间未能识别的一级标题（如 "3 Our Model"）视为方法部分。
+    """
+    located = _locate_headings(text, page_offsets, page_headings) if page_headings else []
+    if not any(classify_heading(heading)[0] for _, heading in located):
+        located = _scan_text_headings(text)
+
+    headings = []
+    for position, heading in located:
+        name, is_subheading = classify_heading(heading)
+        if not is_subheading:
+            headings.append((position, name))
+    if not headings:
+        return PaperSections()
+
+    # 合并连续的同名标题，每段到下一个不同章节的标题为止
+    runs = []
+    for position, name in headings:
+        if runs and runs[-1][0] == name:
+            continue
+        if runs:
+            runs[-1][2] = position
+        runs.append([name, position, len(text)])
+
+    names = [name for name, _, _ in runs]
+    if "methods" not in names and "introduction" in names:
+        first = names.index("introduction") + 1
+        last = names.index("results") if "results" in names[first:] else len(runs)
+        for run in runs[first:last]:
+            if run[0] is None:
+                run[0] = "methods"
+
+    chosen = {}
+    for name, start, end in runs:
+        if name is None:
+            continue
+        if name not in chosen or name == "references":
+            chosen[name] = (start, end)
+        elif chosen[name][1] == start:
+            # 方法部分的多个一级标题相邻时合并
+            chosen[name] = (chosen[name][0], end)
+    return PaperSections(sorted(((name, start, end) for name, (start, end) in chosen.items()), key=lambda span: span[1]))
+
+
+def sections_for_question(question):
+    """根据问题中的关键词判断应优先检索的章节"""
+    lowered = question.lower()
+    return {
+        name for name, hints in QUESTION_HINTS.items()
+        if any(hint in lowered for hint in hints)
+    }
+
+
+def remove_sections(text, page_offsets, sections, names):
+    """从全文中去掉指定章节，返回 (文本, 各页起始字符位置)，页码位置随之平移"""
+    removed = sorted((start, end) for name, start, end in sections.spans if name in names)
+    if not removed:
+        return text, page_offsets
+
+    parts = []
+    cursor = 0
+    for start, end in removed:
+        parts.append(text[cursor:start])
+        cursor = max(cursor, end)
+    parts.append(text[cursor:])
+
+    def shift(offset):
+        delta = 0
+        for start, end in removed:
+            if offset >= end:
+                delta += end - start
+            elif offset > start:
+                delta += offset - start
+        return offset - delta
+
+    return "".join(parts), [shift(offset) for offset in page_offsets]
+
+
+def get_paper_sections(parsed):
+    """论文的章节索引；旧版本缓存中没有章节信息时按纯文本规则补算"""
+    if parsed.sections is not None:
+        return PaperSections(parsed.sections)
+    return detect_sections(parsed.text, parsed.page_offsets)
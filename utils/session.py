@@ -0,0 +1,11 @@
+import threading
+
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+
+def get_session_id():
+    """当前 Streamlit 会话 ID；不在脚本线程中时退化为线程标识"""
+    ctx = get_script_run_ctx()
+    if ctx is not None:
+        return ctx.session_id
+    return f"thread-{threading.get_ident()}"
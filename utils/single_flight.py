@@ -0,0 +1,82 @@
+import threading
+
+
+class Flight:
+    """一次进行中的上游请求
+
+    生产者逐个发布 chunk，订阅者先回放已有 chunk，再继续接收新的 chunk；
+    请求结束后所有订阅者拿到相同的结果或相同的异常。
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.usage = None
+        self._cond = threading.Condition()
+
+    def publish(self, chunk):
+        with self._cond:
+            self.chunks.append(chunk)
+            self._cond.notify_all()
+
+    def finish(self, error=None, usage=None):
+        with self._cond:
+            self.done = True
+            self.error = error
+            self.usage = usage
+            self._cond.notify_all()
+
+    def subscribe(self):
+        """逐个产出 chunk，直到请求结束；请求失败时抛出原异常"""
+        index = 0
+        while True:
+            with self._cond:
+                while index >= len(self.chunks) and not self.done:
+                    self._cond.wait()
+                new_chunks = self.chunks[index:]
+                finished = self.done
+            index += len(new_chunks)
+
+            yield from new_chunks
+
+            if finished and index >= len(self.chunks):
+                if self.error is not None:
+                    raise self.error
+                return
+
+
+class SingleFlight:
+    """按请求指纹合并进程内相同的进行中请求"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def join_or_lead(self, key):
+        """返回 (flight, is_leader)；is_leader 为 True 时调用方负责发起上游请求"""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                return flight, False
+            flight = Flight()
+            self._flights[key] = flight
+            return flight, True
+
+    def forget(self, key, flight):
+        """请求结束后移除登记，之后的相同请求改由缓存或新请求处理"""
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._flights)
+
+
+_single_flight = SingleFlight()
+
+
+def get_single_flight():
+    """获取进程级的请求合并器"""
+    return _single_flight
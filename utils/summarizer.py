@@ -0,0 +1,197 @@
+import hashlib
+import os
+
+import streamlit as st
+
+from utils.completion_cache import CompletionCache
+from utils.config import get_cache_dir, get_setting
+from utils.llm import async_chat_completion
+from utils.page_map import PageMap, format_page_range
+from utils.tokenizer import estimate_tokens, truncate_to_tokens
+
+# 分块摘要 / 合并提示词版本（修改提示词后递增，使旧的分块摘要失效）
+MAP_PROMPT_VERSION = "v1"
+
+MAP_SYSTEM_PROMPT = "你是一个专业的学术文献分析师，负责为长篇论文的一部分撰写要点笔记，供之后汇总成全文总结。"
+
+MAP_INSTRUCTION = """以下是一篇学术论文的一部分（{pages}）：
+
+{text}
+
+请用中文列出这部分的要点笔记，只记录原文中出现的信息：
+- 研究背景、现有不足或作者要解决的问题
+- 方法、实验设计、数据和分析手段
+- 结果、数据支持的结论和局限性
+没有涉及的方面直接略过，不要编造。笔记尽量简洁，保留关键数字和术语。"""
+
+COMBINE_INSTRUCTION = """以下是同一篇论文相邻部分的要点笔记（按页码顺序）：
+
+{notes}
+
+请把它们合并成一份更紧凑的要点笔记，保留研究问题、方法和结论相关的关键信息、数字和页码范围，去掉重复内容。"""
+
+
+class Section:
+    """待摘要的论文片段：text 覆盖第 first_page 到 last_page 页"""
+
+    def __init__(self, text, first_page, last_page):
+        self.text = text
+        self.first_page = first_page
+        self.last_page = last_page
+
+    def label(self):
+        return format_page_range(self.first_page, self.last_page)
+
+
+def split_by_pages(text, page_offsets, max_tokens):
+    """按整页把全文切成不超过 max_tokens 的片段；单页超长时再按 token 截成多段"""
+    page_map = PageMap(page_offsets or [0], len(text))
+    sections = []
+    current, current_tokens, first_page = [], 0, 1
+
+    for page_number, page_text in page_map.iter_pages(text):
+        page_tokens = estimate_tokens(page_text)
+
+        if current and current_tokens + page_tokens > max_tokens:
+            sections.append(Section("".join(current), first_page, page_number - 1))
+            current, current_tokens = [], 0
+
+        if page_tokens > max_tokens:
+            while page_text:
+                cut = truncate_to_tokens(page_text, max_tokens) or len(page_text)
+                sections.append(Section(page_text[:cut], page_number, page_number))
+                page_text = page_text[cut:]
+            continue
+
+        if not current:
+            first_page = page_number
+        current.append(page_text)
+        current_tokens += page_tokens
+
+    if current:
+        sections.append(Section("".join(current), first_page, len(page_map)))
+    return sections
+
+
+def _map_key(section_text, model):
+    """分块摘要的缓存键；model 为 None 时表示“任意模型”"""
+    payload = f"{MAP_PROMPT_VERSION}\0{model or '*'}\0{section_text}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+@st.cache_resource(show_spinner=False)
+def get_map_cache():
+    """获取进程级共享的分块摘要缓存
+
+    与补全缓存不同，键只取决于片段内容和提示词版本：换模型重新总结时，
+    优先复用同一模型的结果，其次复用任意模型的结果，只有全新片段才需要重新调用。
+    """
+    return CompletionCache(
+        os.path.join(get_cache_dir(), "map_summaries.sqlite3"),
+        max_bytes=get_setting("MAP_CACHE_MAX_MB", 64, float) * 1024 * 1024,
+        ttl_seconds=get_setting("MAP_CACHE_TTL_HOURS", 24 * 30, float) * 3600
+    )
+
+
+def _lookup_map_note(cache, section, model):
+    note = cache.get(_map_key(section.text, model))
+    if note is None:
+        note = cache.get(_map_key(section.text, None))
+    return note
+
+
+def map_sections(runner, api_key, base_url, model, sections, max_tokens, on_progress=None):
+    """并发为每个片段生成要点笔记（map 阶段），返回 (笔记列表, 复用缓存的片段数)
+
+    并发上限由 AsyncRunner（LLM_MAX_CONCURRENCY）统一控制；
+    失败的片段对应位置为异常对象，由调用方决定如何处理。
+    """
+    cache = get_map_cache()
+    notes = [_lookup_map_note(cache, section, model) for section in sections]
+    reused = sum(1 for note in notes if note is not None)
+    pending = [i for i, note in enumerate(notes) if note is None]
+    done = reused
+    if on_progress is not None:
+        on_progress(done, len(sections))
+
+    coros = [
+        async_chat_completion(
+            runner, api_key, base_url, model,
+            messages=[
+                {"role": "system", "content": MAP_SYSTEM_PROMPT},
+                {"role": "user", "content": MAP_INSTRUCTION.format(pages=sections[i].label(), text=sections[i].text)}
+            ],
+            max_tokens=max_tokens,
+            temperature=0.2,
+            prompt_version=MAP_PROMPT_VERSION,
+            labels={"page": "pdf_reader", "mode": "summary_map"}
+        )
+        for i in pending
+    ]
+
+    def on_done(index, result):
+        nonlocal done
+        done += 1
+        if on_progress is not None:
+            on_progress(done, len(sections))
+
+    results = runner.gather(coros, on_done=on_done)
+    for i, result in zip(pending, results):
+        notes[i] = result
+        if isinstance(result, str) and result:
+            cache.set(_map_key(sections[i].text, model), result, model=model)
+            cache.set(_map_key(sections[i].text, None), result, model=model)
+    return notes, reused
+
+
+def label_notes(sections, notes):
+    """给各片段的笔记加上页码标签，跳过失败的片段"""
+    return [
+        f"[{section.label()}]\n{note}"
+        for section, note in zip(sections, notes)
+        if isinstance(note, str)
+    ]
+
+
+def combine_notes(runner, api_key, base_url, model, labeled_notes, budget_tokens, max_tokens):
+    """笔记总量超出预算时分组合并（可多轮），直到能放进一次 reduce 调用"""
+    total_tokens = estimate_tokens("\n\n".join(labeled_notes))
+    while total_tokens > budget_tokens and len(labeled_notes) > 1:
+        groups, current, current_tokens = [], [], 0
+        for note in labeled_notes:
+            note_tokens = estimate_tokens(note)
+            if current and current_tokens + note_tokens > budget_tokens // 2:
+                groups.append(current)
+                current, current_tokens = [], 0
+            current.append(note)
+            current_tokens += note_tokens
+        groups.append(current)
+        if len(groups) == len(labeled_notes):
+            # 每组只有一条笔记，继续合并也无法缩小，交给调用方截断
+            break
+
+        coros = [
+            async_chat_completion(
+                runner, api_key, base_url, model,
+                messages=[
+                    {"role": "system", "content": MAP_SYSTEM_PROMPT},
+                    {"role": "user", "content": COMBINE_INSTRUCTION.format(notes="\n\n".join(group))}
+                ],
+                max_tokens=max_tokens,
+                temperature=0.2,
+                prompt_version=MAP_PROMPT_VERSION,
+                labels={"page": "pdf_reader", "mode": "summary_combine"}
+            )
+            for group in groups
+        ]
+        results = runner.gather(coros)
+        labeled_notes = [
+            result if isinstance(result, str) else "\n\n".join(group)
+            for group, result in zip(groups, results)
+        ]
+
+        previous_tokens, total_tokens = total_tokens, estimate_tokens("\n\n".join(labeled_notes))
+        if total_tokens >= previous_tokens:
+            # 合并调用失败或没有变短，停止以免死循环
+            break
+    return labeled_notes
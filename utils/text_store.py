@@ -0,0 +1,122 @@
+import collections
+import sys
+import threading
+import time
+
+import streamlit as st
+
+from utils.config import get_setting
+from utils.paper_library import get_paper_library
+from utils.pdf_cache import get_parsed_pdf_cache
+from utils.sections import get_paper_sections
+
+
+class TextStore:
+    """进程级共享的论文文本，按内容哈希保存解析结果
+
+    各会话的 session_state 只保存内容哈希，多个会话打开同一篇论文时共用一份文本。
+    内存中按总字节数做 LRU 淘汰；被淘汰的论文再次访问时依次从 loaders
+    （磁盘上的解析缓存、文献库）重新读取。同时记录各会话正在查看的论文，用于内存报告。
+    """
+
+    def __init__(self, max_bytes, loaders=(), session_ttl_seconds=3600):
+        self.max_bytes = max_bytes
+        self.session_ttl_seconds = session_ttl_seconds
+        self.hits = 0
+        self.misses = 0
+
+        self._loaders = loaders
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        # 论文大小在淘汰后仍保留，内存报告据此估算各会话各存一份时的占用
+        self._sizes = {}
+        # {会话 ID: (内容哈希, 最近访问时间)}
+        self._sessions = {}
+
+    @staticmethod
+    def _size(parsed):
+        """解析结果在内存中的大致字节数（CPython 字符串按实际编码宽度计算）"""
+        return sys.getsizeof(parsed.text) + sys.getsizeof(parsed.page_offsets) + 28 * len(parsed.page_offsets)
+
+    def put(self, parsed):
+        """保存解析结果（缺少章节信息时补算），返回内容哈希"""
+        if parsed.sections is None:
+            parsed.sections = get_paper_sections(parsed).to_list()
+        size = self._size(parsed)
+        with self._lock:
+            old = self._entries.pop(parsed.sha256, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[parsed.sha256] = (parsed, size)
+            self._sizes[parsed.sha256] = size
+            self._bytes += size
+            self._evict()
+        return parsed.sha256
+
+    def _evict(self):
+        """按最近访问顺序淘汰，最新的一条总是保留"""
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, (_, size) = self._entries.popitem(last=False)
+            self._bytes -= size
+
+    def get(self, sha256):
+        """读取解析结果；内存中没有时从磁盘重新读取，都没有时返回 None"""
+        with self._lock:
+            entry = self._entries.get(sha256)
+            if entry is not None:
+                self._entries.move_to_end(sha256)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        for loader in self._loaders:
+            parsed = loader(sha256)
+            if parsed is not None:
+                self.put(parsed)
+                return parsed
+        return None
+
+    def touch(self, session_id, sha256):
+        """记录会话正在查看的论文（sha256 为空表示没有打开论文）"""
+        now = time.time()
+        with self._lock:
+            if sha256:
+                self._sessions[session_id] = (sha256, now)
+            else:
+                self._sessions.pop(session_id, None)
+            # 会话结束时没有回调，超过时限未访问的会话视为已结束
+            for stale in [sid for sid, (_, seen) in self._sessions.items() if now - seen > self.session_ttl_seconds]:
+                del self._sessions[stale]
+
+    def memory_report(self):
+        """内存报告：共享存储的实际占用，以及与每个会话各存一份相比节省的字节数"""
+        now = time.time()
+        with self._lock:
+            viewing = [
+                sha256 for sha256, seen in self._sessions.values()
+                if now - seen <= self.session_ttl_seconds
+            ]
+            per_session_bytes = sum(self._sizes.get(sha256, 0) for sha256 in viewing)
+            shared_bytes = sum(self._sizes.get(sha256, 0) for sha256 in set(viewing))
+            return {
+                "papers": len(self._entries),
+                "resident_bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "sessions": len(viewing),
+                "viewed_papers": len(set(viewing)),
+                "per_session_bytes": per_session_bytes,
+                "shared_bytes": shared_bytes,
+                "saved_bytes": per_session_bytes - shared_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+@st.cache_resource(show_spinner=False)
+def get_text_store():
+    """获取进程级共享的论文文本存储"""
+    return TextStore(
+        max_bytes=get_setting("TEXT_STORE_MAX_MB", 256, float) * 1024 * 1024,
+        loaders=(get_parsed_pdf_cache().get, get_paper_library().load)
+    )
@@ -0,0 +1,62 @@
+import collections
+import hashlib
+import threading
+
+from utils.config import get_setting
+from utils.tokenizer import estimate_tokens
+
+# 各模型的上下文窗口（token），可通过 LLM_CONTEXT_WINDOW_<模型名> 覆盖，
+# 例如 LLM_CONTEXT_WINDOW_DEEPSEEK_CHAT=131072
+MODEL_CONTEXT_WINDOWS = {
+    "deepseek-chat": 65536,
+    "deepseek-reasoner": 65536
+}
+DEFAULT_CONTEXT_WINDOW = 32768
+
+# 估算误差的安全余量
+SAFETY_MARGIN_TOKENS = 512
+
+
+def get_context_window(model):
+    """获取模型的上下文窗口大小"""
+    setting_name = "LLM_CONTEXT_WINDOW_" + model.upper().replace("-", "_").replace(".", "_")
+    return get_setting(setting_name, MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW), int)
+
+
+class BudgetPlan:
+    """文档预算规划结果：文档 token 数、可用预算，以及能否完整放入上下文"""
+
+    def __init__(self, document_tokens, available_tokens):
+        self.document_tokens = document_tokens
+        self.available_tokens = available_tokens
+        self.fits = document_tokens <= available_tokens
+
+
+# 规划结果按 (文档哈希, 参数) 缓存，不持有文档本身
+_plans_lock = threading.Lock()
+_plans = collections.OrderedDict()
+_PLANS_SIZE = 256
+
+
+def plan_document_budget(model, document, prompt_tokens=0, reserved_output=2000):
+    """规划长文档能否放入模型上下文
+
+    可用预算 = 上下文窗口 - 固定提示词 - 预留输出 - 安全余量。
+    放不下时由调用方决定如何处理（分段汇总、检索片段等）。
+    """
+    digest = hashlib.sha1(document.encode("utf-8")).hexdigest()
+    key = (digest, model, prompt_tokens, reserved_output)
+    with _plans_lock:
+        if key in _plans:
+            _plans.move_to_end(key)
+            return _plans[key]
+
+    window = get_context_window(model)
+    available = max(0, window - prompt_tokens - reserved_output - SAFETY_MARGIN_TOKENS)
+    plan = BudgetPlan(estimate_tokens(document), available)
+
+    with _plans_lock:
+        _plans[key] = plan
+        while len(_plans) > _PLANS_SIZE:
+            _plans.popitem(last=False)
+    return plan
@@ -0,0 +1,78 @@
+import collections
+import hashlib
+import math
+import re
+import threading
+
+# 离线 token 估算：先按 BPE 的预分词规则把文本切成片段，再按片段类型估算 token 数。
+# 系数参考 DeepSeek 官方说明（1 个中文字符约 0.6 token，1 个英文字符约 0.3 token），
+# 英文单词按约 4 个字符 1 个 token 计，数字按 3 位一个 token 计。
+_PIECE_RE = re.compile(
+    r"(?P<cjk>[　-〿㐀-䶿一-鿿豈-﫿＀-￯])"
+    r"|(?P<word>[A-Za-z]+)"
+    r"|(?P<digits>\d+)"
+    r"|(?P<space>\s+)"
+    r"|(?P<other>.)",
+    re.DOTALL
+)
+
+# 长文本按内容哈希缓存计数结果
+_CACHE_MIN_CHARS = 2000
+_cache_lock = threading.Lock()
+_cache = collections.OrderedDict()
+_CACHE_SIZE = 512
+
+
+def _count(text):
+    cjk = 0
+    tokens = 0
+    for match in _PIECE_RE.finditer(text):
+        kind = match.lastgroup
+        if kind == "cjk":
+            cjk += 1
+        elif kind == "word":
+            tokens += max(1, math.ceil(len(match.group()) / 4))
+        elif kind == "digits":
+            tokens += math.ceil(len(match.group()) / 3)
+        elif kind == "other":
+            tokens += 1
+    return tokens + math.ceil(cjk * 0.6)
+
+
+def estimate_tokens(text):
+    """离线估算文本的 token 数（长文本按内容哈希缓存）"""
+    if not text:
+        return 0
+    if len(text) < _CACHE_MIN_CHARS:
+        return _count(text)
+
+    digest = hashlib.sha1(text.encode("utf-8")).hexdigest()
+    with _cache_lock:
+        if digest in _cache:
+            _cache.move_to_end(digest)
+            return _cache[digest]
+
+    tokens = _count(text)
+    with _cache_lock:
+        _cache[digest] = tokens
+        while len(_cache) > _CACHE_SIZE:
+            _cache.popitem(last=False)
+    return tokens
+
+
+def estimate_messages_tokens(messages):
+    """估算一组 chat messages 的输入 token 数（每条消息额外计入少量格式开销）"""
+    return sum(estimate_tokens(message["content"]) + 4 for message in messages)
+
+
+def truncate_to_tokens(text, max_tokens):
+    """按 token 预算截取文本前缀，返回截取后的字符数"""
+    total = estimate_tokens(text)
+    if total <= max_tokens:
+        return len(text)
+
+    # 先按比例估计截断位置，再逐步回退直到满足预算
+    cut = int(len(text) * max_tokens / total)
+    while cut > 0 and _count(text[:cut]) > max_tokens:
+        cut = int(cut * 0.95)
+    return cut
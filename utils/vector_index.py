@@ -0,0 +1,170 @@
+import heapq
+import json
+import os
+import re
+import tempfile
+import threading
+import zlib
+
+import numpy as np
+import streamlit as st
+
+from utils.config import get_cache_dir, get_setting
+from utils.retrieval import tokenize_for_search
+
+# 向量算法版本（修改特征或权重后递增，使旧的向量文件失效）
+EMBEDDING_VERSION = "v1"
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def _features(text):
+    """文本的 n-gram 特征：检索词元、相邻词二元组，以及英文单词的字符三元组（容忍词形变化）"""
+    terms = tokenize_for_search(text)
+    features = list(terms)
+    features.extend(f"{a} {b}" for a, b in zip(terms, terms[1:]))
+    for word in _WORD_RE.findall(text.lower()):
+        if len(word) > 3:
+            padded = f"#{word}#"
+            features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+    return features
+
+
+def embed_texts(texts, dim):
+    """哈希 n-gram 向量：特征经 CRC32 映射到 dim 维并带符号，tf 取对数后做 L2 归一化
+
+    不依赖外部模型或服务；同一文本在任何进程中得到相同的向量，可以持久化。
+    """
+    rows, cols, signs = [], [], []
+    for row, text in enumerate(texts):
+        for feature in _features(text):
+            h = zlib.crc32(feature.encode("utf-8"))
+            rows.append(row)
+            cols.append(h % dim)
+            signs.append(1.0 if h & 0x80000000 else -1.0)
+
+    flat = np.bincount(
+        np.asarray(rows, dtype=np.int64) * dim + np.asarray(cols, dtype=np.int64),
+        weights=np.asarray(signs, dtype=np.float32),
+        minlength=len(texts) * dim
+    ).reshape(len(texts), dim)
+    vectors = (np.sign(flat) * np.log1p(np.abs(flat))).astype(np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class VectorStore:
+    """按论文内容哈希存放片段向量的本地向量库
+
+    每篇论文一个 float16 的 .npy 文件，检索时以内存映射方式打开，
+    不会把整个文献库读入内存；查询按批做矩阵乘法，逐篇合并 top-k。
+    """
+
+    def __init__(self, root, dim):
+        self.root = root
+        self.dim = dim
+        # 同一篇论文的写入串行化：多个会话同时打开同一篇论文时不会互相覆盖临时文件
+        self._locks_lock = threading.Lock()
+        self._locks = {}
+
+    def _lock(self, pdf_hash):
+        with self._locks_lock:
+            return self._locks.setdefault(pdf_hash, threading.Lock())
+
+    def _temp_path(self, target):
+        """在库目录中创建唯一的临时文件（多线程、多进程写入互不冲突），替换到 target 前先写入这里"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix=os.path.basename(target) + ".", suffix=".tmp")
+        os.close(fd)
+        return tmp_path
+
+    def _path(self, pdf_hash):
+        return os.path.join(self.root, f"{pdf_hash}.{EMBEDDING_VERSION}.d{self.dim}.npy")
+
+    def _meta_path(self, pdf_hash):
+        return os.path.join(self.root, f"{pdf_hash}.{EMBEDDING_VERSION}.json")
+
+    def has(self, pdf_hash, chunk_count=None):
+        """是否已有该论文的向量（给定 chunk_count 时还要求片段数一致）"""
+        if not os.path.exists(self._path(pdf_hash)):
+            return False
+        if chunk_count is None:
+            return True
+        try:
+            with open(self._meta_path(pdf_hash), encoding="utf-8") as f:
+                return len(json.load(f)["chunks"]) == chunk_count
+        except (OSError, ValueError, KeyError):
+            return False
+
+    def add(self, pdf_hash, chunks):
+        """计算并写入论文各片段的向量（先写临时文件再原子替换）"""
+        with self._lock(pdf_hash):
+            self._write(pdf_hash, chunks)
+
+    def _write(self, pdf_hash, chunks):
+        vectors = embed_texts([chunk.text for chunk in chunks], self.dim)
+        meta = {"chunks": [[chunk.start, chunk.end, chunk.pages] for chunk in chunks]}
+        vectors_tmp = self._temp_path(self._path(pdf_hash))
+        meta_tmp = self._temp_path(self._meta_path(pdf_hash))
+        try:
+            array = np.lib.format.open_memmap(vectors_tmp, mode="w+", dtype=np.float16, shape=vectors.shape)
+            array[:] = vectors
+            array.flush()
+            del array
+            with open(meta_tmp, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            # 先替换向量再替换片段信息：has() 以片段信息判断是否最新，两者都就位后才会返回 True
+            os.replace(vectors_tmp, self._path(pdf_hash))
+            os.replace(meta_tmp, self._meta_path(pdf_hash))
+        finally:
+            for tmp_path in (vectors_tmp, meta_tmp):
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    def ensure(self, pdf_hash, chunks):
+        """论文向量不存在或片段已变化时重新计算（加锁后再检查，并发调用只计算一次）"""
+        with self._lock(pdf_hash):
+            if not self.has(pdf_hash, len(chunks)):
+                self._write(pdf_hash, chunks)
+
+    def load(self, pdf_hash):
+        """以只读内存映射方式打开论文的向量矩阵"""
+        return np.load(self._path(pdf_hash), mmap_mode="r")
+
+    def pdf_hashes(self):
+        """库中所有论文的内容哈希"""
+        suffix = f".{EMBEDDING_VERSION}.d{self.dim}.npy"
+        return [name[:-len(suffix)] for name in os.listdir(self.root) if name.endswith(suffix)]
+
+    def search(self, queries, k=5, pdf_hashes=None, batch_rows=65536):
+        """批量检索：返回每个问题的 [(相似度, 内容哈希, 片段序号)]，按相似度从高到低
+
+        pdf_hashes 为空时检索整个库；每次只映射一篇论文的一个行块到内存。
+        """
+        query_vectors = embed_texts(queries, self.dim).T
+        heaps = [[] for _ in queries]
+
+        for pdf_hash in (pdf_hashes if pdf_hashes is not None else self.pdf_hashes()):
+            try:
+                matrix = self.load(pdf_hash)
+            except (OSError, ValueError):
+                continue
+
+            for offset in range(0, matrix.shape[0], batch_rows):
+                scores = np.asarray(matrix[offset:offset + batch_rows], dtype=np.float32) @ query_vectors
+                take = min(k, scores.shape[0])
+                top = np.argpartition(-scores, take - 1, axis=0)[:take]
+                for q, heap in enumerate(heaps):
+                    for row in top[:, q]:
+                        item = (float(scores[row, q]), pdf_hash, int(offset + row))
+                        if len(heap) < k:
+                            heapq.heappush(heap, item)
+                        elif item[0] > heap[0][0]:
+                            heapq.heapreplace(heap, item)
+
+        return [sorted(heap, reverse=True) for heap in heaps]
+
+
+@st.cache_resource(show_spinner=False)
+def get_vector_store():
+    """获取进程级共享的本地向量库"""
+    return VectorStore(get_cache_dir("vectors"), dim=get_setting("VECTOR_DIM", 512, int))